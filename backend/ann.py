@@ -0,0 +1,177 @@
+"""
+Tìm láng giềng gần đúng (ANN) cho vector đã chuẩn hóa, thuần NumPy.
+
+IVF (inverted file): k-means chia vector thành nlist cụm; truy vấn chỉ quét
+nprobe cụm có tâm gần nhất thay vì cả ma trận. Vector gốc được build_embeddings.py
+sắp theo cụm (mỗi cụm là một dải hàng liền nhau trong store mmap); vector thêm
+sau khi build nằm ở danh sách phụ của cụm gần nhất.
+"""
+from typing import Dict, List
+
+import numpy as np
+
+
+def merge_top_k(scores: np.ndarray, ids: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Giữ k cột điểm cao nhất của mỗi hàng (chưa sắp xếp)."""
+    if scores.shape[1] <= k:
+        return scores, ids
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, part, axis=1), np.take_along_axis(ids, part, axis=1)
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 16384) -> np.ndarray:
+    """Cụm gần nhất (cosine) của từng vector."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        labels[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iters: int = 10,
+                    sample: int = 64, seed: int = 0) -> np.ndarray:
+    """Spherical k-means trên tối đa `sample` vector mỗi cụm."""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    pick = rng.choice(n, size=min(n, nlist * sample), replace=False)
+    data = np.asarray(vectors[np.sort(pick)], dtype=np.float32)
+    centroids = data[rng.choice(len(data), size=nlist, replace=False)].copy()
+
+    for _ in range(iters):
+        labels = assign(data, centroids)
+        counts = np.bincount(labels, minlength=nlist)
+        # tổng theo cụm: sắp theo nhãn rồi cộng từng dải (nhanh hơn np.add.at)
+        order = np.argsort(labels, kind="stable")
+        sums = np.zeros_like(centroids)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        sums[filled] = np.add.reduceat(data[order], starts, axis=0)
+        # cụm rỗng: lấy lại một điểm ngẫu nhiên
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+def build_ivf(ids: np.ndarray, vectors: np.ndarray, nlist: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    -> order (hoán vị để sắp ids/vectors theo cụm), centroids, offsets
+    (cụm c là các hàng offsets[c]:offsets[c + 1] sau khi sắp).
+    """
+    nlist = max(1, min(nlist, len(ids)))
+    centroids = train_centroids(vectors, nlist, seed=seed)
+    labels = assign(vectors, centroids)
+    order = np.argsort(labels, kind="stable")
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(labels, minlength=nlist), out=offsets[1:])
+    return {"order": order, "centroids": centroids, "offsets": offsets}
+
+
+class IVFIndex:
+    """
+    vectors / ids / live là mảng của store (đã sắp theo cụm) do DenseIndex giữ:
+    live[i] = False khi hàng i bị xóa hoặc đã có bản mới ở danh sách phụ.
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, vectors: np.ndarray,
+                 ids: np.ndarray, live: np.ndarray, nprobe: int):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.offsets = offsets
+        self.vectors = vectors
+        self.ids = ids
+        self.live = live
+        self.nprobe = nprobe
+
+        # cụm -> {doc id: vector} thêm sau khi build; doc id -> cụm
+        self._extra: Dict[int, Dict[int, np.ndarray]] = {}
+        self._extra_list: Dict[int, int] = {}
+        self._extra_arrays: Dict[int, tuple[np.ndarray, np.ndarray]] = {}
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def added(self) -> int:
+        """Số vector thêm sau khi build (chưa nằm trong store)."""
+        return len(self._extra_list)
+
+    # ---------- delta ----------
+
+    def add(self, doc_id: int, vector: np.ndarray):
+        self.discard(doc_id)
+        cluster = int(np.argmax(self.centroids @ vector))
+        self._extra.setdefault(cluster, {})[doc_id] = vector
+        self._extra_list[doc_id] = cluster
+        self._extra_arrays.pop(cluster, None)
+
+    def discard(self, doc_id: int):
+        cluster = self._extra_list.pop(doc_id, None)
+        if cluster is not None:
+            del self._extra[cluster][doc_id]
+            self._extra_arrays.pop(cluster, None)
+
+    def _extra_of(self, cluster: int) -> tuple[np.ndarray, np.ndarray] | None:
+        vectors = self._extra.get(cluster)
+        if not vectors:
+            return None
+        arrays = self._extra_arrays.get(cluster)
+        if arrays is None:
+            arrays = self._extra_arrays[cluster] = (
+                np.fromiter(vectors.keys(), dtype=np.int64, count=len(vectors)),
+                np.stack(list(vectors.values())),
+            )
+        return arrays
+
+    # ---------- query ----------
+
+    def search(self, queries: np.ndarray, k: int, nprobe: int | None = None) -> List[List[tuple[float, int]]]:
+        queries = np.asarray(queries, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        coarse = queries @ self.centroids.T
+        if nprobe < self.nlist:
+            probe = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probe = np.broadcast_to(np.arange(self.nlist), coarse.shape)
+
+        # gom theo cụm: mỗi cụm một phép nhân cho mọi câu hỏi cần quét nó
+        by_cluster: Dict[int, List[int]] = {}
+        for qi, clusters in enumerate(probe):
+            for c in clusters:
+                by_cluster.setdefault(int(c), []).append(qi)
+
+        found_scores: List[List[np.ndarray]] = [[] for _ in range(len(queries))]
+        found_ids: List[List[np.ndarray]] = [[] for _ in range(len(queries))]
+
+        def collect(qs: List[int], scores: np.ndarray, ids: np.ndarray):
+            scores, ids = merge_top_k(scores, np.broadcast_to(ids, scores.shape), k)
+            for row, qi in enumerate(qs):
+                found_scores[qi].append(scores[row])
+                found_ids[qi].append(ids[row])
+
+        for c, qs in by_cluster.items():
+            qv = queries[qs]
+            start, end = int(self.offsets[c]), int(self.offsets[c + 1])
+            if end > start:
+                mask = self.live[start:end]
+                if mask.any():
+                    scores = qv @ np.asarray(self.vectors[start:end], dtype=np.float32).T
+                    if not mask.all():
+                        scores[:, ~mask] = -np.inf
+                    collect(qs, scores, self.ids[start:end])
+            extra = self._extra_of(c)
+            if extra is not None:
+                collect(qs, qv @ extra[1].T, extra[0])
+
+        results = []
+        for scores, ids in zip(found_scores, found_ids):
+            if not scores:
+                results.append([])
+                continue
+            scores = np.concatenate(scores)
+            ids = np.concatenate(ids)
+            top = np.argsort(-scores, kind="stable")[:k]
+            results.append([(float(scores[i]), int(ids[i])) for i in top if np.isfinite(scores[i])])
+        return results
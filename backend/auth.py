@@ -1,12 +1,19 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
 from datetime import datetime, timedelta
 from typing import Optional
+import threading
+import time
 import jwt as pyjwt
-from passlib.context import CryptContext
+from sqlalchemy import func
 
-from db import User, get_session
+import config
+from cache import TTLCache
+from db import User, UserChange, get_session
+from metrics import stage
+from passwords import PasswordPool, PasswordPoolBusy, make_context
 
 # ================= JWT CONFIG =================
 SECRET_KEY = "your-secret-key-change-in-production"
@@ -17,7 +24,15 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 # ================= PASSWORD =================
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = make_context(config.PASSWORD_BCRYPT_ROUNDS)
+
+# endpoint dùng pool (process riêng); hash_password / verify_password chạy
+# inline, chỉ dành cho script (init_data.py...)
+password_pool = PasswordPool(
+    workers=config.PASSWORD_WORKERS,
+    max_pending=config.PASSWORD_MAX_PENDING,
+    rounds=config.PASSWORD_BCRYPT_ROUNDS,
+)
 
 
 def hash_password(password: str) -> str:
@@ -28,6 +43,24 @@ def verify_password(password: str, hashed: str) -> bool:
     return pwd_context.verify(password, hashed)
 
 
+def _busy() -> HTTPException:
+    return HTTPException(503, "Hệ thống đang bận, vui lòng thử lại", headers={"Retry-After": "1"})
+
+
+async def hash_password_async(password: str) -> str:
+    try:
+        return await password_pool.hash(password)
+    except PasswordPoolBusy:
+        raise _busy()
+
+
+async def verify_password_async(password: str, hashed: str) -> tuple[bool, str | None]:
+    try:
+        return await password_pool.verify_and_update(password, hashed)
+    except PasswordPoolBusy:
+        raise _busy()
+
+
 # ================= MODELS =================
 class UserRegister(BaseModel):
     username: str
@@ -61,45 +94,157 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return pyjwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+# token đã kiểm tra chữ ký -> payload; hết hạn cùng lúc với exp của token
+token_cache = TTLCache(config.AUTH_TOKEN_CACHE_SIZE, config.AUTH_TOKEN_CACHE_TTL)
+
+
 def verify_token(token: str):
+    with stage("jwt_decode"):
+        payload = token_cache.get(token)
+        if payload is not None:
+            return payload
+
+        try:
+            payload = pyjwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except pyjwt.ExpiredSignatureError:
+            raise HTTPException(401, "Token đã hết hạn")
+        except pyjwt.InvalidTokenError:
+            raise HTTPException(401, "Token không hợp lệ")
+
+        exp = payload.get("exp")
+        token_cache.set(token, payload, exp - time.time() if exp else None)
+        return payload
+
+
+# ================= USER CACHE =================
+class CachedUser:
+    """Phần thông tin user dùng ở mỗi request, tách khỏi session ORM."""
+
+    __slots__ = ("id", "username", "email", "created_at", "is_admin", "is_active")
+
+    def __init__(self, id, username, email, created_at, is_admin, is_active):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.created_at = created_at
+        self.is_admin = is_admin
+        self.is_active = is_active
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "username": self.username,
+            "is_admin": self.is_admin,
+            "is_active": self.is_active
+        }
+
+
+USER_COLUMNS = (User.id, User.username, User.email, User.created_at, User.is_admin, User.is_active)
+
+user_cache = TTLCache(config.AUTH_USER_CACHE_SIZE, config.AUTH_USER_CACHE_TTL)
+
+_user_change_lock = threading.Lock()
+_user_change_watermark: int | None = None
+_next_user_change_poll = 0.0
+
+
+def user_changes_due() -> bool:
+    return time.monotonic() >= _next_user_change_poll
+
+
+def poll_user_changes():
+    """Bỏ cache các user bị sửa/xóa (kể cả bởi worker khác) kể từ lần đọc trước."""
+    global _user_change_watermark, _next_user_change_poll
+
+    if not _user_change_lock.acquire(blocking=False):
+        return
     try:
-        return pyjwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except pyjwt.ExpiredSignatureError:
-        raise HTTPException(401, "Token đã hết hạn")
-    except pyjwt.JWTError:
-        raise HTTPException(401, "Token không hợp lệ")
+        _next_user_change_poll = time.monotonic() + config.AUTH_USER_CHANGE_POLL_SECONDS
+        with get_session() as db:
+            if _user_change_watermark is None:
+                # lần đầu: cache còn rỗng, chỉ cần mốc bắt đầu
+                _user_change_watermark = db.query(func.max(UserChange.id)).scalar() or 0
+                return
+            rows = (
+                db.query(UserChange.id, UserChange.username)
+                .filter(UserChange.id > _user_change_watermark)
+                .order_by(UserChange.id)
+                .all()
+            )
+        for change_id, username in rows:
+            user_cache.pop(username)
+            _user_change_watermark = change_id
+    finally:
+        _user_change_lock.release()
+
+
+def record_user_change(db, username: str):
+    # gọi trong cùng transaction với thay đổi; sau commit gọi forget_user
+    db.add(UserChange(username=username))
+
+
+def forget_user(username: str):
+    user_cache.pop(username)
+
+
+def get_user(username: str) -> CachedUser | None:
+    with stage("user_lookup"):
+        if user_changes_due():
+            poll_user_changes()
+
+        user = user_cache.get(username)
+        if user is None:
+            with get_session() as db:
+                row = db.query(*USER_COLUMNS).filter(User.username == username).first()
+            if not row:
+                return None
+            user = CachedUser(*row)
+            user_cache.set(username, user)
+        return user
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> CachedUser:
     payload = verify_token(token)
     username = payload.get("sub")
 
     if not username:
         raise HTTPException(401)
 
-    with get_session() as db:
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            raise HTTPException(401)
-        if not user.is_active:
-            raise HTTPException(403, "Tài khoản đã bị khóa")
-        return user
+    user = get_user(username)
+    if not user:
+        raise HTTPException(401)
+    if not user.is_active:
+        raise HTTPException(403, "Tài khoản đã bị khóa")
+    return user
 
 
 # ================= ROUTES =================
-@router.post("/register", response_model=UserOut)
-def register(data: UserRegister):
+def _register_conflict(db, data: UserRegister) -> str | None:
+    if db.query(User.id).filter(User.username == data.username).first():
+        return "Username đã tồn tại"
+    if db.query(User.id).filter(User.email == data.email).first():
+        return "Email đã tồn tại"
+    return None
+
+
+def _check_register(data: UserRegister):
     with get_session() as db:
-        if db.query(User).filter(User.username == data.username).first():
-            raise HTTPException(400, "Username đã tồn tại")
+        conflict = _register_conflict(db, data)
+    if conflict:
+        raise HTTPException(400, conflict)
+
 
-        if db.query(User).filter(User.email == data.email).first():
-            raise HTTPException(400, "Email đã tồn tại")
+def _create_user(data: UserRegister, hashed: str) -> UserOut:
+    with get_session() as db:
+        # kiểm tra lại: trong lúc băm mật khẩu có thể đã có request khác đăng ký
+        conflict = _register_conflict(db, data)
+        if conflict:
+            raise HTTPException(400, conflict)
 
         user = User(
             username=data.username,
             email=data.email,
-            hashed_password=hash_password(data.password),
+            hashed_password=hashed,
             is_active=True,
             is_admin=False,
         )
@@ -116,33 +261,64 @@ def register(data: UserRegister):
         )
 
 
-@router.post("/login", response_model=Token)
-def login(form: OAuth2PasswordRequestForm = Depends()):
-    with get_session() as db:
-        user = db.query(User).filter(User.username == form.username).first()
+@router.post("/register", response_model=UserOut)
+async def register(data: UserRegister):
+    # bcrypt chạy trong password_pool; phần DB trên threadpool
+    await run_in_threadpool(_check_register, data)
+    hashed = await hash_password_async(data.password)
+    return await run_in_threadpool(_create_user, data, hashed)
 
-        if not user or not verify_password(form.password, user.hashed_password):
-            raise HTTPException(401, "Sai tài khoản hoặc mật khẩu")
 
-        if not user.is_active:
-            raise HTTPException(403, "Tài khoản đã bị khóa")
+def _login_row(username: str):
+    with get_session() as db:
+        return (
+            db.query(*USER_COLUMNS, User.hashed_password)
+            .filter(User.username == username)
+            .first()
+        )
 
-        token = create_access_token({"sub": user.username})
 
-        return Token(
-            access_token=token,
-            token_type="bearer",
-            user=UserOut(
-                id=user.id,
-                username=user.username,
-                email=user.email,
-                created_at=user.created_at.isoformat(),
-            ),
+def _store_rehash(user_id: int, hashed: str):
+    with get_session() as db:
+        db.query(User).filter(User.id == user_id).update(
+            {User.hashed_password: hashed}, synchronize_session=False
         )
 
 
+@router.post("/login", response_model=Token)
+async def login(form: OAuth2PasswordRequestForm = Depends()):
+    row = await run_in_threadpool(_login_row, form.username)
+    if not row:
+        raise HTTPException(401, "Sai tài khoản hoặc mật khẩu")
+
+    user = CachedUser(*row[:-1])
+    ok, new_hash = await verify_password_async(form.password, row[-1])
+    if not ok:
+        raise HTTPException(401, "Sai tài khoản hoặc mật khẩu")
+
+    if new_hash:
+        # PASSWORD_BCRYPT_ROUNDS đã đổi: lưu hash theo cost mới
+        await run_in_threadpool(_store_rehash, user.id, new_hash)
+
+    if not user.is_active:
+        raise HTTPException(403, "Tài khoản đã bị khóa")
+
+    token = create_access_token({"sub": user.username})
+
+    return Token(
+        access_token=token,
+        token_type="bearer",
+        user=UserOut(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            created_at=user.created_at.isoformat(),
+        ),
+    )
+
+
 @router.get("/me", response_model=UserOut)
-async def me(user: User = Depends(get_current_user)):
+async def me(user: CachedUser = Depends(get_current_user)):
     return UserOut(
         id=user.id,
         username=user.username,
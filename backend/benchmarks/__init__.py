@@ -0,0 +1,7 @@
+"""
+Benchmark / đo hiệu năng cho backend.
+
+Chạy từ thư mục backend, ví dụ:
+    python -m benchmarks.scoring
+    python -m benchmarks.suite --baseline baseline.json   # bộ hồi quy đầy đủ
+"""
@@ -0,0 +1,117 @@
+"""
+Recall@k và độ trễ của IVF (ann.py) so với quét toàn bộ store, trên vector
+tổng hợp dạng cụm (gần với embedding thật hơn vector ngẫu nhiên đều).
+Ghi store thật vào thư mục tạm rồi nạp qua DenseIndex như worker.
+
+    python -m benchmarks.ann --rows 100000 --dim 384 --nprobe 1,4,8,16,32,64
+"""
+import argparse
+import math
+import tempfile
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from ann import build_ivf
+from dense import DenseIndex, VectorStore, content_hash
+
+Doc = namedtuple("Doc", "id text")
+
+
+class FixedEmbedder:
+    """Vector đã có sẵn: store dựng trực tiếp từ ma trận, không embed lại."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.name = f"bench-{dim}"
+
+    def embed(self, texts):
+        raise AssertionError("benchmark không embed document")
+
+
+def make_vectors(n: int, dim: int, topics: int, noise: float, rng) -> np.ndarray:
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, topics, n)] + noise * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def open_index(store: VectorStore, docs, dim: int, ann: str, nprobe: int) -> tuple[DenseIndex, float]:
+    index = DenseIndex(FixedEmbedder(dim), store, lambda doc: doc.text, ann=ann, nprobe=nprobe)
+    start = time.perf_counter()
+    index.load(docs)
+    return index, (time.perf_counter() - start) * 1e3
+
+
+def timed_search(index: DenseIndex, queries: np.ndarray, k: int, batch: int):
+    results = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch):
+        results.extend(index.search(queries[i:i + batch], k))
+    return results, (time.perf_counter() - start) / len(queries) * 1e3
+
+
+def recall(found, truth) -> float:
+    hits = sum(len({d for _, d in f} & {d for _, d in t}) for f, t in zip(found, truth))
+    return hits / max(1, sum(len(t) for t in truth))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=2000)
+    parser.add_argument("--noise", type=float, default=0.6)
+    parser.add_argument("--lists", type=int, default=0)
+    parser.add_argument("--nprobe", default="1,4,8,16,32,64")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=1, help="số câu hỏi mỗi lần search")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = make_vectors(args.rows, args.dim, args.topics, args.noise, rng)
+    ids = np.arange(1, args.rows + 1, dtype=np.int64)
+    docs = [Doc(int(i), f"doc {i}") for i in ids]
+    hashes = np.array([content_hash(doc.text) for doc in docs], dtype=np.uint32)
+
+    # câu hỏi: document ngẫu nhiên + nhiễu
+    queries = vectors[rng.integers(0, args.rows, args.queries)]
+    queries = queries + 0.5 * args.noise / math.sqrt(args.dim) * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    nlist = args.lists or int(4 * math.sqrt(args.rows))
+    start = time.perf_counter()
+    ivf = build_ivf(ids, vectors, nlist)
+    build_s = time.perf_counter() - start
+    order = ivf["order"]
+
+    with tempfile.TemporaryDirectory() as root:
+        store = VectorStore(root)
+        store.write(
+            ids[order], vectors[order], hashes[order],
+            meta={"embedder": f"bench-{args.dim}", "dim": args.dim, "ann": "ivf"},
+            dtype="float32",
+            extra={"centroids": ivf["centroids"], "offsets": ivf["offsets"]},
+        )
+        exact, exact_load = open_index(store, docs, args.dim, "none", 0)
+        approx, ivf_load = open_index(store, docs, args.dim, "ivf", 1)
+
+        truth, exact_ms = timed_search(exact, queries, args.k, args.batch)
+        print(
+            f"{args.rows} dòng x {args.dim} chiều, {nlist} cụm (dựng {build_s:.1f}s), "
+            f"nạp store: quét toàn bộ {exact_load:.0f} ms, IVF {ivf_load:.0f} ms"
+        )
+        print(f"  quét toàn bộ         {exact_ms:8.3f} ms/câu  recall@{args.k} 1.000")
+        for nprobe in (int(x) for x in args.nprobe.split(",")):
+            approx.nprobe = nprobe
+            found, ms = timed_search(approx, queries, args.k, args.batch)
+            print(
+                f"  ivf nprobe={nprobe:<4}      {ms:8.3f} ms/câu  recall@{args.k} {recall(found, truth):.3f}"
+                f"  (x{exact_ms / ms:.1f})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Micro-benchmark tìm gần đúng: câu hỏi gõ không dấu + sai một ký tự, so
+index trigram (FuzzyIndex) với cách so trigram câu hỏi với toàn bộ từ vựng.
+
+    python -m benchmarks.fuzzy --docs 1000,10000,50000 --questions 300
+"""
+import argparse
+import random
+import time
+
+import config
+from fuzzy import trigrams
+from rag import KnowledgeDoc, fold_text, fuzzy_entry, make_fuzzy_index
+from benchmarks.synthetic import make_docs
+
+SYLLABLES = (
+    "hàng khách mã kho phiếu nhập xuất trả đổi giao nhận lương thưởng phép "
+    "ca kíp chi nhánh phòng ban hợp đồng công nợ tồn kiểm định mức giá vốn"
+).split()
+
+
+def make_terms(n: int, seed: int) -> list:
+    # từ vựng lớn dần theo số document (mã hàng, tên chi nhánh...)
+    rnd = random.Random(seed)
+    return ["".join(rnd.sample(SYLLABLES, 2)) + str(rnd.randint(0, 99)) for _ in range(n)]
+
+
+def typo(word: str, rnd: random.Random) -> str:
+    i = rnd.randrange(len(word))
+    op = rnd.choice("sid")
+    if op == "s":
+        return word[:i] + rnd.choice("abcdeghiklmnopqrstuvxy") + word[i + 1:]
+    if op == "i":
+        return word[:i] + rnd.choice("abcdeghiklmnopqrstuvxy") + word[i:]
+    return word[:i] + word[i + 1:] if len(word) > 4 else word
+
+
+def brute_candidates(vocab: dict, token: str, min_similarity: float) -> dict:
+    grams = trigrams(token)
+    found = {}
+    for term, term_grams in vocab.items():
+        similarity = 2 * len(grams & term_grams) / (len(grams) + len(term_grams))
+        if similarity >= min_similarity:
+            found[term] = similarity
+    return found
+
+
+def run(n: int, questions: int, k: int):
+    rnd = random.Random(n)
+    terms = make_terms(n, seed=n)
+    docs = [
+        KnowledgeDoc(d.id, d.title, d.content, f"{d.keywords},{terms[d.id - 1]}", d.intent)
+        for d in make_docs(n, content_words=8)
+    ]
+    index = make_fuzzy_index()
+    start = time.perf_counter()
+    index.load(fuzzy_entry(doc) for doc in docs)
+    build_ms = (time.perf_counter() - start) * 1e3
+
+    targets = rnd.sample(docs, min(questions, len(docs)))
+    queries = [
+        [typo(fold_text(terms[doc.id - 1]), rnd)] for doc in targets
+    ]
+
+    found = 0
+    start = time.perf_counter()
+    for doc, tokens in zip(targets, queries):
+        index._cache.clear()
+        if doc.id in {doc_id for _, doc_id in index.top_k(tokens, set(), k)}:
+            found += 1
+    indexed_us = (time.perf_counter() - start) / len(queries) * 1e6
+
+    vocab = {term: trigrams(term) for term in index._postings}
+    start = time.perf_counter()
+    for tokens in queries:
+        brute_candidates(vocab, tokens[0], index.min_similarity)
+    brute_us = (time.perf_counter() - start) / len(queries) * 1e6
+
+    print(
+        f"{n:>7} docs  {len(index):>7} term  build {build_ms:7.1f} ms  "
+        f"index {indexed_us:8.1f} µs/câu  so toàn bộ {brute_us:9.1f} µs/câu  "
+        f"top-{k} đúng {found / len(queries):.0%}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", default="1000,10000,50000")
+    parser.add_argument("--questions", type=int, default=300)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--min-similarity", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.min_similarity is not None:
+        config.RAG_FUZZY_MIN_SIMILARITY = args.min_similarity
+
+    for n in (int(x) for x in args.docs.split(",")):
+        run(n, args.questions, args.k)
+
+
+if __name__ == "__main__":
+    main()
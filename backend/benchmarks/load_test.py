@@ -0,0 +1,138 @@
+"""
+Load test /chat: so sánh handler sync (threadpool) và async (AsyncSession).
+
+Mỗi chế độ chạy một uvicorn riêng trên cùng một file SQLite đã seed sẵn,
+rồi bắn request đồng thời trong một khoảng thời gian cố định.
+
+    python -m benchmarks.load_test --concurrency 64 --duration 15
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(database_url: str, n_docs: int) -> str:
+    # import muộn: db đọc DATABASE_URL lúc import
+    os.environ["DATABASE_URL"] = database_url
+    from auth import create_access_token
+    from db import Knowledge, User, get_session, init_db
+    from benchmarks.synthetic import make_docs
+
+    init_db()
+    with get_session() as db:
+        db.add(User(username="loadtest", email="loadtest@example.com",
+                    hashed_password="-", is_admin=False, is_active=True))
+        db.add_all(
+            Knowledge(title=d.title, content=d.content, keywords=d.keywords, intent=d.intent)
+            for d in make_docs(n_docs)
+        )
+    return create_access_token({"sub": "loadtest"})
+
+
+def start_server(database_url: str, port: int, chat_async: bool) -> subprocess.Popen:
+    env = dict(os.environ, DATABASE_URL=database_url, CHAT_ASYNC="1" if chat_async else "0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+async def wait_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(base_url + "/docs")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("server không khởi động được")
+
+
+async def run_load(base_url: str, token: str, concurrency: int, duration: float, questions):
+    latencies = []
+    errors = 0
+    headers = {"Authorization": f"Bearer {token}"}
+    stop_at = time.monotonic() + duration
+
+    async def worker(i: int, client: httpx.AsyncClient):
+        nonlocal errors
+        conversation_id = None
+        n = i
+        while time.monotonic() < stop_at:
+            body = {"message": questions[n % len(questions)], "conversation_id": conversation_id}
+            n += concurrency
+            start = time.perf_counter()
+            try:
+                res = await client.post(base_url + "/chat", json=body, headers=headers)
+                res.raise_for_status()
+                conversation_id = res.json().get("conversation_id")
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(worker(i, client) for i in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return latencies, errors, elapsed
+
+
+def report(name: str, latencies, errors: int, elapsed: float):
+    if not latencies:
+        print(f"{name:<6} không có request thành công ({errors} lỗi)")
+        return
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(
+        f"{name:<6} {len(latencies) / elapsed:8.1f} req/s   "
+        f"p50 {statistics.median(ordered) * 1e3:7.1f} ms   "
+        f"p99 {p99 * 1e3:7.1f} ms   lỗi {errors}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--database-url", help="mặc định: file SQLite tạm")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="chatbot-load-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'load.db')}"
+    token = seed(database_url, args.docs)
+
+    from benchmarks.synthetic import make_questions
+    questions = make_questions(500)
+
+    for name, chat_async in (("sync", False), ("async", True)):
+        server = start_server(database_url, args.port, chat_async)
+        try:
+            base_url = f"http://127.0.0.1:{args.port}"
+            asyncio.run(wait_ready(base_url))
+            # làm nóng: nạp index, mở connection pool
+            asyncio.run(run_load(base_url, token, 4, 1.0, questions))
+            report(name, *asyncio.run(
+                run_load(base_url, token, args.concurrency, args.duration, questions)
+            ))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
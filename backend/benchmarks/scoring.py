@@ -0,0 +1,145 @@
+"""
+Micro-benchmark chấm điểm một câu hỏi: quét toàn bảng + normalize từng dòng
+(cách cũ) so với index dựng sẵn (KnowledgeIndex).
+
+Đánh đổi bộ nhớ: cách cũ giữ một biến điểm tốt nhất, chuỗi lower() của từng
+dòng được giải phóng ngay nên peak tạm thấp (~8 KiB) dù cấp phát tổng cộng ~cả
+bảng mỗi câu. Index cộng điểm vào một dict doc id -> điểm cho mọi document
+khớp (~50 byte/document) rồi mới lấy top-k -> peak tạm tỉ lệ với số document
+khớp (~100 KiB ở 2000 docs), đổi lại nhanh hơn trên 10 lần và không cấp phát
+chuỗi nào.
+
+    python -m benchmarks.scoring --docs 2000 --questions 200
+"""
+import argparse
+import time
+import tracemalloc
+
+from rag import (
+    FIELD_POINTS,
+    INTENT_WEIGHT,
+    STOPWORDS,
+    KnowledgeIndex,
+    detect_intents,
+    make_scorer,
+    normalize_text,
+    tokenize,
+)
+from benchmarks.synthetic import make_docs, make_questions
+
+
+def legacy_score(tokens, doc, intents) -> int:
+    # bản sao score_knowledge trước khi có index: 4 chuỗi lower() mỗi dòng
+    score = 0
+    title = normalize_text(doc.title or "")
+    content = normalize_text(doc.content or "")
+    keywords = normalize_text(doc.keywords or "")
+    intent = normalize_text(doc.intent or "")
+    for w in tokens:
+        if w in keywords:
+            score += 5
+        if w in title:
+            score += 3
+        if w in content:
+            score += 2
+    if intent and intent in intents:
+        score += 8
+    return score
+
+
+def reference_score(tokens, doc, intents) -> int:
+    """
+    Điểm heuristic của một document tính thẳng trên doc.terms (không index):
+    `w in field` tương đương `w` là chuỗi con của một term của field
+    (token chỉ gồm chữ/số). HeuristicScorer phải cho đúng điểm này.
+    """
+    score = 0
+    for w in tokens:
+        mask = 0
+        for term, bits in doc.terms.items():
+            if w in term:
+                mask |= bits
+        score += FIELD_POINTS[mask]
+    if doc.intent_key and doc.intent_key in intents:
+        score += INTENT_WEIGHT
+    return score
+
+
+def legacy_search(docs, tokens, intents):
+    best_score, best_doc = 0, None
+    for doc in docs:
+        score = legacy_score(tokens, doc, intents)
+        if score > best_score:
+            best_score, best_doc = score, doc
+    return best_score, best_doc
+
+
+def prepare(question: str):
+    tokens = [
+        t for t in tokenize(normalize_text(question))
+        if t not in STOPWORDS and len(t) > 2
+    ]
+    return tokens, detect_intents(tokens)
+
+
+def measure(name, fn, queries):
+    # lượt 1: thời gian; lượt 2: bộ nhớ tạm mỗi câu (tracemalloc làm chậm đáng kể)
+    start = time.perf_counter()
+    for tokens, intents in queries:
+        fn(tokens, intents)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peaks = 0
+    for tokens, intents in queries:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(tokens, intents)
+        peaks += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    n = len(queries)
+    print(f"{name:<6} {elapsed / n * 1e6:10.1f} µs/câu   peak tạm {peaks / n / 1024:8.1f} KiB/câu")
+    return elapsed / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--scorer", default="heuristic", help="heuristic | bm25")
+    args = parser.parse_args()
+
+    docs = make_docs(args.docs)
+    queries = [prepare(q) for q in make_questions(args.questions)]
+    queries = [(t, i) for t, i in queries if t]
+
+    index = KnowledgeIndex(make_scorer(args.scorer))
+    start = time.perf_counter()
+    index.load(docs)
+    print(f"build index: {len(docs)} docs trong {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    # heuristic phải ra cùng kết quả trước khi so tốc độ
+    if args.scorer == "heuristic":
+        for tokens, intents in queries:
+            old_score, old_doc = legacy_search(docs, tokens, intents)
+            new_score, new_doc = index.search(tokens, intents)
+            assert (old_score, old_doc and old_doc.id) == (new_score, new_doc and new_doc.id)
+        # và cùng điểm với bản tham chiếu trên mọi document, không chỉ top-1
+        for tokens, intents in queries[:20]:
+            expected = {d.id: s for d in docs if (s := reference_score(tokens, d, intents)) > 0}
+            assert index.scorer.scores(tokens, intents) == expected
+
+    lowered = sum(
+        len(d.title or "") + len(d.content or "") + len(d.keywords or "") + len(d.intent or "")
+        for d in docs
+    )
+    print(f"cách cũ lower() {4 * len(docs)} chuỗi (~{lowered / 1024:.0f} KiB ký tự) mỗi câu hỏi; index: 0")
+
+    before = measure("trước", lambda t, i: legacy_search(docs, t, i), queries)
+    after = measure("sau", index.search, queries)
+    print(f"nhanh hơn {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Bộ benchmark hồi quy: seed SQLite cục bộ bằng dữ liệu giả lập rồi đo trong cùng
+process (TestClient) từng kịch bản, tuần tự và đồng thời:
+
+    answer          RAGChatbot.answer (không qua HTTP)
+    chat            POST /chat (user đã đăng nhập, có ghi lịch sử)
+    conversations   GET /chat/conversations
+    messages        GET /chat/conversations/{cid}/messages
+
+Mỗi kịch bản: throughput, p50/p99, peak RSS của process, số câu SQL / request.
+--save-baseline ghi kết quả ra JSON; --baseline so sánh với file đó và đánh dấu
+chỗ chậm đi quá --tolerance. benchmarks/baseline.json là baseline với tham số
+mặc định (python / máy đo ghi trong file); so trên máy khác chỉ để tham khảo,
+nên ghi baseline mới trước khi đổi code.
+
+    python -m benchmarks.suite --db /tmp/bench.db --users 2000 --conversations 50 --messages 20
+    python -m benchmarks.suite --db /tmp/bench.db --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --db /tmp/bench.db --baseline benchmarks/baseline.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCENARIOS = ("answer", "chat", "conversations", "messages")
+
+# chỉ số nào tăng là xấu / giảm là xấu
+HIGHER_IS_WORSE = ("p50_ms", "p99_ms", "sql_per_request", "peak_rss_mb")
+LOWER_IS_WORSE = ("throughput",)
+
+
+def peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KB, macOS: byte
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def percentile(ordered, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class SQLCounter:
+    """Đếm câu SQL qua engine event (mọi Engine, kể cả engine của AsyncSession)."""
+
+    def __init__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        self._counter = itertools.count()
+        self._taken = 0
+        event.listen(Engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        next(self._counter)
+
+    def take(self) -> int:
+        """Số câu SQL từ lần take() trước."""
+        # itertools.count: next() nguyên tử dưới GIL, không cần lock
+        now = next(self._counter)
+        n, self._taken = now - self._taken, now + 1
+        return n
+
+
+# ======================
+# SEED
+# ======================
+
+def seed(args) -> bool:
+    """Seed nếu file DB chưa có; True nếu vừa seed."""
+    from db import init_db
+    from benchmarks import synthetic
+
+    if os.path.exists(args.db) and os.path.getsize(args.db) > 0:
+        return False
+    init_db()
+    start = time.perf_counter()
+    synthetic.seed_knowledge(args.docs)
+    synthetic.seed_users(args.users)
+    rows = synthetic.seed_history(args.users, args.conversations, args.messages)
+    print(
+        f"🌱 Seed {args.docs} knowledge, {args.users} user, "
+        f"{args.users * args.conversations} hội thoại, {rows} tin nhắn "
+        f"trong {time.perf_counter() - start:.1f}s"
+    )
+    return True
+
+
+# ======================
+# CHẠY KỊCH BẢN
+# ======================
+
+def run_scenario(call, n: int, concurrency: int, sql: SQLCounter, offset: int = 0, settle=None) -> dict:
+    """
+    offset: request thứ i gọi call(offset + i) -> mỗi lần chạy hỏi câu khác,
+    không đo nhầm cache của lần chạy trước. settle: chạy sau khi bấm giờ xong
+    (ghi nốt lịch sử đang chờ) để câu SQL vẫn tính cho kịch bản này.
+    """
+    latencies = []
+    errors = 0
+
+    def one(i: int):
+        start = time.perf_counter()
+        ok = call(offset + i)
+        return ok, time.perf_counter() - start
+
+    sql.take()
+    started = time.perf_counter()
+    if concurrency <= 1:
+        results = [one(i) for i in range(n)]
+    else:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(one, range(n)))
+    elapsed = time.perf_counter() - started
+    if settle is not None:
+        settle()
+    queries = sql.take()
+
+    for ok, latency in results:
+        if ok:
+            latencies.append(latency)
+        else:
+            errors += 1
+    ordered = sorted(latencies) or [0.0]
+    return {
+        "requests": n,
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(ordered) * 1e3, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1e3, 3),
+        "sql_per_request": round(queries / n, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def make_calls(client, bot, args) -> dict:
+    from auth import create_access_token
+    from benchmarks.synthetic import conversation_id, make_questions
+
+    questions = make_questions(20000, seed=3)
+    # một nhóm user "đang hoạt động", request thứ i dùng user thứ i % len
+    active = range(1, min(args.users, args.active_users) + 1)
+    headers = [{"Authorization": f"Bearer {create_access_token({'sub': f'bench{uid}'})}"} for uid in active]
+
+    def user_of(i: int) -> tuple[int, dict]:
+        return active[i % len(active)], headers[i % len(active)]
+
+    def answer(i: int) -> bool:
+        bot.answer(questions[i % len(questions)])
+        return True
+
+    def chat(i: int) -> bool:
+        _, h = user_of(i)
+        return client.post("/chat", json={"message": questions[i % len(questions)]}, headers=h).status_code == 200
+
+    def conversations(i: int) -> bool:
+        _, h = user_of(i)
+        return client.get("/chat/conversations", headers=h).status_code == 200
+
+    def messages(i: int) -> bool:
+        uid, h = user_of(i)
+        cid = conversation_id(uid, i % max(args.conversations, 1), args.conversations)
+        return client.get(f"/chat/conversations/{cid}/messages", headers=h).status_code == 200
+
+    return {"answer": answer, "chat": chat, "conversations": conversations, "messages": messages}
+
+
+# ======================
+# BASELINE
+# ======================
+
+def compare(results: dict, baseline: dict, tolerance: float) -> int:
+    """In chênh lệch so với baseline; trả về số chỉ số chậm đi quá tolerance."""
+    regressions = 0
+    old_results = baseline.get("results", {})
+    for name, now in results.items():
+        old = old_results.get(name)
+        if old is None:
+            print(f"  {name:<18} (không có trong baseline)")
+            continue
+        parts = []
+        for key in LOWER_IS_WORSE + HIGHER_IS_WORSE:
+            before, after = old.get(key), now.get(key)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = change < -tolerance if key in LOWER_IS_WORSE else change > tolerance
+            regressions += worse
+            parts.append(f"{key} {change:+.0%}{' ⚠️' if worse else ''}")
+        print(f"  {name:<18} " + "  ".join(parts))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="file SQLite (seed nếu chưa có); mặc định: file tạm")
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--conversations", type=int, default=20, help="số hội thoại mỗi user")
+    parser.add_argument("--messages", type=int, default=10, help="số tin nhắn mỗi hội thoại")
+    parser.add_argument("--active-users", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500, help="số request mỗi kịch bản")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--baseline", help="JSON baseline để so sánh")
+    parser.add_argument("--save-baseline", help="ghi kết quả lần chạy này ra JSON")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 nếu có chỉ số chậm đi")
+    args = parser.parse_args()
+
+    args.db = os.path.abspath(args.db or os.path.join(tempfile.mkdtemp(prefix="chatbot-bench-"), "bench.db"))
+    # import muộn: db / config đọc biến môi trường lúc import
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    seeded = seed(args)
+    if not seeded:
+        print(f"♻️  Dùng lại {args.db} (xóa file để seed lại với tham số mới)")
+
+    from fastapi.testclient import TestClient
+    import main as app_main
+
+    sql = SQLCounter()
+    results = {}
+    with TestClient(app_main.app) as client:
+        calls = make_calls(client, app_main.bot, args)
+        # làm nóng: nạp index, mở connection, điền cache token / user
+        for name in SCENARIOS:
+            for i in range(min(args.active_users, 50)):
+                calls[name](i)
+
+        offset = 0
+        for name in args.scenarios.split(","):
+            for concurrency in sorted({1, args.concurrency}):
+                key = f"{name}@{concurrency}"
+                offset += args.requests
+                results[key] = r = run_scenario(
+                    calls[name], args.requests, concurrency, sql, offset, app_main.history_writer.flush
+                )
+                print(
+                    f"  {key:<18} {r['throughput']:9.1f} req/s  p50 {r['p50_ms']:8.2f} ms  "
+                    f"p99 {r['p99_ms']:8.2f} ms  SQL/req {r['sql_per_request']:5.2f}  "
+                    f"RSS {r['peak_rss_mb']} MB  lỗi {r['errors']}"
+                )
+
+    params = {k: getattr(args, k) for k in ("docs", "users", "conversations", "messages", "active_users", "requests", "concurrency")}
+    regressions = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("params") != params:
+            print(f"⚠️  Tham số khác baseline: {baseline.get('params')}")
+        print(f"📊 So với {args.baseline} (ngưỡng ±{args.tolerance:.0%}):")
+        regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "params": params,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"💾 Đã lưu baseline: {args.save_baseline}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Sinh dữ liệu knowledge / câu hỏi / lịch sử chat tiếng Việt giả lập cho benchmark.
+
+Từ điển gồm các từ nghiệp vụ (đứng đầu, hay gặp nhất) và vài nghìn âm tiết
+tiếng Việt ghép từ phụ âm đầu + vần + thanh; tần suất theo luật Zipf như văn
+bản thật: ít từ rất phổ biến, phần đuôi dài hiếm gặp. Cùng seed -> cùng dữ liệu.
+"""
+import itertools
+import random
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Iterator, List
+
+from sqlalchemy import insert
+
+from db import ChatHistory, Conversation, Knowledge, User, get_session
+from rag import KnowledgeDoc
+
+DOMAIN_VOCAB = (
+    "lỗi đăng nhập báo cáo chậm treo lag hệ thống dữ liệu người dùng mật khẩu "
+    "xuất file excel trang web sai lệch số liệu tài khoản quyền truy cập máy chủ "
+    "kết nối mạng trình duyệt bộ nhớ đệm cập nhật phiên bản cài đặt cấu hình "
+    "biểu đồ thống kê doanh thu đơn hàng khách hàng sản phẩm kho hàng hóa đơn "
+    "thanh toán email thông báo lịch sử tìm kiếm lọc sắp xếp phân trang"
+).split()
+
+ONSETS = "b c ch d đ g gi h k kh l m n ng nh p ph qu r s t th tr v x".split() + [""]
+RHYMES = (
+    "a ai am an ang anh ao au ay ac ach at ăm ăn ăng âm ân âng âu ây "
+    "e em en eng eo et ê êm ên ênh êu êt i ia im in inh it iêm iên iêng iêu "
+    "o oa oai oan oang oanh oe oi om on ong ot ô ôi ôm ôn ông ôt ơ ơi ơm ơn ơt "
+    "u ua uân uê ui um un ung uy uyên ut ư ưa ưi ưng ươi ươm ươn ương ươu"
+).split()
+# không dấu, sắc, huyền, hỏi, ngã, nặng (dấu tổ hợp, NFC gộp lại)
+TONES = ("", "\u0301", "\u0300", "\u0309", "\u0303", "\u0323")
+VOWELS = set("aăâeêioôơuưy")
+
+VOCAB_SIZE = 5000
+# số mũ Zipf: từ hạng r có tần suất ~ 1 / r^ZIPF_S
+ZIPF_S = 1.1
+
+
+def syllable(onset: str, rhyme: str, tone: str) -> str:
+    # dấu thanh đặt sau nguyên âm cuối của cụm nguyên âm đầu tiên (gần đúng chính tả)
+    i = next(i for i, ch in enumerate(rhyme) if ch in VOWELS)
+    while i + 1 < len(rhyme) and rhyme[i + 1] in VOWELS and i + 2 < len(rhyme):
+        i += 1
+    return unicodedata.normalize("NFC", onset + rhyme[:i + 1] + tone + rhyme[i + 1:])
+
+
+def make_vocab(size: int = VOCAB_SIZE, seed: int = 5) -> List[str]:
+    """Từ nghiệp vụ trước rồi tới âm tiết ngẫu nhiên, tổng cộng size từ khác nhau."""
+    vocab = list(dict.fromkeys(DOMAIN_VOCAB))
+    seen = set(vocab)
+    generated = [syllable(o, r, t) for o in ONSETS for r in RHYMES for t in TONES]
+    random.Random(seed).shuffle(generated)
+    for word in generated:
+        if len(vocab) >= size:
+            break
+        if word not in seen:
+            seen.add(word)
+            vocab.append(word)
+    return vocab
+
+
+VOCAB = make_vocab()
+# trọng số cộng dồn cho random.choices (tính một lần)
+VOCAB_CUM_WEIGHTS = list(itertools.accumulate(1 / (r + 1) ** ZIPF_S for r in range(len(VOCAB))))
+
+
+def words(rnd: random.Random, k: int) -> List[str]:
+    """k từ rút theo phân phối Zipf (có thể lặp)."""
+    return rnd.choices(VOCAB, cum_weights=VOCAB_CUM_WEIGHTS, k=k)
+
+
+def distinct_words(rnd: random.Random, k: int) -> List[str]:
+    """k từ khác nhau theo phân phối Zipf (tiêu đề, keywords)."""
+    picked: dict = {}
+    while len(picked) < k:
+        picked.update(dict.fromkeys(words(rnd, k - len(picked))))
+    return list(picked)
+
+INTENTS = ["login_issue", "report", "report_error", "performance", None]
+
+
+def make_docs(n: int, seed: int = 42, content_words: int = 120) -> List[KnowledgeDoc]:
+    rnd = random.Random(seed)
+    docs = []
+    for i in range(1, n + 1):
+        title = " ".join(distinct_words(rnd, 4)).capitalize()
+        keywords = ",".join(distinct_words(rnd, 3))
+        paragraphs = [
+            " ".join(words(rnd, content_words // 4)).capitalize() + "."
+            for _ in range(4)
+        ]
+        docs.append(KnowledgeDoc(i, title, "\n\n".join(paragraphs), keywords, rnd.choice(INTENTS)))
+    return docs
+
+
+def make_questions(n: int, seed: int = 7) -> List[str]:
+    rnd = random.Random(seed)
+    return [" ".join(words(rnd, rnd.randint(2, 6))) for _ in range(n)]
+
+
+# ======================
+# SEED DATABASE
+# ======================
+
+INSERT_CHUNK = 10000
+
+
+def _insert(table, rows: Iterator[dict]) -> int:
+    """Chèn theo lô (executemany), mỗi lô một transaction ngắn."""
+    total = 0
+    chunk: List[dict] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK:
+            with get_session() as db:
+                db.execute(insert(table), chunk)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        with get_session() as db:
+            db.execute(insert(table), chunk)
+        total += len(chunk)
+    return total
+
+
+def conversation_id(user_id: int, n: int, per_user: int) -> int:
+    """Id hội thoại thứ n (0..per_user-1) của user user_id (bắt đầu từ 1)."""
+    return (user_id - 1) * per_user + n + 1
+
+
+def seed_knowledge(n: int, seed: int = 42) -> int:
+    return _insert(Knowledge, (
+        {"title": d.title, "content": d.content, "keywords": d.keywords, "intent": d.intent}
+        for d in make_docs(n, seed)
+    ))
+
+
+def seed_users(n: int) -> int:
+    return _insert(User, (
+        {"id": i, "username": f"bench{i}", "email": f"bench{i}@example.com",
+         "hashed_password": "-", "is_admin": False, "is_active": True}
+        for i in range(1, n + 1)
+    ))
+
+
+def seed_history(users: int, conversations: int, messages: int, seed: int = 11) -> int:
+    """
+    users x conversations x messages dòng chat_history + dòng conversations tóm tắt
+    tương ứng (như HistoryWriter ghi). Câu hỏi / trả lời lấy vòng từ một tập nhỏ
+    sinh sẵn: nội dung không quan trọng, tốc độ sinh thì có.
+    """
+    rnd = random.Random(seed)
+    questions = make_questions(997, seed)
+    answers = [
+        " ".join(words(rnd, rnd.randint(20, 60))).capitalize() + "."
+        for _ in range(991)
+    ]
+    start = datetime(2024, 1, 1)
+    step = timedelta(minutes=1)
+
+    def conversation_start(uid: int, n: int) -> datetime:
+        return start + timedelta(hours=(uid * 7 + n * 13) % 8760)
+
+    def history_rows():
+        i = 0
+        for uid in range(1, users + 1):
+            for n in range(conversations):
+                cid = conversation_id(uid, n, conversations)
+                at = conversation_start(uid, n)
+                for m in range(messages):
+                    i += 1
+                    yield {
+                        "conversation_id": cid,
+                        "user_id": uid,
+                        "question": questions[i % len(questions)],
+                        "answer": answers[i % len(answers)],
+                        "created_at": at + m * step,
+                        "is_pinned": False,
+                    }
+
+    def conversation_rows():
+        for uid in range(1, users + 1):
+            for n in range(conversations):
+                at = conversation_start(uid, n)
+                first = (((uid - 1) * conversations + n) * messages + 1) % len(questions)
+                yield {
+                    "id": conversation_id(uid, n, conversations),
+                    "user_id": uid,
+                    "title": questions[first],
+                    "created_at": at,
+                    "last_message_at": at + (messages - 1) * step,
+                    "message_count": messages,
+                    "is_pinned": n == 0,
+                }
+
+    if not messages:
+        return 0
+    _insert(Conversation, conversation_rows())
+    return _insert(ChatHistory, history_rows())
@@ -0,0 +1,65 @@
+"""
+Embed toàn bộ knowledge (offline) vào vector store dùng cho RAG_RETRIEVAL=dense/hybrid.
+
+    python build_embeddings.py
+
+Worker đang chạy tự nạp bản mới ở lần poll index kế tiếp; dòng sửa sau lần
+build được embed ngay trong worker (delta) cho tới lần build sau.
+DENSE_ANN=ivf: dựng thêm cụm IVF và ghi vector theo thứ tự cụm.
+"""
+import math
+import time
+
+import numpy as np
+
+import config
+from db import Knowledge, KnowledgeChange, get_session, init_db
+from ann import build_ivf
+from dense import content_hash
+from rag import KnowledgeDoc, dense_text, make_dense_index
+from sqlalchemy import func
+
+BATCH_SIZE = 256
+
+
+def run():
+    init_db()
+    with get_session() as db:
+        # generation chỉ để ghi nhận: worker so từng dòng theo content hash khi
+        # nạp store, nên thay đổi commit muộn (id dưới watermark, chưa thấy lúc
+        # đọc) vẫn được embed lại trong worker, không bị bỏ sót
+        generation = db.query(func.max(KnowledgeChange.id)).scalar() or 0
+        docs = [KnowledgeDoc.from_row(row) for row in db.query(Knowledge).order_by(Knowledge.id)]
+
+    index = make_dense_index()
+    embedder = index.embedder
+    print(f"🔧 Embedding {len(docs)} knowledge bằng {embedder.name}...")
+
+    start = time.perf_counter()
+    vectors = np.zeros((len(docs), embedder.dim), dtype=np.float32)
+    for i in range(0, len(docs), BATCH_SIZE):
+        batch = docs[i:i + BATCH_SIZE]
+        vectors[i:i + len(batch)] = embedder.embed([dense_text(doc) for doc in batch])
+
+    ids = np.array([doc.id for doc in docs], dtype=np.int64)
+    hashes = np.array([content_hash(dense_text(doc)) for doc in docs], dtype=np.uint32)
+    meta = {"embedder": embedder.name, "dim": embedder.dim, "generation": generation}
+    extra = None
+
+    if config.DENSE_ANN == "ivf" and len(docs) >= config.DENSE_IVF_MIN_ROWS:
+        nlist = config.DENSE_IVF_LISTS or int(4 * math.sqrt(len(docs)))
+        print(f"🔧 Dựng IVF {nlist} cụm...")
+        ivf = build_ivf(ids, vectors, nlist)
+        order = ivf["order"]
+        ids, vectors, hashes = ids[order], vectors[order], hashes[order]
+        extra = {"centroids": ivf["centroids"], "offsets": ivf["offsets"]}
+        meta.update(ann="ivf", nlist=len(ivf["centroids"]))
+
+    path = index.store.write(
+        ids=ids, vectors=vectors, hashes=hashes, meta=meta, dtype=config.DENSE_DTYPE, extra=extra,
+    )
+    print(f"✅ Đã ghi {path} ({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,185 @@
+"""
+Cache LRU giới hạn số phần tử, mỗi phần tử có hạn (TTL):
+- TTLCache: trong tiến trình
+- SQLiteCache: dùng chung giữa các worker trên cùng máy qua một file SQLite
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (hết hạn lúc, value); cuối OrderedDict = dùng gần nhất
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[0] <= now:
+                if item is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteCache:
+    """
+    Cùng giao diện với TTLCache nhưng key là str, value phải JSON được.
+    LRU xấp xỉ theo cột last_used; lỗi SQLite (file bị khóa...) coi như miss,
+    không làm hỏng request.
+    """
+
+    # dọn phần tử hết hạn / vượt maxsize sau mỗi EVICT_EVERY lần set
+    EVICT_EVERY = 64
+
+    def __init__(self, path: str, maxsize: int, ttl: float):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sets = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connect().execute("CREATE INDEX IF NOT EXISTS ix_cache_last_used ON cache (last_used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # mỗi thread một connection, autocommit
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def __len__(self) -> int:
+        try:
+            return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= now:
+                self._count("misses")
+                return default
+            conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            self._count("misses")
+            return default
+        self._count("hits")
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl, now),
+            )
+            with self._lock:
+                self._sets += 1
+                evict = self._sets % self.EVICT_EVERY == 0
+            if evict:
+                self._evict(conn, now)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        removed = conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+        excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.maxsize
+        if excess > 0:
+            removed += conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used LIMIT ?)",
+                (excess,),
+            ).rowcount
+        if removed:
+            self._count("evictions", removed)
+
+    def pop(self, key: str):
+        try:
+            self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        try:
+            self._connect().execute("DELETE FROM cache")
+        except sqlite3.Error:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,120 @@
+"""
+Ngữ cảnh hội thoại cho truy xuất nhiều lượt:
+- mỗi conversation_id giữ N lượt hỏi gần nhất (đã tách token) trong một ring
+  buffer (deque maxlen=N), không đọc lại chat_history mỗi tin nhắn
+- số hội thoại giữ trong bộ nhớ có giới hạn, đầy thì bỏ hội thoại lâu không
+  dùng nhất (LRU)
+- hội thoại chưa có trong bộ nhớ (cold miss: worker vừa khởi động, bị đẩy ra,
+  hoặc hội thoại bắt đầu ở worker khác) mới đọc N dòng cuối từ DB
+
+Mỗi worker giữ bộ đệm riêng: hội thoại đổi worker giữa chừng có thể thiếu vài
+lượt vừa xử lý ở worker kia – chỉ ảnh hưởng độ liên quan, không ảnh hưởng dữ liệu.
+"""
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, List, Optional
+
+# (token, intent) của một lượt hỏi
+Turn = tuple[List[str], set]
+
+
+class _Window:
+    __slots__ = ("user_id", "turns")
+
+    def __init__(self, user_id: int, turns: deque):
+        self.user_id = user_id
+        self.turns = turns
+
+
+class ContextWindows:
+    """
+    loader(conversation_id, user_id, n) -> tối đa n lượt cuối, cũ trước mới sau.
+    turns = 0: tắt hẳn (không giữ gì, không đọc DB).
+    """
+
+    def __init__(self, turns: int, max_conversations: int,
+                 loader: Callable[[int, int, int], List[Turn]]):
+        self.turns = turns
+        self.max_conversations = max_conversations
+        self._loader = loader
+        self._lock = threading.Lock()
+        # cuối OrderedDict = dùng gần nhất
+        self._windows: "OrderedDict[int, _Window]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.turns > 0 and self.max_conversations > 0
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def _insert(self, conversation_id: int, window: _Window):
+        self._windows[conversation_id] = window
+        self._windows.move_to_end(conversation_id)
+        while len(self._windows) > self.max_conversations:
+            self._windows.popitem(last=False)
+            self.evictions += 1
+
+    def try_get(self, conversation_id: int, user_id: int) -> Optional[List[Turn]]:
+        """Các lượt trước, mới nhất trước; None nếu phải đọc DB (dùng get trên thread)."""
+        if not self.enabled:
+            return []
+        with self._lock:
+            window = self._windows.get(conversation_id)
+            if window is None:
+                return None
+            self.hits += 1
+            self._windows.move_to_end(conversation_id)
+            # hội thoại của user khác: không lộ nội dung, coi như không có ngữ cảnh
+            return list(reversed(window.turns)) if window.user_id == user_id else []
+
+    def get(self, conversation_id: int, user_id: int) -> List[Turn]:
+        turns = self.try_get(conversation_id, user_id)
+        if turns is not None:
+            return turns
+
+        # đọc DB ngoài khóa; request khác nạp trước thì dùng bản đã có
+        loaded = deque(self._loader(conversation_id, user_id, self.turns), maxlen=self.turns)
+        with self._lock:
+            self.misses += 1
+            window = self._windows.get(conversation_id)
+            if window is None:
+                window = _Window(user_id, loaded)
+                self._insert(conversation_id, window)
+            if window.user_id != user_id:
+                return []
+            return list(reversed(window.turns))
+
+    def record(self, conversation_id: int, user_id: int, turn: Turn, new: bool = False):
+        """
+        Thêm lượt vừa trả lời. new: hội thoại vừa tạo -> mở cửa sổ mới, không
+        cần DB; hội thoại cũ đã bị đẩy ra thì bỏ qua, lần sau nạp lại từ DB.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            window = self._windows.get(conversation_id)
+            if window is None:
+                if not new:
+                    return
+                window = _Window(user_id, deque(maxlen=self.turns))
+                self._insert(conversation_id, window)
+            elif window.user_id != user_id:
+                return
+            window.turns.append(turn)
+
+    def discard(self, conversation_id: int):
+        with self._lock:
+            self._windows.pop(conversation_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._windows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
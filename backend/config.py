@@ -0,0 +1,221 @@
+"""
+Cấu hình backend, đọc từ biến môi trường (mặc định dùng được ngay trên máy dev).
+"""
+import os
+import tempfile
+
+
+def env_str(name: str, default: str) -> str:
+    return os.getenv(name, default)
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+# =========================
+# DATABASE
+# =========================
+
+# "sqlite" (local / CI) | "postgresql" | "mssql"; DATABASE_URL (nếu có) được ưu tiên
+DB_BACKEND = env_str("DB_BACKEND", "sqlite").lower()
+
+SQLITE_PATH = env_str("SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.db"))
+# WAL: đọc không chặn ghi; NORMAL đủ an toàn với WAL và nhanh hơn FULL
+SQLITE_WAL = env_bool("SQLITE_WAL", True)
+SQLITE_SYNCHRONOUS = env_str("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+
+POSTGRES_HOST = env_str("POSTGRES_HOST", "localhost")
+POSTGRES_PORT = env_int("POSTGRES_PORT", 5432)
+POSTGRES_USER = env_str("POSTGRES_USER", "chatbot")
+POSTGRES_PASSWORD = env_str("POSTGRES_PASSWORD", "")
+POSTGRES_DB = env_str("POSTGRES_DB", "chatbot")
+
+MSSQL_SERVER = env_str("MSSQL_SERVER", "DESKTOP-JBUKRLP\\MSSQLSERVER01")
+MSSQL_DATABASE = env_str("MSSQL_DATABASE", "ChatbotDB")
+MSSQL_DRIVER = env_str("MSSQL_DRIVER", "ODBC Driver 17 for SQL Server")
+# Bỏ trống user -> Windows Trusted_Connection như trước
+MSSQL_USER = env_str("MSSQL_USER", "")
+MSSQL_PASSWORD = env_str("MSSQL_PASSWORD", "")
+
+# Pool cho mỗi engine (sync và async riêng) trong mỗi worker uvicorn:
+# số connection tối đa tới DB ~ workers * 2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+DB_POOL_SIZE = env_int("DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT = env_float("DB_POOL_TIMEOUT", 30)
+DB_POOL_PRE_PING = env_bool("DB_POOL_PRE_PING", True)
+# Giây; -1 = không recycle
+DB_POOL_RECYCLE = env_int("DB_POOL_RECYCLE", 1800)
+# Cache câu SQL đã compile của SQLAlchemy (và prepared statement của asyncpg)
+DB_STATEMENT_CACHE_SIZE = env_int("DB_STATEMENT_CACHE_SIZE", 500)
+
+# =========================
+# RAG
+# =========================
+
+# "heuristic" (5/3/2/+8 như cũ) | "bm25"
+RAG_SCORER = env_str("RAG_SCORER", "heuristic")
+
+# Ngưỡng tin cậy theo từng scorer: điểm thấp hơn -> hỏi lại người dùng
+RAG_MIN_SCORE = {
+    "heuristic": env_float("RAG_MIN_SCORE_HEURISTIC", 8),
+    "bm25": env_float("RAG_MIN_SCORE_BM25", 3.0),
+}
+
+BM25_K1 = env_float("BM25_K1", 1.2)
+BM25_B = env_float("BM25_B", 0.75)
+# Điểm cộng khi intent của document trùng intent câu hỏi
+BM25_INTENT_BOOST = env_float("BM25_INTENT_BOOST", 2.0)
+
+# Chu kỳ (giây) hỏi bảng knowledge_change để bắt kịp thay đổi từ worker khác
+INDEX_POLL_SECONDS = env_float("RAG_INDEX_POLL_SECONDS", 2.0)
+# id knowledge_change bị bỏ trống dưới watermark (transaction commit muộn ở
+# PostgreSQL / MSSQL) được hỏi lại trong ngần này giây rồi mới coi là rollback
+INDEX_GAP_GRACE_SECONDS = env_float("RAG_INDEX_GAP_GRACE_SECONDS", 60)
+# lúc nạp index: chỉ tìm id bỏ trống trong ngần này id gần nhất
+INDEX_GAP_LOOKBACK = env_int("RAG_INDEX_GAP_LOOKBACK", 1000)
+
+# Số document trả về mặc định của RAGChatbot.retrieve
+RAG_TOP_K = env_int("RAG_TOP_K", 3)
+
+# Bật thì chỉ trả đoạn liên quan nhất của bài dài thay vì toàn bộ content
+RAG_PASSAGES = env_bool("RAG_PASSAGES", False)
+RAG_PASSAGE_CHARS = env_int("RAG_PASSAGE_CHARS", 600)
+RAG_ANSWER_PASSAGES = env_int("RAG_ANSWER_PASSAGES", 1)
+
+# "keyword" (như cũ) | "dense" (vector) | "hybrid" (trộn hai bên theo thứ hạng - RRF)
+RAG_RETRIEVAL = env_str("RAG_RETRIEVAL", "keyword")
+# Mỗi bên lấy bao nhiêu ứng viên trước khi trộn; hằng số k của RRF
+RAG_HYBRID_CANDIDATES = env_int("RAG_HYBRID_CANDIDATES", 20)
+RAG_RRF_K = env_int("RAG_RRF_K", 60)
+
+# "hashing" (không cần model) | "sentence-transformers" (model nhỏ chạy CPU)
+DENSE_EMBEDDER = env_str("DENSE_EMBEDDER", "hashing")
+DENSE_MODEL = env_str("DENSE_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+DENSE_DIM = env_int("DENSE_DIM", 512)
+# Kiểu lưu trên đĩa: float32 (nhân thẳng trên mmap) | float16 (nhẹ một nửa
+# nhưng mỗi truy vấn phải đổi sang float32, chậm hơn ~6 lần với 1 câu hỏi)
+DENSE_DTYPE = env_str("DENSE_DTYPE", "float32")
+DENSE_STORE_DIR = env_str("DENSE_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_store"))
+DENSE_MAX_CHARS = env_int("DENSE_MAX_CHARS", 2000)
+# cosine tối thiểu để coi là trả lời được
+DENSE_MIN_SCORE = env_float("DENSE_MIN_SCORE", 0.35)
+# ANN cho kho lớn: "none" (quét toàn bộ) | "ivf"; build_embeddings.py dựng cụm
+# khi store có từ DENSE_IVF_MIN_ROWS dòng, DENSE_IVF_LISTS = 0 -> 4 * sqrt(số dòng)
+DENSE_ANN = env_str("DENSE_ANN", "none")
+DENSE_IVF_MIN_ROWS = env_int("DENSE_IVF_MIN_ROWS", 20000)
+DENSE_IVF_LISTS = env_int("DENSE_IVF_LISTS", 0)
+# số cụm quét mỗi câu hỏi: tăng -> recall cao hơn, chậm hơn
+DENSE_IVF_NPROBE = env_int("DENSE_IVF_NPROBE", 16)
+
+# Không có kết quả đủ tin cậy -> tìm gần đúng trên keywords + title đã bỏ dấu
+RAG_FUZZY = env_bool("RAG_FUZZY", True)
+# Độ giống trigram (Dice) tối thiểu để coi là cùng một từ gõ sai
+RAG_FUZZY_MIN_SIMILARITY = env_float("RAG_FUZZY_MIN_SIMILARITY", 0.6)
+# Cùng thang điểm heuristic: keyword 5, title 3, intent 8 (nhân độ giống)
+RAG_FUZZY_MIN_SCORE = env_float("RAG_FUZZY_MIN_SCORE", 8)
+
+# Bảng intent: {intent: {"words": [...], "phrases": [...]}}
+INTENTS_PATH = env_str("RAG_INTENTS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents.json"))
+
+# Cache câu trả lời theo (token đã lọc + sắp xếp, intent, k); 0 = tắt
+ANSWER_CACHE_SIZE = env_int("ANSWER_CACHE_SIZE", 2048)
+ANSWER_CACHE_TTL = env_float("ANSWER_CACHE_TTL", 3600)
+# "memory" (từng worker) | "sqlite" (file dùng chung giữa các worker trên một máy)
+ANSWER_CACHE_BACKEND = env_str("ANSWER_CACHE_BACKEND", "memory")
+ANSWER_CACHE_PATH = env_str("ANSWER_CACHE_PATH", os.path.join(tempfile.gettempdir(), "chatbot_answer_cache.db"))
+
+# Hội thoại nhiều lượt: truy xuất tính thêm CONTEXT_TURNS câu hỏi trước (0 = tắt),
+# lượt trước trọng số CONTEXT_DECAY, trước nữa CONTEXT_DECAY², ...
+CONTEXT_TURNS = env_int("CONTEXT_TURNS", 3)
+CONTEXT_DECAY = env_float("CONTEXT_DECAY", 0.5)
+# Số hội thoại giữ ngữ cảnh trong bộ nhớ mỗi worker (LRU); thiếu thì đọc chat_history
+CONTEXT_MAX_CONVERSATIONS = env_int("CONTEXT_MAX_CONVERSATIONS", 10000)
+
+# =========================
+# API
+# =========================
+
+# /chat dùng handler async + AsyncSession (0: handler sync trên threadpool)
+CHAT_ASYNC = env_bool("CHAT_ASYNC", True)
+
+# /chat/batch: số câu hỏi tối đa mỗi request
+CHAT_BATCH_MAX = env_int("CHAT_BATCH_MAX", 200)
+
+# /chat/stream: mỗi event "chunk" gồm các đoạn văn liền nhau tới khoảng chừng này ký tự
+CHAT_STREAM_CHUNK_CHARS = env_int("CHAT_STREAM_CHUNK_CHARS", 400)
+
+# /admin/knowledge/import: số dòng mỗi transaction (+ một lần cập nhật index);
+# trả về tối đa KNOWLEDGE_IMPORT_MAX_ERRORS lỗi đầu tiên
+KNOWLEDGE_IMPORT_BATCH = env_int("KNOWLEDGE_IMPORT_BATCH", 500)
+KNOWLEDGE_IMPORT_MAX_ERRORS = env_int("KNOWLEDGE_IMPORT_MAX_ERRORS", 1000)
+# /admin/knowledge/export: số dòng đọc mỗi lượt
+KNOWLEDGE_EXPORT_PAGE = env_int("KNOWLEDGE_EXPORT_PAGE", 1000)
+# GET /admin/knowledge?q=...: số kết quả tìm kiếm tối đa (phân trang bằng offset trong đó)
+KNOWLEDGE_SEARCH_MAX = env_int("KNOWLEDGE_SEARCH_MAX", 500)
+
+# =========================
+# CHAT HISTORY (write-behind)
+# =========================
+
+# 0: insert ChatHistory ngay trong request như trước
+HISTORY_WRITE_BEHIND = env_bool("HISTORY_WRITE_BEHIND", True)
+HISTORY_BATCH_SIZE = env_int("HISTORY_BATCH_SIZE", 200)
+HISTORY_FLUSH_SECONDS = env_float("HISTORY_FLUSH_SECONDS", 0.5)
+# Số dòng tối đa giữ trong bộ nhớ; đầy thì /chat chờ tối đa HISTORY_SUBMIT_TIMEOUT
+HISTORY_MAX_PENDING = env_int("HISTORY_MAX_PENDING", 10000)
+HISTORY_SUBMIT_TIMEOUT = env_float("HISTORY_SUBMIT_TIMEOUT", 2.0)
+# Lô ghi lỗi bấy nhiêu lần liên tiếp mà DB vẫn chạy -> tách từng dòng, bỏ dòng không ghi được
+HISTORY_MAX_RETRIES = env_int("HISTORY_MAX_RETRIES", 3)
+
+# Số id hội thoại mỗi worker giữ trước trong một lần chạm DB
+CONVERSATION_ID_BLOCK = env_int("CONVERSATION_ID_BLOCK", 100)
+# Chủ của hội thoại (conversation_id -> user_id) để /chat kiểm tra không phải hỏi DB
+CONVERSATION_OWNER_CACHE_SIZE = env_int("CONVERSATION_OWNER_CACHE_SIZE", 10000)
+CONVERSATION_OWNER_CACHE_TTL = env_float("CONVERSATION_OWNER_CACHE_TTL", 3600)
+
+# =========================
+# AUTH CACHE
+# =========================
+
+# Thông tin user (id, is_admin, is_active...) theo username
+AUTH_USER_CACHE_SIZE = env_int("AUTH_USER_CACHE_SIZE", 10000)
+AUTH_USER_CACHE_TTL = env_float("AUTH_USER_CACHE_TTL", 60)
+# JWT đã giải mã + kiểm tra chữ ký (không quá hạn exp của token)
+AUTH_TOKEN_CACHE_SIZE = env_int("AUTH_TOKEN_CACHE_SIZE", 10000)
+AUTH_TOKEN_CACHE_TTL = env_float("AUTH_TOKEN_CACHE_TTL", 300)
+# Chu kỳ (giây) đọc bảng user_change để bỏ cache user bị worker khác sửa
+AUTH_USER_CHANGE_POLL_SECONDS = env_float("AUTH_USER_CHANGE_POLL_SECONDS", 1.0)
+
+# =========================
+# PASSWORD (bcrypt)
+# =========================
+
+# Cost của hash mới; hash cũ khác cost được băm lại khi user đăng nhập đúng
+PASSWORD_BCRYPT_ROUNDS = env_int("PASSWORD_BCRYPT_ROUNDS", 12)
+# Số process băm mật khẩu mỗi worker uvicorn (0: chạy trên threadpool như trước)
+PASSWORD_WORKERS = env_int("PASSWORD_WORKERS", 2)
+# Số yêu cầu băm / kiểm tra đang chạy + chờ tối đa; vượt quá -> 503 ngay
+PASSWORD_MAX_PENDING = env_int("PASSWORD_MAX_PENDING", 32)
+
+# =========================
+# METRICS
+# =========================
+
+# Histogram theo bước xử lý / route / câu SQL + GET /metrics (Prometheus text);
+# 0: không đo gì, /metrics trả 404
+METRICS_ENABLED = env_bool("METRICS_ENABLED", True)
@@ -1,34 +1,219 @@
 from __future__ import annotations
-from contextlib import contextmanager
-from typing import Generator
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncGenerator, Callable, Generator
 import os
+import threading
+import time
 from datetime import datetime
+from urllib.parse import quote_plus
 
 from sqlalchemy import (
+    BigInteger,
     Column,
     Integer,
     Unicode,
     UnicodeText,
     DateTime,
     Boolean,
-    create_engine
+    Index,
+    create_engine,
+    event,
+    select,
+    update,
 )
+from sqlalchemy.engine import URL, Engine
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+import config
+from metrics import stage
 
 # =========================
 # DATABASE CONFIG
 # =========================
-SERVER_NAME = "DESKTOP-JBUKRLP\\MSSQLSERVER01"
-DATABASE_NAME = "ChatbotDB"
+def build_database_url(backend: str | None = None) -> str:
+    backend = backend or config.DB_BACKEND
+    if backend == "sqlite":
+        return f"sqlite:///{config.SQLITE_PATH}"
+    if backend == "postgresql":
+        return URL.create(
+            "postgresql+psycopg2",
+            username=config.POSTGRES_USER,
+            password=config.POSTGRES_PASSWORD or None,
+            host=config.POSTGRES_HOST,
+            port=config.POSTGRES_PORT,
+            database=config.POSTGRES_DB,
+        ).render_as_string(hide_password=False)
+    if backend == "mssql":
+        params = f"?driver={quote_plus(config.MSSQL_DRIVER)}&TrustServerCertificate=yes"
+        if not config.MSSQL_USER:
+            return f"mssql+pyodbc://@{config.MSSQL_SERVER}/{config.MSSQL_DATABASE}{params}&Trusted_Connection=yes"
+        credentials = f"{quote_plus(config.MSSQL_USER)}:{quote_plus(config.MSSQL_PASSWORD)}"
+        return f"mssql+pyodbc://{credentials}@{config.MSSQL_SERVER}/{config.MSSQL_DATABASE}{params}"
+    raise ValueError(f"DB_BACKEND không hỗ trợ: {backend}")
 
-DATABASE_URL = (
-    f"mssql+pyodbc://@{SERVER_NAME}/{DATABASE_NAME}"
-    "?driver=ODBC+Driver+17+for+SQL+Server"
-    "&Trusted_Connection=yes"
-    "&TrustServerCertificate=yes"
-)
 
-engine = create_engine(DATABASE_URL)
+DATABASE_URL = os.getenv("DATABASE_URL") or build_database_url()
+
+# Driver async tương ứng với driver sync (aiosqlite dùng cho local / test)
+ASYNC_DRIVERS = {
+    "mssql+pyodbc": "mssql+aioodbc",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# =========================
+# POOL METRICS
+# =========================
+class PoolMetrics:
+    """Thời gian chờ lấy connection từ pool (checkout) của một engine."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.pool: Pool | None = None
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+
+    def timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            data = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+        pool = self.pool
+        if isinstance(pool, QueuePool):
+            data.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+            )
+        return data
+
+
+sync_pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class _InstrumentedPoolMixin:
+    # pool.recreate() (dispose / invalidate) tạo lại cùng class -> metrics đi theo
+    metrics: PoolMetrics
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics.pool = self
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.timeout()
+            raise
+        finally:
+            self.metrics.observe(time.perf_counter() - start)
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    metrics = sync_pool_metrics
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics = async_pool_metrics
+
+
+def pool_metrics() -> dict:
+    return {"sync": sync_pool_metrics.snapshot(), "async": async_pool_metrics.snapshot()}
+
+# =========================
+# ENGINE FACTORY
+# =========================
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return _is_sqlite(url) and (url.partition("://")[2] in ("", "/", "/:memory:") or "mode=memory" in url)
+
+
+def _connect_args(url: str) -> dict:
+    if _is_sqlite(url):
+        # SQLite: connection được pool trao cho thread khác của threadpool
+        return {"check_same_thread": False}
+    if url.startswith("postgresql+asyncpg"):
+        return {"prepared_statement_cache_size": config.DB_STATEMENT_CACHE_SIZE}
+    return {}
+
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    options = {
+        "connect_args": _connect_args(url),
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+        "query_cache_size": config.DB_STATEMENT_CACHE_SIZE,
+    }
+    if _is_memory_sqlite(url):
+        # :memory: sống trong đúng một connection -> giữ pool mặc định của dialect
+        return options
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+    )
+    return options
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    if config.SQLITE_WAL:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.close()
+
+
+def create_db_engine(url: str = DATABASE_URL) -> Engine:
+    engine = create_engine(url, **engine_options(url))
+    if _is_sqlite(url):
+        event.listen(engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+def create_async_db_engine(url: str = ASYNC_DATABASE_URL) -> AsyncEngine:
+    engine = create_async_engine(url, **engine_options(url, is_async=True))
+    if _is_sqlite(url):
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -49,6 +234,16 @@ class Knowledge(Base):
     # ⭐⭐ THÊM DÒNG NÀY
     intent = Column(Unicode(50))
 
+
+class KnowledgeChange(Base):
+    """Nhật ký thay đổi knowledge: id tăng dần chính là generation của index."""
+    __tablename__ = "knowledge_change"
+
+    id = Column(Integer, primary_key=True)
+    knowledge_id = Column(Integer, nullable=False)
+    op = Column(Unicode(10), nullable=False)  # "upsert" | "delete"
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
 class ChatHistory(Base):
     __tablename__ = "chat_history"
 
@@ -60,6 +255,49 @@ class ChatHistory(Base):
     user_id = Column(Integer, index=True)
     is_pinned = Column(Boolean, default=False, nullable=False)
 
+    __table_args__ = (
+        # phân trang keyset tin nhắn theo (created_at, id) trong một hội thoại
+        Index("ix_chat_history_conv_created", "conversation_id", "created_at", "id"),
+    )
+
+
+class Conversation(Base):
+    """
+    Tóm tắt một hội thoại, cập nhật dần mỗi lần ghi ChatHistory
+    -> sidebar đọc một dải index thay vì GROUP BY toàn bộ chat_history.
+    """
+    __tablename__ = "conversations"
+
+    # cấp bởi IdBlockAllocator("conversation"), không dùng IDENTITY
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False)
+    title = Column(Unicode(255))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_message_at = Column(DateTime, nullable=False)
+    message_count = Column(Integer, default=0, nullable=False)
+    is_pinned = Column(Boolean, default=False, nullable=False)
+
+    __table_args__ = (
+        Index("ix_conversations_user_pinned_last", "user_id", "is_pinned", "last_message_at", "id"),
+    )
+
+
+class UserChange(Base):
+    """Nhật ký sửa/xóa user: worker khác đọc để bỏ cache user tương ứng."""
+    __tablename__ = "user_change"
+
+    id = Column(Integer, primary_key=True)
+    username = Column(Unicode(50), nullable=False)
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+
+class IdSequence(Base):
+    """Bộ đếm cấp id theo khối (hi/lo) cho các id không do IDENTITY sinh ra."""
+    __tablename__ = "id_sequence"
+
+    name = Column(Unicode(50), primary_key=True)
+    next_value = Column(BigInteger, nullable=False)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -80,17 +318,130 @@ class User(Base):
 def init_db():
     Base.metadata.create_all(bind=engine)
 
+# =========================
+# ASYNC ENGINE (tạo khi dùng lần đầu – driver async có thể chưa cài)
+# =========================
+_async_engine: AsyncEngine | None = None
+_AsyncSessionLocal: async_sessionmaker[AsyncSession] | None = None
+
+
+def get_async_engine() -> AsyncEngine:
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        _async_engine = create_async_db_engine()
+        _AsyncSessionLocal = async_sessionmaker(
+            _async_engine, autoflush=False, expire_on_commit=False
+        )
+    return _async_engine
+
 # =========================
 # SESSION
 # =========================
 @contextmanager
 def get_session() -> Generator[Session, None, None]:
-    db = SessionLocal()
+    # stage "db_session": từ lúc mở tới khi commit + trả connection về pool
+    with stage("db_session"):
+        db = SessionLocal()
+        try:
+            yield db
+            db.commit()
+        except:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+@asynccontextmanager
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    get_async_engine()
+    db = _AsyncSessionLocal()
     try:
         yield db
-        db.commit()
+        await db.commit()
     except:
-        db.rollback()
+        await db.rollback()
         raise
     finally:
-        db.close()
+        await db.close()
+
+# =========================
+# ID ALLOCATOR
+# =========================
+class IdBlockAllocator:
+    """
+    Cấp id tăng dần, không trùng giữa các worker: mỗi worker giữ trước một khối
+    `block_size` id bằng một UPDATE trên id_sequence (khoá dòng tới lúc commit),
+    sau đó cấp từng id trong bộ nhớ – không tốn round-trip trên hot path.
+    Worker khởi động lại sẽ bỏ phần còn lại của khối (id có thể nhảy cóc).
+
+    _lock chỉ giữ quanh phần đếm trong bộ nhớ (try_allocate gọi được trên event
+    loop); giữ khối mới xuống DB nằm dưới _reserve_lock riêng, chỉ allocate chờ.
+    """
+
+    def __init__(self, name: str, block_size: int, initial: Callable[[Session], int]):
+        self.name = name
+        self.block_size = block_size
+        # giá trị đầu tiên khi id_sequence chưa có dòng `name`
+        self._initial = initial
+        self._lock = threading.Lock()
+        self._reserve_lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def _reserve(self) -> tuple[int, int]:
+        n = self.block_size
+        while True:
+            with get_session() as db:
+                updated = db.execute(
+                    update(IdSequence)
+                    .where(IdSequence.name == self.name)
+                    .values(next_value=IdSequence.next_value + n)
+                ).rowcount
+                if updated:
+                    end = db.execute(
+                        select(IdSequence.next_value).where(IdSequence.name == self.name)
+                    ).scalar_one()
+                    return end - n, end
+
+            # lần đầu: khởi tạo dòng; worker khác chèn trước thì thử UPDATE lại
+            try:
+                with get_session() as db:
+                    start = self._initial(db)
+                    db.add(IdSequence(name=self.name, next_value=start + n))
+                return start, start + n
+            except IntegrityError:
+                continue
+
+    def issued(self, db: Session, value: int) -> bool:
+        """value đã được cấp cho một worker nào đó (nhỏ hơn next_value của id_sequence)."""
+        with self._lock:
+            if self._end - self.block_size <= value < self._next:
+                return True
+        next_value = db.execute(
+            select(IdSequence.next_value).where(IdSequence.name == self.name)
+        ).scalar()
+        return next_value is not None and 0 < value < next_value
+
+    def try_allocate(self) -> int | None:
+        """Id kế tiếp nếu khối hiện tại còn, không chạm DB; None nếu đã hết."""
+        with self._lock:
+            if self._next >= self._end:
+                return None
+            value = self._next
+            self._next += 1
+            return value
+
+    def allocate(self) -> int:
+        while True:
+            value = self.try_allocate()
+            if value is not None:
+                return value
+            with self._reserve_lock:
+                with self._lock:
+                    # thread khác vừa giữ khối mới trong lúc chờ
+                    if self._next < self._end:
+                        continue
+                start, end = self._reserve()
+                with self._lock:
+                    self._next, self._end = start, end
@@ -0,0 +1,346 @@
+"""
+Truy xuất theo vector (dense retrieval), chạy offline trên CPU:
+
+- Embedder: HashingEmbedder (không cần model, ổn định giữa các tiến trình)
+  hoặc SentenceTransformerEmbedder (model nhỏ, cài sentence-transformers)
+- VectorStore: ma trận float16/float32 trên đĩa, mở bằng np.load(mmap_mode="r")
+  -> mọi worker uvicorn dùng chung page cache của hệ điều hành, không ai giữ bản riêng
+- DenseIndex: store dựng sẵn (build_embeddings.py) + phần delta trong bộ nhớ
+  cho các dòng admin sửa sau đó; tìm top-k bằng tích vô hướng theo lô (NumPy),
+  hoặc qua IVFIndex (ann.py) khi store được dựng kèm cụm
+"""
+import json
+import logging
+import os
+import shutil
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Sequence
+
+import numpy as np
+
+from ann import IVFIndex, merge_top_k
+
+logger = logging.getLogger(__name__)
+
+
+# ======================
+# EMBEDDERS
+# ======================
+
+class HashingEmbedder:
+    """
+    Feature hashing: unigram + bigram từ và trigram ký tự của token đã bỏ dấu,
+    tf log, dấu +/- theo hash, chuẩn hóa L2. crc32 thay cho hash() vì hash()
+    của Python đổi theo từng tiến trình.
+    """
+
+    def __init__(self, dim: int, analyzer: Callable[[str], List[str]], fold: Callable[[str], str]):
+        self.dim = dim
+        self.analyzer = analyzer
+        self.fold = fold
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Dict[str, float]:
+        tokens = [self.fold(t) for t in self.analyzer(text)]
+        features: Dict[str, float] = {}
+        for i, tok in enumerate(tokens):
+            features["w:" + tok] = features.get("w:" + tok, 0.0) + 1.0
+            if i:
+                bigram = "b:" + tokens[i - 1] + " " + tok
+                features[bigram] = features.get(bigram, 0.0) + 1.0
+            padded = f" {tok} "
+            for j in range(len(padded) - 2):
+                gram = "c:" + padded[j:j + 3]
+                features[gram] = features.get(gram, 0.0) + 0.5
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, tf in self._features(text).items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                out[row, (h >> 1) % self.dim] += (1.0 if h & 1 else -1.0) * (1.0 + np.log(tf))
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+class SentenceTransformerEmbedder:
+    """Model sentence-transformers chạy local (tải một lần vào cache của thư viện)."""
+
+    def __init__(self, model_name: str):
+        # import muộn: thư viện tùy chọn, nặng
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return self.model.encode(
+            list(texts), batch_size=64, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def make_embedder(kind: str, model_name: str, dim: int, analyzer, fold):
+    if kind == "sentence-transformers":
+        try:
+            return SentenceTransformerEmbedder(model_name)
+        except ImportError:
+            logger.warning("Chưa cài sentence-transformers, dùng HashingEmbedder")
+    elif kind != "hashing":
+        raise ValueError(f"DENSE_EMBEDDER không hỗ trợ: {kind}")
+    return HashingEmbedder(dim, analyzer, fold)
+
+
+def content_hash(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+# ======================
+# VECTOR STORE (trên đĩa)
+# ======================
+
+class VectorStore:
+    """
+    Mỗi lần build ghi một thư mục phiên bản mới (vectors.npy, ids.npy,
+    hashes.npy, meta.json, thêm centroids.npy / offsets.npy nếu có IVF) rồi đổi file CURRENT bằng os.replace -> worker
+    đang đọc không bao giờ thấy bản ghi dở. Bản cũ bị xóa vẫn đọc được qua
+    mmap đang mở cho tới khi worker nạp lại.
+    """
+
+    KEEP_VERSIONS = 2
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @property
+    def _pointer(self) -> str:
+        return os.path.join(self.root, "CURRENT")
+
+    def current(self) -> str | None:
+        try:
+            with open(self._pointer, encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return os.path.join(self.root, name) if name else None
+
+    def write(self, ids: np.ndarray, vectors: np.ndarray, hashes: np.ndarray, meta: dict, dtype: str,
+              extra: Dict[str, np.ndarray] | None = None):
+        os.makedirs(self.root, exist_ok=True)
+        name = f"v{time.time_ns()}"
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+
+        matrix = np.lib.format.open_memmap(
+            os.path.join(path, "vectors.npy"), mode="w+", dtype=dtype, shape=vectors.shape
+        )
+        matrix[:] = vectors
+        matrix.flush()
+        del matrix
+        np.save(os.path.join(path, "ids.npy"), ids.astype(np.int64))
+        np.save(os.path.join(path, "hashes.npy"), hashes.astype(np.uint32))
+        for part, array in (extra or {}).items():
+            np.save(os.path.join(path, f"{part}.npy"), array)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        tmp = self._pointer + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(tmp, self._pointer)
+        self._cleanup(keep=name)
+        return path
+
+    def _cleanup(self, keep: str):
+        versions = sorted(
+            (d for d in os.listdir(self.root) if d.startswith("v") and d != keep),
+            reverse=True,
+        )
+        for old in versions[self.KEEP_VERSIONS - 1:]:
+            shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+
+    def open(self) -> tuple[str | None, dict, np.ndarray, np.ndarray, np.ndarray]:
+        """(phiên bản, meta, ids, hashes, vectors mmap chỉ đọc); chưa build thì rỗng."""
+        path = self.current()
+        if path is None or not os.path.exists(os.path.join(path, "meta.json")):
+            return None, {}, np.zeros(0, np.int64), np.zeros(0, np.uint32), np.zeros((0, 0), np.float32)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return (
+            path,
+            meta,
+            np.load(os.path.join(path, "ids.npy")),
+            np.load(os.path.join(path, "hashes.npy")),
+            np.load(os.path.join(path, "vectors.npy"), mmap_mode="r"),
+        )
+
+    @staticmethod
+    def load_extra(path: str, name: str) -> np.ndarray:
+        return np.load(os.path.join(path, f"{name}.npy"))
+
+
+# ======================
+# DENSE INDEX
+# ======================
+
+class DenseIndex:
+    """
+    Vector của document = phần trong store (mmap, chỉ đọc) + delta trong bộ nhớ.
+    Dòng nào bị sửa / xóa sau khi build thì bị che trong store (mask `_live`)
+    và (nếu còn) nằm ở delta. Store có cụm IVF và ann="ivf" thì delta nằm trong
+    danh sách phụ của IVFIndex, tìm kiếm chỉ quét nprobe cụm.
+    """
+
+    # số hàng store đổi sang float32 mỗi lượt nhân ma trận
+    BLOCK_ROWS = 16384
+    # số document embed mỗi lượt khi cập nhật theo lô
+    EMBED_BATCH = 256
+
+    def __init__(self, embedder, store: VectorStore, text_of: Callable[[object], str],
+                 ann: str = "none", nprobe: int = 16):
+        self.embedder = embedder
+        self.store = store
+        self.text_of = text_of
+        self.ann = ann
+        self.nprobe = nprobe
+        self.version: str | None = None
+        self._reset()
+
+    def _reset(self):
+        self._matrix = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self._store_ids = np.zeros(0, dtype=np.int64)
+        self._live = np.zeros(0, dtype=bool)
+        self._row: Dict[int, int] = {}
+        self._delta: Dict[int, np.ndarray] = {}
+        self._delta_ids = np.zeros(0, dtype=np.int64)
+        self._delta_matrix = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self._delta_dirty = False
+        self._ivf: IVFIndex | None = None
+
+    def __len__(self) -> int:
+        added = self._ivf.added if self._ivf is not None else len(self._delta)
+        return int(self._live.sum()) + added
+
+    # ---------- delta ----------
+
+    def load(self, docs: Iterable):
+        """Mở store hiện tại; document mới / đã sửa so với store thì embed vào delta."""
+        docs = list(docs)
+        self._reset()
+        version, meta, ids, hashes, matrix = self.store.open()
+        if version is not None and meta.get("embedder") != self.embedder.name:
+            logger.warning("Vector store dựng bằng %s, bỏ qua (đang dùng %s)", meta.get("embedder"), self.embedder.name)
+            version = None
+        if version is not None:
+            self._matrix = matrix
+            self._store_ids = ids
+            self._row = {int(doc_id): i for i, doc_id in enumerate(ids)}
+        self.version = version
+        self._live = np.zeros(len(self._store_ids), dtype=bool)
+        if version is not None and self.ann == "ivf" and meta.get("ann") == "ivf":
+            self._ivf = IVFIndex(
+                self.store.load_extra(version, "centroids"),
+                self.store.load_extra(version, "offsets"),
+                self._matrix, self._store_ids, self._live, self.nprobe,
+            )
+
+        stale = []
+        for doc in docs:
+            row = self._row.get(doc.id)
+            if row is not None and int(hashes[row]) == content_hash(self.text_of(doc)):
+                self._live[row] = True
+            else:
+                stale.append(doc)
+        if stale:
+            self._embed_into_delta(stale)
+
+    def _embed_into_delta(self, docs: List):
+        vectors = self.embedder.embed([self.text_of(doc) for doc in docs])
+        for doc, vec in zip(docs, vectors):
+            row = self._row.get(doc.id)
+            if row is not None:
+                self._live[row] = False
+            if self._ivf is not None:
+                self._ivf.add(doc.id, vec)
+            else:
+                self._delta[doc.id] = vec
+                self._delta_dirty = True
+
+    def upsert(self, doc):
+        self._embed_into_delta([doc])
+
+    def upsert_many(self, docs: Sequence):
+        for i in range(0, len(docs), self.EMBED_BATCH):
+            self._embed_into_delta(list(docs[i:i + self.EMBED_BATCH]))
+
+    def remove(self, doc_id: int):
+        row = self._row.get(doc_id)
+        if row is not None:
+            self._live[row] = False
+        if self._ivf is not None:
+            self._ivf.discard(doc_id)
+        elif self._delta.pop(doc_id, None) is not None:
+            self._delta_dirty = True
+
+    def store_changed(self) -> bool:
+        return self.store.current() != self.version
+
+    # ---------- query ----------
+
+    def embed_queries(self, texts: Sequence[str]) -> np.ndarray:
+        return self.embedder.embed(texts)
+
+    def _delta_arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        if self._delta_dirty:
+            self._delta_ids = np.fromiter(self._delta.keys(), dtype=np.int64, count=len(self._delta))
+            self._delta_matrix = (
+                np.stack(list(self._delta.values())) if self._delta
+                else np.zeros((0, self.embedder.dim), dtype=np.float32)
+            )
+            self._delta_dirty = False
+        return self._delta_ids, self._delta_matrix
+
+    def search(self, queries: np.ndarray, k: int) -> List[List[tuple[float, int]]]:
+        """queries: (b, dim) đã chuẩn hóa -> mỗi câu k cặp (cosine, doc id) giảm dần."""
+        queries = np.asarray(queries, dtype=np.float32)
+        if self._ivf is not None:
+            return self._ivf.search(queries, k, self.nprobe)
+        b = queries.shape[0]
+        best_scores = np.zeros((b, 0), dtype=np.float32)
+        best_ids = np.zeros((b, 0), dtype=np.int64)
+
+        def consider(scores: np.ndarray, ids: np.ndarray):
+            nonlocal best_scores, best_ids
+            scores, ids = merge_top_k(scores, np.broadcast_to(ids, scores.shape), k)
+            best_scores, best_ids = merge_top_k(
+                np.concatenate([best_scores, scores], axis=1),
+                np.concatenate([best_ids, ids], axis=1),
+                k,
+            )
+
+        live = self._live
+        for start in range(0, len(self._store_ids), self.BLOCK_ROWS):
+            end = start + self.BLOCK_ROWS
+            mask = live[start:end]
+            if not mask.any():
+                continue
+            block = np.asarray(self._matrix[start:end], dtype=np.float32)
+            scores = queries @ block.T
+            if not mask.all():
+                scores[:, ~mask] = -np.inf
+            consider(scores, self._store_ids[start:end])
+
+        delta_ids, delta_matrix = self._delta_arrays()
+        if len(delta_ids):
+            consider(queries @ delta_matrix.T, delta_ids)
+
+        results = []
+        for scores, ids in zip(best_scores, best_ids):
+            order = np.argsort(-scores, kind="stable")
+            results.append([
+                (float(scores[i]), int(ids[i])) for i in order if np.isfinite(scores[i])
+            ])
+        return results
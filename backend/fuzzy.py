@@ -0,0 +1,196 @@
+"""
+Tìm gần đúng trên keywords + title cho câu hỏi gõ không dấu / gõ sai chính tả:
+- index phụ theo term đã bỏ dấu: "đăng" và "dang" về cùng một term
+- index trigram ký tự của các term đó: sinh ứng viên sai chính tả bằng cách
+  đếm trigram chung qua postings, không so câu hỏi với toàn bộ từ vựng
+"""
+import heapq
+import math
+from typing import Callable, Dict, Iterable, List, Sequence, Set
+
+from scorers import Terms, term_weights
+
+
+def trigrams(term: str) -> Set[str]:
+    padded = f" {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+
+    # token hỏi -> {term bỏ dấu: độ giống}
+    CACHE_SIZE = 1024
+
+    def __init__(
+        self,
+        fold: Callable[[str], str],
+        field_points: Sequence[float],
+        intent_weight: float,
+        min_similarity: float,
+    ):
+        self.fold = fold
+        self.field_points = field_points
+        self.intent_weight = intent_weight
+        self.min_similarity = min_similarity
+        self._reset()
+
+    def _reset(self):
+        # term bỏ dấu -> {doc id: bitmask trường}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        # trigram -> {số trigram của term: các term bỏ dấu chứa nó}: chia theo
+        # độ dài để lọc theo ngưỡng độ giống trước khi đếm; term -> số trigram của nó
+        self._grams: Dict[str, Dict[int, Set[str]]] = {}
+        self._gram_count: Dict[str, int] = {}
+        self._doc_terms: Dict[int, Dict[str, int]] = {}
+        self._by_intent: Dict[str, Set[int]] = {}
+        self._doc_intent: Dict[int, str] = {}
+        self._cache: Dict[str, Dict[str, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+    # ---------- delta ----------
+
+    def load(self, docs: Iterable[tuple[int, Dict[str, int], str]]):
+        self._reset()
+        for doc_id, terms, intent in docs:
+            self.add(doc_id, terms, intent)
+
+    def add(self, doc_id: int, terms: Dict[str, int], intent: str = ""):
+        """terms: term gốc -> bitmask trường (chỉ nên gồm keywords/title)."""
+        if doc_id in self._doc_terms:
+            self.remove(doc_id)
+
+        folded: Dict[str, int] = {}
+        for term, bits in terms.items():
+            key = self.fold(term)
+            folded[key] = folded.get(key, 0) | bits
+
+        for key, bits in folded.items():
+            postings = self._postings.get(key)
+            if postings is None:
+                postings = self._postings[key] = {}
+                grams = trigrams(key)
+                size = self._gram_count[key] = len(grams)
+                for g in grams:
+                    self._grams.setdefault(g, {}).setdefault(size, set()).add(key)
+            postings[doc_id] = bits
+        self._doc_terms[doc_id] = folded
+
+        if intent:
+            self._by_intent.setdefault(intent, set()).add(doc_id)
+            self._doc_intent[doc_id] = intent
+        self._cache.clear()
+
+    def remove(self, doc_id: int):
+        for key in self._doc_terms.pop(doc_id, {}):
+            postings = self._postings.get(key)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[key]
+                size = self._gram_count.pop(key)
+                for g in trigrams(key):
+                    by_size = self._grams.get(g)
+                    terms = by_size.get(size) if by_size is not None else None
+                    if terms is not None:
+                        terms.discard(key)
+                        if not terms:
+                            del by_size[size]
+                            if not by_size:
+                                del self._grams[g]
+
+        intent = self._doc_intent.pop(doc_id, None)
+        if intent is not None:
+            ids = self._by_intent.get(intent)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self._by_intent[intent]
+        self._cache.clear()
+
+    # ---------- query ----------
+
+    def candidates(self, token: str) -> Dict[str, float]:
+        """Term bỏ dấu giống `token` -> độ giống (Dice trên trigram, 1.0 = trùng)."""
+        key = self.fold(token)
+        found = self._cache.get(key)
+        if found is not None:
+            return found
+
+        if key in self._postings:
+            found = {key: 1.0}
+        else:
+            found = self._similar(key)
+
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.clear()
+        self._cache[key] = found
+        return found
+
+    def _similar(self, key: str) -> Dict[str, float]:
+        """
+        Dice(A, B) = 2|A∩B| / (|A| + |B|) >= s kéo theo |A∩B| >= s(|A| + |B|) / 2 = t,
+        nên chỉ term có s|A| / (2 - s) <= |B| <= |A|(2 - s) / s mới có thể đạt.
+        Xét riêng từng độ dài |B| (postings đã chia theo số trigram), m = số
+        trigram câu hỏi có term dài |B|: term đạt ngưỡng phải có ít nhất một
+        trigram trong (m - t + 1) trigram hiếm nhất -> chỉ gom ứng viên từ các
+        trigram đó, trigram phổ biến chỉ dùng để đếm tiếp cho ứng viên đã có.
+        |B| càng lớn t càng lớn, phần gom ứng viên càng ngắn.
+        """
+        s = self.min_similarity
+        grams = trigrams(key)
+        size = len(grams)
+        lo = max(1, math.ceil(s * size / (2 - s) - 1e-9))
+        hi = math.floor(size * (2 - s) / s + 1e-9) if s > 0 else max(self._gram_count.values(), default=0)
+        by_gram = [by_size for by_size in map(self._grams.get, grams) if by_size]
+
+        found: Dict[str, float] = {}
+        for n in range(lo, hi + 1):
+            needed = max(1, math.ceil(s * (size + n) / 2 - 1e-9))
+            # chỉ trigram có term dài n mới góp vào |A∩B|: ít hơn t thì bỏ cả độ dài này
+            postings = [by_size[n] for by_size in by_gram if n in by_size]
+            if len(postings) < needed:
+                continue
+            postings.sort(key=len)
+            prefix = len(postings) - needed + 1
+
+            shared: Dict[str, int] = {}
+            for terms in postings[:prefix]:
+                for term in terms:
+                    shared[term] = shared.get(term, 0) + 1
+            if not shared:
+                continue
+            for terms in postings[prefix:]:
+                for term in shared:
+                    if term in terms:
+                        shared[term] += 1
+
+            for term, count in shared.items():
+                if count >= needed:
+                    found[term] = 2 * count / (size + n)
+        return found
+
+    def scores(self, tokens: Terms, intents: Set[str]) -> Dict[int, float]:
+        points = self.field_points
+        scores: Dict[int, float] = {}
+        for token, weight in term_weights(tokens).items():
+            # mỗi document lấy term khớp tốt nhất của token này
+            best: Dict[int, float] = {}
+            for term, similarity in self.candidates(token).items():
+                for doc_id, bits in self._postings[term].items():
+                    value = similarity * points[bits]
+                    if value > best.get(doc_id, 0):
+                        best[doc_id] = value
+            for doc_id, value in best.items():
+                scores[doc_id] = scores.get(doc_id, 0) + weight * value
+        for intent in intents:
+            for doc_id in self._by_intent.get(intent, ()):
+                scores[doc_id] = scores.get(doc_id, 0) + self.intent_weight
+        return scores
+
+    def top_k(self, tokens: Terms, intents: Set[str], k: int) -> List[tuple[float, int]]:
+        scores = self.scores(tokens, intents)
+        best = heapq.nlargest(k, scores.items(), key=lambda kv: (kv[1], -kv[0]))
+        return [(score, doc_id) for doc_id, score in best]
@@ -0,0 +1,348 @@
+"""
+Ghi ChatHistory kiểu write-behind: /chat trả lời ngay, các dòng lịch sử được
+gom lại và insert hàng loạt theo lô (đủ kích thước hoặc hết chu kỳ).
+"""
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import bindparam, case, insert, select, text, update
+
+from db import ChatHistory, Conversation, get_session
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryQueueFull(Exception):
+    """Hàng đợi đầy quá thời gian chờ – DB không theo kịp tốc độ chat."""
+
+
+class HistoryWriter:
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_pending: int = 10000, submit_timeout: float = 2.0,
+                 enabled: bool = True, max_retries: int = 3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.submit_timeout = submit_timeout
+        self.enabled = enabled
+        self.max_retries = max_retries
+
+        self._cond = threading.Condition()
+        self._buffer: List[dict] = []
+        # số dòng đã lấy khỏi buffer mà chưa commit / bỏ -> vẫn tính vào max_pending
+        self._inflight = 0
+        # số lần ghi lỗi liên tiếp của lô đầu hàng đợi
+        self._failures = 0
+        # user id -> số dòng đã nhận nhưng chưa commit (kể cả đang ghi)
+        self._pending: Counter = Counter()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+
+        self.flushed_rows = 0
+        self.failed_batches = 0
+        self.dropped_rows = 0
+
+    # ---------- vòng đời (FastAPI lifespan) ----------
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # bảo đảm không còn dòng nào trong bộ nhớ khi tắt server
+        self.flush()
+
+    # ---------- producer ----------
+
+    def _row(self, conversation_id: int, user_id: int, question: str, answer: str) -> dict:
+        return {
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "question": question,
+            "answer": answer,
+            # giờ nhận tin nhắn, không phải giờ flush -> thứ tự tin nhắn giữ nguyên
+            "created_at": datetime.utcnow(),
+            "is_pinned": False,
+        }
+
+    def try_submit(self, conversation_id: int, user_id: int, question: str, answer: str) -> bool:
+        """
+        Không chờ, không chạm DB (gọi được trên event loop): trả False nếu hàng
+        đợi đầy hoặc write-behind tắt -> caller dùng submit trên thread.
+        """
+        if not self.enabled:
+            return False
+        row = self._row(conversation_id, user_id, question, answer)
+        with self._cond:
+            if self._queued() >= self.max_pending:
+                return False
+            self._append(row)
+        return True
+
+    def submit(self, conversation_id: int, user_id: int, question: str, answer: str):
+        """Chờ tối đa submit_timeout khi hàng đợi đầy (back-pressure)."""
+        row = self._row(conversation_id, user_id, question, answer)
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self._queued() < self.max_pending, self.submit_timeout
+            ):
+                raise HistoryQueueFull()
+            self._append(row)
+        if not self.enabled:
+            self.flush()
+
+    def write_many(self, turns: List[tuple[int, int, str, str]]):
+        """
+        Ghi ngay một lô (conversation id, user id, câu hỏi, trả lời), vd. /chat/batch:
+        một transaction, một lệnh INSERT nhiều dòng, không qua hàng đợi.
+        Lỗi DB được ném ra cho caller.
+        """
+        rows = [self._row(*turn) for turn in turns]
+        try:
+            with stage("history_write"), get_session() as db:
+                db.execute(insert(ChatHistory), rows)
+                self._apply_summaries(db, self._summaries(rows))
+        except Exception:
+            logger.exception("Ghi %d dòng chat_history (lô) thất bại", len(rows))
+            raise
+        with self._cond:
+            self.flushed_rows += len(rows)
+
+    def _queued(self) -> int:
+        return len(self._buffer) + self._inflight
+
+    def _append(self, row: dict):
+        self._buffer.append(row)
+        self._pending[row["user_id"]] += 1
+        if len(self._buffer) >= self.batch_size:
+            self._cond.notify_all()
+
+    # ---------- read-your-writes ----------
+
+    def has_pending(self, user_id: int) -> bool:
+        with self._cond:
+            return self._pending[user_id] > 0
+
+    def wait_user(self, user_id: int, timeout: float | None = None, flush: bool = True) -> bool:
+        """
+        Chờ tới khi các tin nhắn user vừa gửi đọc lại được từ DB.
+        flush=False: không ép ghi ngay, chờ lượt flush định kỳ (giữ nguyên batch).
+        """
+        if not self.has_pending(user_id):
+            return True
+        if flush:
+            self.flush()
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending[user_id] == 0, timeout)
+
+    # ---------- consumer ----------
+
+    def _take(self, limit: int | None) -> List[dict]:
+        batch = self._buffer[:limit] if limit else self._buffer[:]
+        del self._buffer[:len(batch)]
+        # chỗ của lô chỉ được nhả khi commit xong (_done), không phải lúc lấy ra
+        self._inflight += len(batch)
+        return batch
+
+    @staticmethod
+    def _summaries(batch: List[dict]) -> Dict[tuple, dict]:
+        """(conversation id, user id) -> phần cộng thêm vào dòng conversations."""
+        summaries: Dict[tuple, dict] = {}
+        for row in batch:
+            key = row["conversation_id"], row["user_id"]
+            s = summaries.get(key)
+            if s is None:
+                summaries[key] = {
+                    "id": row["conversation_id"],
+                    "user_id": row["user_id"],
+                    "title": row["question"][:255],
+                    "created_at": row["created_at"],
+                    "last_message_at": row["created_at"],
+                    "message_count": 1,
+                    "is_pinned": False,
+                }
+            else:
+                s["last_message_at"] = max(s["last_message_at"], row["created_at"])
+                s["message_count"] += 1
+        return summaries
+
+    @staticmethod
+    def _apply_summaries(db, summaries: Dict[tuple, dict]):
+        """
+        Upsert dòng conversations theo id; chỉ cộng vào dòng của đúng user
+        (id đã thuộc user khác thì bỏ qua, không sửa tóm tắt của người đó).
+        """
+        if not summaries:
+            return
+        rows = list(summaries.values())
+        dialect = db.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as upsert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as upsert
+            stmt = upsert(Conversation)
+            excluded = stmt.excluded
+            # INSERT ... ON CONFLICT: hai writer cùng chèn một hội thoại không còn
+            # làm hỏng cả lô (và bị thử lại mãi)
+            db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[Conversation.id],
+                    set_={
+                        "message_count": Conversation.message_count + excluded.message_count,
+                        "last_message_at": case(
+                            (Conversation.last_message_at < excluded.last_message_at, excluded.last_message_at),
+                            else_=Conversation.last_message_at,
+                        ),
+                    },
+                    where=Conversation.user_id == excluded.user_id,
+                ),
+                rows,
+            )
+            return
+
+        # DB khác (MSSQL): đọc rồi chèn / cập nhật, cùng điều kiện (id, user_id).
+        # Hai writer cùng chèn -> IntegrityError, lô được thử lại và lần sau
+        # dòng đã có nên đi nhánh UPDATE.
+        ids = sorted({s["id"] for s in rows})
+        owners: Dict[int, int] = {}
+        for i in range(0, len(ids), 1000):
+            owners.update(db.execute(
+                select(Conversation.id, Conversation.user_id).where(Conversation.id.in_(ids[i:i + 1000]))
+            ).tuples())
+
+        # id chưa có: chèn dòng đầu tiên của id đó (một id chỉ có một chủ)
+        new: Dict[int, dict] = {}
+        for s in rows:
+            if s["id"] not in owners:
+                new.setdefault(s["id"], s)
+        if new:
+            db.execute(insert(Conversation), list(new.values()))
+
+        changed = [
+            {"cid": s["id"], "uid": s["user_id"], "n": s["message_count"], "last": s["last_message_at"]}
+            for s in rows if owners.get(s["id"]) == s["user_id"]
+        ]
+        if changed:
+            last = bindparam("last")
+            db.connection().execute(
+                update(Conversation)
+                .where(Conversation.id == bindparam("cid"), Conversation.user_id == bindparam("uid"))
+                .values(
+                    message_count=Conversation.message_count + bindparam("n"),
+                    last_message_at=case(
+                        (Conversation.last_message_at < last, last),
+                        else_=Conversation.last_message_at,
+                    ),
+                ),
+                changed,
+            )
+
+    def _commit(self, batch: List[dict]) -> bool:
+        try:
+            with stage("history_write"), get_session() as db:
+                db.execute(insert(ChatHistory), batch)
+                # cùng transaction: bảng tóm tắt không lệch với chat_history
+                self._apply_summaries(db, self._summaries(batch))
+        except Exception:
+            logger.exception("Ghi %d dòng chat_history thất bại", len(batch))
+            with self._cond:
+                self.failed_batches += 1
+            return False
+        return True
+
+    def _done(self, batch: List[dict], dropped: bool = False):
+        """Lô đã commit (hoặc bị bỏ): nhả chỗ trong hàng đợi, hết chờ read-your-writes."""
+        done: Dict[int, int] = Counter(row["user_id"] for row in batch)
+        with self._cond:
+            self._pending.subtract(done)
+            for uid in done:
+                if self._pending[uid] <= 0:
+                    del self._pending[uid]
+            self._inflight -= len(batch)
+            if dropped:
+                self.dropped_rows += len(batch)
+            else:
+                self.flushed_rows += len(batch)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _db_alive() -> bool:
+        try:
+            with get_session() as db:
+                db.execute(text("SELECT 1"))
+        except Exception:
+            return False
+        return True
+
+    def _salvage(self, batch: List[dict]):
+        """Chia đôi lô lỗi tới từng dòng: ghi phần ghi được, bỏ (dead-letter vào log) dòng hỏng."""
+        if len(batch) == 1:
+            logger.error("Bỏ dòng chat_history không ghi được: %r", batch[0])
+            self._done(batch, dropped=True)
+            return
+        mid = len(batch) // 2
+        for part in (batch[:mid], batch[mid:]):
+            if self._commit(part):
+                self._done(part)
+            else:
+                self._salvage(part)
+
+    def _write(self, batch: List[dict]) -> bool:
+        if self._commit(batch):
+            with self._cond:
+                self._failures = 0
+            self._done(batch)
+            return True
+
+        with self._cond:
+            self._failures += 1
+            give_up = self._failures >= self.max_retries
+        # lỗi max_retries lần mà DB vẫn trả lời: lỗi nằm ở dữ liệu của lô,
+        # không thử lại mãi (chặn mọi lô sau) mà tách dòng hỏng ra
+        if give_up and self._db_alive():
+            with self._cond:
+                self._failures = 0
+            self._salvage(batch)
+            return True
+
+        with self._cond:
+            # DB không tới được: trả lại đầu hàng đợi, giữ thứ tự; chỗ của lô vẫn
+            # tính vào max_pending nên producer không đẩy buffer vượt giới hạn
+            self._buffer[:0] = batch
+            self._inflight -= len(batch)
+        return False
+
+    def flush(self) -> bool:
+        with self._cond:
+            batch = self._take(None)
+        return self._write(batch) if batch else True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopping or len(self._buffer) >= self.batch_size,
+                    self.flush_interval,
+                )
+                if self._stopping:
+                    return
+                batch = self._take(self.batch_size)
+            if batch and not self._write(batch):
+                with self._cond:
+                    # DB lỗi: nghỉ một chu kỳ trước khi thử lại
+                    self._cond.wait(self.flush_interval)
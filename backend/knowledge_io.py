@@ -0,0 +1,208 @@
+"""
+Nhập / xuất knowledge hàng loạt cho admin API:
+- đọc NDJSON / CSV từng bản ghi từ file upload (FastAPI đã spool ra đĩa),
+  không nạp cả file vào bộ nhớ
+- ghi theo lô: mỗi lô một transaction + một lần cập nhật index
+- lỗi của từng dòng được ghi lại (số dòng + lý do), không làm hỏng cả lô
+"""
+import csv
+import io
+import json
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List
+
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import Knowledge, KnowledgeChange, get_session
+from rag import KnowledgeDoc
+
+FIELDS = ("id", "title", "content", "keywords", "intent")
+
+
+class KnowledgeRecord(BaseModel):
+    # có id và id tồn tại -> ghi đè dòng đó; không có / không tồn tại -> thêm mới
+    id: int | None = None
+    title: str | None = Field(default=None, max_length=255)
+    content: str = Field(min_length=1)
+    keywords: str | None = None
+    intent: str | None = Field(default=None, max_length=50)
+
+
+class ImportReport:
+    __slots__ = ("created", "updated", "failed", "errors", "max_errors")
+
+    def __init__(self, max_errors: int):
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+        self.max_errors = max_errors
+
+    def fail(self, line: int, error: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "error": error})
+
+    def to_dict(self) -> dict:
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+# ======================
+# ĐỌC FILE
+# ======================
+
+def read_ndjson(stream: BinaryIO) -> Iterator[tuple[int, dict | str]]:
+    """(số dòng, object) hoặc (số dòng, lý do lỗi) cho mỗi dòng không rỗng."""
+    for line_no, raw in enumerate(stream, 1):
+        line = raw.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError as e:
+            yield line_no, f"JSON không hợp lệ: {e}"
+            continue
+        if not isinstance(value, dict):
+            yield line_no, "mỗi dòng phải là một JSON object"
+            continue
+        yield line_no, value
+
+
+def read_csv(stream: BinaryIO) -> Iterator[tuple[int, dict | str]]:
+    """Dòng đầu là tên cột (FIELDS); ô trống = không có giá trị."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.DictReader(text)
+        if reader.fieldnames is None or "content" not in reader.fieldnames:
+            raise ValueError("CSV cần dòng tiêu đề có cột content")
+        for row in reader:
+            # line_num: dòng cuối của bản ghi (content có thể xuống dòng)
+            yield reader.line_num, {k: v for k, v in row.items() if k and v not in ("", None)}
+    finally:
+        # trả file lại cho UploadFile, không để wrapper đóng nó
+        text.detach()
+
+
+READERS: Dict[str, Callable[[BinaryIO], Iterator[tuple[int, dict | str]]]] = {
+    "ndjson": read_ndjson,
+    "csv": read_csv,
+}
+
+
+# ======================
+# GHI THEO LÔ
+# ======================
+
+def _describe(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in e['loc']) or 'dòng'}: {e['msg']}" for e in error.errors()
+    )
+
+
+def _save(batch: List[tuple[int, KnowledgeRecord]]) -> tuple[List[KnowledgeDoc], int]:
+    """Một transaction cho cả lô -> (document đã ghi, số dòng thêm mới)."""
+    with get_session() as db:
+        ids = sorted({rec.id for _, rec in batch if rec.id is not None})
+        existing: Dict[int, Knowledge] = {}
+        # chia nhỏ IN (...) – MSSQL giới hạn ~2100 tham số mỗi câu lệnh
+        for i in range(0, len(ids), 1000):
+            for row in db.query(Knowledge).filter(Knowledge.id.in_(ids[i:i + 1000])):
+                existing[row.id] = row
+
+        rows: List[Knowledge] = []
+        created = 0
+        for _, rec in batch:
+            row = existing.get(rec.id) if rec.id is not None else None
+            if row is None:
+                row = Knowledge()
+                db.add(row)
+                created += 1
+            row.title = rec.title
+            row.content = rec.content
+            row.keywords = rec.keywords
+            row.intent = rec.intent
+            rows.append(row)
+
+        db.flush()
+        db.add_all([KnowledgeChange(knowledge_id=row.id, op="upsert") for row in rows])
+        # đọc trước khi commit: sau commit các thuộc tính bị expire
+        docs = [KnowledgeDoc.from_row(row) for row in rows]
+    return docs, created
+
+
+def _write_batch(batch: List[tuple[int, KnowledgeRecord]], report: ImportReport,
+                 on_batch: Callable[[List[KnowledgeDoc]], None]):
+    try:
+        docs, created = _save(batch)
+    except SQLAlchemyError:
+        # lô hỏng vì một vài dòng -> ghi lại từng dòng để biết dòng nào lỗi
+        docs, created = [], 0
+        for line_no, rec in batch:
+            try:
+                one, n = _save([(line_no, rec)])
+            except SQLAlchemyError as e:
+                report.fail(line_no, str(getattr(e, "orig", None) or e)[:300])
+                continue
+            docs += one
+            created += n
+
+    report.created += created
+    report.updated += len(docs) - created
+    if docs:
+        on_batch(docs)
+
+
+def import_records(
+    records: Iterable[tuple[int, dict | str]],
+    on_batch: Callable[[List[KnowledgeDoc]], None],
+    batch_size: int,
+    max_errors: int,
+) -> ImportReport:
+    """on_batch: gọi một lần sau mỗi lô đã commit (cập nhật index)."""
+    report = ImportReport(max_errors)
+    batch: List[tuple[int, KnowledgeRecord]] = []
+    for line_no, value in records:
+        if isinstance(value, str):
+            report.fail(line_no, value)
+            continue
+        try:
+            batch.append((line_no, KnowledgeRecord.model_validate(value)))
+        except ValidationError as e:
+            report.fail(line_no, _describe(e))
+            continue
+        if len(batch) >= batch_size:
+            _write_batch(batch, report, on_batch)
+            batch = []
+    if batch:
+        _write_batch(batch, report, on_batch)
+    return report
+
+
+# ======================
+# XUẤT
+# ======================
+
+def export_ndjson(page_size: int) -> Iterator[str]:
+    """Mỗi dòng một knowledge, đọc theo trang id tăng dần (mỗi trang một session ngắn)."""
+    last_id = 0
+    while True:
+        with get_session() as db:
+            rows = (
+                db.query(Knowledge.id, Knowledge.title, Knowledge.content, Knowledge.keywords, Knowledge.intent)
+                .filter(Knowledge.id > last_id)
+                .order_by(Knowledge.id)
+                .limit(page_size)
+                .all()
+            )
+        if not rows:
+            return
+        yield "".join(
+            json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + "\n" for row in rows
+        )
+        last_id = rows[-1].id
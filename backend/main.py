@@ -1,17 +1,59 @@
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, File, HTTPException, Header, Query, UploadFile
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+from datetime import datetime
+import base64
+import json
 import os
 
 import auth
+import config
+import knowledge_io
+import metrics
 from auth import router as auth_router, verify_token
-from db import Knowledge, get_session, init_db, User, ChatHistory
+from cache import TTLCache
+from db import (
+    ChatHistory,
+    Conversation,
+    IdBlockAllocator,
+    Knowledge,
+    KnowledgeChange,
+    User,
+    get_async_session,
+    get_session,
+    init_db,
+    pool_metrics,
+)
+from history import HistoryQueueFull, HistoryWriter
 from rag import RAGChatbot
-from sqlalchemy import func, case
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+
+history_writer = HistoryWriter(
+    batch_size=config.HISTORY_BATCH_SIZE,
+    flush_interval=config.HISTORY_FLUSH_SECONDS,
+    max_pending=config.HISTORY_MAX_PENDING,
+    submit_timeout=config.HISTORY_SUBMIT_TIMEOUT,
+    enabled=config.HISTORY_WRITE_BEHIND,
+    max_retries=config.HISTORY_MAX_RETRIES,
+)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    history_writer.start()
+    auth.password_pool.start()
+    yield
+    # flush nốt lịch sử chat còn trong bộ nhớ trước khi tắt
+    await run_in_threadpool(history_writer.stop)
+    await run_in_threadpool(auth.password_pool.stop)
+
+
+app = FastAPI(lifespan=lifespan)
 
 # ===== AUTH =====
 app.include_router(auth_router)
@@ -28,10 +70,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ===== METRICS =====
+# tắt (METRICS_ENABLED=0) thì không gắn middleware / event SQL nào
+if metrics.ENABLED:
+    metrics.instrument_sql()
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # ===== DB =====
 init_db()
 bot = RAGChatbot()
 
+# id hội thoại mới: cấp theo khối từ id_sequence, không còn MAX(conversation_id) + 1
+conversation_ids = IdBlockAllocator(
+    "conversation",
+    config.CONVERSATION_ID_BLOCK,
+    initial=lambda db: (db.query(func.max(ChatHistory.conversation_id)).scalar() or 0) + 1,
+)
+# conversation_id -> user_id; hội thoại không đổi chủ nên cache không cần bỏ, trừ khi xóa
+conversation_owners = TTLCache(config.CONVERSATION_OWNER_CACHE_SIZE, config.CONVERSATION_OWNER_CACHE_TTL)
+
 # =======================
 # HELPERS
 # =======================
@@ -44,18 +101,153 @@ def get_current_user(authorization: str | None):
     payload = verify_token(token)
     username = payload.get("sub")
 
+    # ✅ TRẢ DICT – KHÔNG TRẢ ORM (lấy từ cache, miss mới hỏi DB)
+    user = auth.get_user(username)
+    return user.to_dict() if user else None
+
+
+async def get_current_user_async(authorization: str | None):
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+
+    token = authorization.replace("Bearer ", "")
+    payload = verify_token(token)
+    username = payload.get("sub")
+
+    with metrics.stage("user_lookup"):
+        if auth.user_changes_due():
+            await run_in_threadpool(auth.poll_user_changes)
+
+        user = auth.user_cache.get(username)
+        if user is None:
+            async with get_async_session() as db:
+                row = (
+                    await db.execute(select(*auth.USER_COLUMNS).where(User.username == username))
+                ).first()
+            if not row:
+                return None
+            user = auth.CachedUser(*row)
+            auth.user_cache.set(username, user)
+
+    return user.to_dict()
+
+
+def wait_history(user: dict):
+    # read-your-writes: tin nhắn vừa gửi có thể còn nằm trong history_writer
+    if not history_writer.wait_user(user["id"], config.HISTORY_SUBMIT_TIMEOUT):
+        raise HTTPException(503, "Lịch sử chat đang được lưu, vui lòng thử lại")
+
+
+def conversation_owner(cid: int, user: dict) -> int | None:
+    """
+    User sở hữu hội thoại cid; None nếu id chưa từng được cấp. Id đã cấp mà
+    chưa có dòng conversations (lượt đầu còn trong buffer của worker này hoặc
+    worker khác) được coi là của người hỏi: chỉ từ chối khi dòng đã có và
+    thuộc user khác. Trùng hợp hiếm (user khác đoán đúng id chưa flush) thì
+    upsert tóm tắt vẫn giữ chủ là user ghi trước.
+    """
+    owner = conversation_owners.get(cid)
+    if owner is not None:
+        return owner
+    # lượt đầu còn trong history_writer của chính worker này: ghi xong rồi đọc
+    if history_writer.has_pending(user["id"]):
+        history_writer.wait_user(user["id"], config.HISTORY_SUBMIT_TIMEOUT)
     with get_session() as db:
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            return None
+        owner = db.query(Conversation.user_id).filter(Conversation.id == cid).scalar()
+        if owner is None:
+            # không cache: khi dòng được ghi, chủ thật có thể khác
+            return user["id"] if conversation_ids.issued(db, cid) else None
+    conversation_owners.set(cid, owner)
+    return owner
 
-        # ✅ TRẢ DICT – KHÔNG TRẢ ORM
-        return {
-            "id": user.id,
-            "username": user.username,
-            "is_admin": user.is_admin,
-            "is_active": user.is_active
-        }
+
+def new_conversation(user: dict) -> int:
+    cid = conversation_ids.allocate()
+    conversation_owners.set(cid, user["id"])
+    return cid
+
+
+async def new_conversation_async(user: dict) -> int:
+    # hết khối id thì mới phải xuống DB giữ khối mới (trên thread)
+    cid = conversation_ids.try_allocate()
+    if cid is None:
+        cid = await run_in_threadpool(conversation_ids.allocate)
+    conversation_owners.set(cid, user["id"])
+    return cid
+
+
+def resolve_conversation(cid: int | None, user: dict) -> tuple[int, bool]:
+    """
+    (conversation_id, có phải hội thoại mới). conversation_id của user khác
+    (hoặc chưa từng được cấp) không được ghi vào: mở hội thoại mới thay vào đó.
+    """
+    if cid is not None and conversation_owner(cid, user) == user["id"]:
+        return cid, False
+    return new_conversation(user), True
+
+
+async def owns_conversation_async(cid: int, user: dict) -> bool:
+    owner = conversation_owners.get(cid)
+    if owner is None:
+        owner = await run_in_threadpool(conversation_owner, cid, user)
+    return owner == user["id"]
+
+
+async def resolve_conversation_async(cid: int | None, user: dict) -> tuple[int, bool]:
+    if cid is not None and await owns_conversation_async(cid, user):
+        return cid, False
+    return await new_conversation_async(user), True
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, default=lambda v: v.isoformat(), separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def cursor_int(value) -> int:
+    if type(value) is not int:
+        raise TypeError
+    return value
+
+
+def cursor_bool(value) -> bool:
+    if type(value) is not bool:
+        raise TypeError
+    return value
+
+
+def cursor_datetime(value) -> datetime:
+    # không phải str -> TypeError, sai định dạng -> ValueError
+    return datetime.fromisoformat(value)
+
+
+def decode_cursor(cursor: str, *fields) -> list:
+    """
+    fields: hàm kiểm tra / chuyển từng phần tử (cursor_int, cursor_datetime...).
+    Cursor hỏng ở bất kỳ đâu (base64, JSON, số phần tử, kiểu) -> 400, không để lọt 500.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        return [field(value) for field, value in zip(fields, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Cursor không hợp lệ")
+
+
+def keyset_before(columns, values):
+    """(c1, c2, ...) < (v1, v2, ...) theo thứ tự từ điển, viết dạng OR/AND cho mọi DB."""
+    clauses = []
+    for i, (col, value) in enumerate(zip(columns, values)):
+        if isinstance(value, bool):
+            # cột boolean: chỉ có False < True
+            if not value:
+                continue
+            less = col == False
+        else:
+            less = col < value
+        clauses.append(and_(*[c == v for c, v in zip(columns[:i], values[:i])], less))
+    return or_(*clauses)
 
 
 def require_admin(authorization: str | None):
@@ -75,68 +267,277 @@ def require_admin(authorization: str | None):
 class ChatRequest(BaseModel):
     message: str
     conversation_id: int | None = None
+    # > 0: trả thêm top-k nguồn tham khảo (id, title, score, đoạn liên quan)
+    top_k: int | None = Field(default=None, ge=1, le=20)
+
+
+def chat_payload(answer: str, hits: list, req: BaseModel, **extra) -> dict:
+    payload = {"answer": answer, **extra}
+    if req.top_k:
+        payload["sources"] = [h.to_dict() for h in hits]
+    return payload
 
 
-@app.post("/chat")
 def chat(req: ChatRequest, authorization: str | None = Header(default=None)):
-    answer = bot.answer(req.message)
     user = get_current_user(authorization)
 
     if not user or not user["is_active"]:
-        return {"answer": answer, "guest": True}
+        answer, hits = bot.respond(req.message, req.top_k or 1)
+        return chat_payload(answer, hits, req, guest=True)
+
+    conv_id, new = resolve_conversation(req.conversation_id, user)
+    context = [] if new else bot.conversation_context(conv_id, user["id"])
+    answer, hits = bot.respond(req.message, req.top_k or 1, context)
+
+    try:
+        history_writer.submit(conv_id, user["id"], req.message, answer)
+    except HistoryQueueFull:
+        raise HTTPException(503, "Hệ thống đang quá tải, vui lòng thử lại")
+    bot.remember_turn(conv_id, user["id"], req.message, new=new)
+
+    return chat_payload(answer, hits, req, conversation_id=conv_id, guest=False)
+
+
+async def conversation_context_async(conv_id: int | None, user: dict) -> list:
+    # cửa sổ ngữ cảnh trong bộ nhớ; chỉ cold miss mới xuống DB (trên thread)
+    if conv_id is None:
+        return []
+    context = bot.contexts.try_get(conv_id, user["id"])
+    if context is None:
+        context = await run_in_threadpool(bot.conversation_context, conv_id, user["id"])
+    return context
+
+
+async def sync_index_async():
+    # retrieval chạy trong bộ nhớ; chỉ lần nạp / poll index mới cần thread.
+    # Gọi ngay trước respond(..., sync=False) để respond không tự poll trên event loop
+    if bot.needs_sync():
+        await run_in_threadpool(bot.sync)
+
+
+async def respond_async(message: str, k: int, context=()):
+    # keyword: truy xuất trong bộ nhớ, chạy luôn trên event loop;
+    # dense / hybrid phải embed câu hỏi -> trên thread
+    await sync_index_async()
+    if bot.embeds_queries():
+        return await run_in_threadpool(bot.respond, message, k, context, False)
+    return bot.respond(message, k, context, sync=False)
+
+
+async def chat_async(req: ChatRequest, authorization: str | None = Header(default=None)):
+    user = await get_current_user_async(authorization)
+
+    if not user or not user["is_active"]:
+        answer, hits = await respond_async(req.message, req.top_k or 1)
+        return chat_payload(answer, hits, req, guest=True)
+
+    conv_id, new = await resolve_conversation_async(req.conversation_id, user)
+    context = [] if new else await conversation_context_async(conv_id, user)
+    answer, hits = await respond_async(req.message, req.top_k or 1, context)
+
+    if not history_writer.try_submit(conv_id, user["id"], req.message, answer):
+        # hàng đợi đầy hoặc ghi đồng bộ (write-behind tắt): chờ / ghi trên thread, không chặn event loop
+        try:
+            await run_in_threadpool(history_writer.submit, conv_id, user["id"], req.message, answer)
+        except HistoryQueueFull:
+            raise HTTPException(503, "Hệ thống đang quá tải, vui lòng thử lại")
+    bot.remember_turn(conv_id, user["id"], req.message, new=new)
+
+    return chat_payload(answer, hits, req, conversation_id=conv_id, guest=False)
 
-    with get_session() as db:
-        conv_id = req.conversation_id
-        if conv_id is None:
-            max_id = db.query(func.max(ChatHistory.conversation_id)).scalar()
-            conv_id = (max_id or 0) + 1
-
-        db.add(ChatHistory(
-            conversation_id=conv_id,
-            question=req.message,
-            answer=answer,
-            user_id=user["id"]
-        ))
-        db.commit()
 
-    return {"answer": answer, "conversation_id": conv_id, "guest": False}
+# CHAT_ASYNC=0 giữ handler sync cũ (chạy trên threadpool) để so sánh / fallback
+app.add_api_route("/chat", chat_async if config.CHAT_ASYNC else chat, methods=["POST"])
+
+
+class ChatBatchRequest(BaseModel):
+    messages: list[str] = Field(min_length=1, max_length=config.CHAT_BATCH_MAX)
+    # có: mọi câu vào hội thoại này (cùng dùng ngữ cảnh trước lô);
+    # không: mỗi câu một hội thoại mới (như gọi /chat từng câu)
+    conversation_id: int | None = None
+    top_k: int | None = Field(default=None, ge=1, le=20)
+
+
+@app.post("/chat/batch")
+async def chat_batch(req: ChatBatchRequest, authorization: str | None = Header(default=None)):
+    """
+    Nhiều câu hỏi trong một request: xác thực một lần, chấm điểm cả lô một lượt
+    (ma trận câu hỏi x knowledge), lịch sử ghi bằng một lệnh INSERT.
+    """
+    user = await get_current_user_async(authorization)
+    if user and not user["is_active"]:
+        user = None
+
+    # conversation_id không thuộc user: như không gửi (mỗi câu một hội thoại mới)
+    shared = None
+    if user and req.conversation_id is not None and await owns_conversation_async(req.conversation_id, user):
+        shared = req.conversation_id
+
+    contexts = None
+    if shared is not None:
+        contexts = [await conversation_context_async(shared, user)] * len(req.messages)
+
+    # lô lớn tốn CPU -> chạy trên thread, không giữ event loop
+    results = await run_in_threadpool(bot.respond_many, req.messages, req.top_k or 1, contexts)
+
+    conv_ids: list[int | None] = [None] * len(results)
+    if user:
+        for i in range(len(results)):
+            conv_ids[i] = shared if shared is not None else await new_conversation_async(user)
+        turns = [
+            (conv_id, user["id"], message, answer)
+            for conv_id, message, (answer, _) in zip(conv_ids, req.messages, results)
+        ]
+        try:
+            await run_in_threadpool(history_writer.write_many, turns)
+        except SQLAlchemyError:
+            raise HTTPException(503, "Không lưu được lịch sử chat, vui lòng thử lại")
+        for conv_id, _, message, _ in turns:
+            bot.remember_turn(conv_id, user["id"], message, new=shared is None)
+
+    return {
+        "items": [
+            chat_payload(answer, hits, req, conversation_id=conv_id, guest=False) if user
+            else chat_payload(answer, hits, req, guest=True)
+            for conv_id, (answer, hits) in zip(conv_ids, results)
+        ]
+    }
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, authorization: str | None = Header(default=None)):
+    """
+    Như /chat nhưng trả Server-Sent Events:
+    meta (ngay, trước khi truy xuất) -> chunk* -> sources (nếu top_k) -> done.
+    done.persisted = true khi lượt chat đã nằm trong DB (lượt flush định kỳ).
+    """
+    # lỗi xác thực trả HTTP status bình thường, trước khi mở stream
+    user = await get_current_user_async(authorization)
+    if user and not user["is_active"]:
+        user = None
+
+    conv_id = None
+    new = True
+    context = []
+    if user:
+        conv_id, new = await resolve_conversation_async(req.conversation_id, user)
+        if not new:
+            context = await conversation_context_async(conv_id, user)
+
+    async def events():
+        yield sse("meta", {"conversation_id": conv_id, "guest": user is None})
+
+        await sync_index_async()
+        if bot.embeds_queries():
+            chunks, hits = await run_in_threadpool(bot.stream, req.message, req.top_k or 1, context, False)
+        else:
+            chunks, hits = bot.stream(req.message, req.top_k or 1, context, sync=False)
+
+        parts = []
+        if isinstance(chunks, list):
+            for chunk in chunks:
+                parts.append(chunk)
+                yield sse("chunk", {"text": chunk})
+        else:
+            # generator (vd. LLM) có thể chặn giữa các phần -> lấy từng phần trên thread
+            async for chunk in iterate_in_threadpool(iter(chunks)):
+                parts.append(chunk)
+                yield sse("chunk", {"text": chunk})
+
+        if req.top_k:
+            yield sse("sources", [h.to_dict() for h in hits])
+
+        persisted = False
+        if user:
+            answer = "".join(parts)
+            if not history_writer.try_submit(conv_id, user["id"], req.message, answer):
+                try:
+                    await run_in_threadpool(history_writer.submit, conv_id, user["id"], req.message, answer)
+                except HistoryQueueFull:
+                    yield sse("error", {"detail": "Hệ thống đang quá tải, vui lòng thử lại"})
+                    return
+            bot.remember_turn(conv_id, user["id"], req.message, new=new)
+            persisted = await run_in_threadpool(
+                history_writer.wait_user, user["id"],
+                config.HISTORY_FLUSH_SECONDS + config.HISTORY_SUBMIT_TIMEOUT, False,
+            )
+
+        yield sse("done", {"conversation_id": conv_id, "guest": user is None, "persisted": persisted})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # tắt buffer của proxy (nginx) để chunk tới client ngay
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # =======================
 # CONVERSATIONS
 # =======================
 
 @app.get("/chat/conversations")
-def conversations(authorization: str | None = Header(default=None)):
+def conversations(
+    cursor: str | None = None,
+    limit: int = Query(default=30, ge=1, le=100),
+    authorization: str | None = Header(default=None),
+):
     user = get_current_user(authorization)
     if not user:
-        return []
+        return {"items": [], "next_cursor": None}
 
+    wait_history(user)
     with get_session() as db:
-        pinned = func.max(case((ChatHistory.is_pinned == True, 1), else_=0))
-        rows = (
+        # một dải index (user_id, is_pinned, last_message_at, id), không GROUP BY
+        query = (
             db.query(
-                ChatHistory.conversation_id,
-                func.min(ChatHistory.question),
-                func.max(ChatHistory.created_at),
-                func.count(),
-                pinned
+                Conversation.id,
+                Conversation.title,
+                Conversation.last_message_at,
+                Conversation.message_count,
+                Conversation.is_pinned
             )
-            .filter(ChatHistory.user_id == user["id"])
-            .group_by(ChatHistory.conversation_id)
-            .order_by(pinned.desc(), func.max(ChatHistory.created_at).desc())
+            .filter(Conversation.user_id == user["id"])
+        )
+        if cursor:
+            pinned, last_at, cid = decode_cursor(cursor, cursor_bool, cursor_datetime, cursor_int)
+            query = query.filter(keyset_before(
+                (Conversation.is_pinned, Conversation.last_message_at, Conversation.id),
+                (pinned, last_at, cid),
+            ))
+        rows = (
+            query
+            .order_by(
+                Conversation.is_pinned.desc(),
+                Conversation.last_message_at.desc(),
+                Conversation.id.desc()
+            )
+            .limit(limit + 1)
             .all()
         )
 
-        return [
-            {
-                "id": r[0],
-                "title": (r[1][:50] + "...") if r[1] else "Cuộc hội thoại",
-                "last_message_at": r[2].isoformat(),
-                "message_count": r[3],
-                "is_pinned": bool(r[4])
-            }
-            for r in rows
-        ]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(bool(last[4]), last[2], last[0])
+
+        return {
+            "items": [
+                {
+                    "id": r[0],
+                    "title": (r[1][:50] + "...") if r[1] else "Cuộc hội thoại",
+                    "last_message_at": r[2].isoformat(),
+                    "message_count": r[3],
+                    "is_pinned": bool(r[4])
+                }
+                for r in rows
+            ],
+            "next_cursor": next_cursor,
+        }
 
 # =======================
 # PIN
@@ -148,10 +549,11 @@ def pin(cid: int, authorization: str | None = Header(default=None)):
     if not user:
         raise HTTPException(401)
 
+    wait_history(user)
     with get_session() as db:
-        result = db.query(ChatHistory).filter(
-            ChatHistory.conversation_id == cid,
-            ChatHistory.user_id == user["id"]
+        result = db.query(Conversation).filter(
+            Conversation.id == cid,
+            Conversation.user_id == user["id"]
         ).update({"is_pinned": True})
         
         if result == 0:
@@ -168,10 +570,11 @@ def unpin(cid: int, authorization: str | None = Header(default=None)):
     if not user:
         raise HTTPException(401)
 
+    wait_history(user)
     with get_session() as db:
-        result = db.query(ChatHistory).filter(
-            ChatHistory.conversation_id == cid,
-            ChatHistory.user_id == user["id"]
+        result = db.query(Conversation).filter(
+            Conversation.id == cid,
+            Conversation.user_id == user["id"]
         ).update({"is_pinned": False})
         
         if result == 0:
@@ -186,21 +589,49 @@ def unpin(cid: int, authorization: str | None = Header(default=None)):
 # =======================
 
 @app.get("/chat/conversations/{cid}/messages")
-def get_conversation_messages(cid: int, authorization: str | None = Header(default=None)):
+def get_conversation_messages(
+    cid: int,
+    before: str | None = None,
+    limit: int = Query(default=50, ge=1, le=200),
+    authorization: str | None = Header(default=None),
+):
+    """Trang tin nhắn mới nhất (hoặc cũ hơn `before`), trả về theo thứ tự thời gian."""
     try:
         user = get_current_user(authorization)
         if not user:
             raise HTTPException(401, "Chưa đăng nhập")
         
+        wait_history(user)
         with get_session() as db:
-            messages = db.query(ChatHistory).filter(
+            query = db.query(
+                ChatHistory.id,
+                ChatHistory.question,
+                ChatHistory.answer,
+                ChatHistory.created_at
+            ).filter(
                 ChatHistory.conversation_id == cid,
                 ChatHistory.user_id == user["id"]
-            ).order_by(ChatHistory.created_at.asc()).all()
+            )
+            if before:
+                created_at, mid = decode_cursor(before, cursor_datetime, cursor_int)
+                query = query.filter(keyset_before(
+                    (ChatHistory.created_at, ChatHistory.id),
+                    (created_at, mid),
+                ))
+            messages = query.order_by(
+                ChatHistory.created_at.desc(),
+                ChatHistory.id.desc()
+            ).limit(limit + 1).all()
             
-            if not messages:
+            if not messages and not before:
                 raise HTTPException(404, "Conversation not found")
             
+            next_cursor = None
+            if len(messages) > limit:
+                messages = messages[:limit]
+                next_cursor = encode_cursor(messages[-1].created_at, messages[-1].id)
+            messages.reverse()
+            
             result = []
             for m in messages:
                 try:
@@ -219,7 +650,7 @@ def get_conversation_messages(cid: int, authorization: str | None = Header(defau
                 except Exception:
                     continue
             
-            return result
+            return {"items": result, "next_cursor": next_cursor}
     except HTTPException:
         raise
     except Exception as e:
@@ -235,17 +666,24 @@ def delete_conversation(cid: int, authorization: str | None = Header(default=Non
     if not user:
         raise HTTPException(401, "Chưa đăng nhập")
     
+    wait_history(user)
     with get_session() as db:
         # Xóa tất cả messages trong conversation này của user
         result = db.query(ChatHistory).filter(
             ChatHistory.conversation_id == cid,
             ChatHistory.user_id == user["id"]
         ).delete()
+        db.query(Conversation).filter(
+            Conversation.id == cid,
+            Conversation.user_id == user["id"]
+        ).delete()
         
         if result == 0:
             raise HTTPException(404, "Conversation not found")
         
         db.commit()
+    conversation_owners.pop(cid)
+    bot.contexts.discard(cid)
     
     return {"ok": True}
 
@@ -289,9 +727,13 @@ def update_user(uid: int, payload: UserUpdate, authorization: str | None = Heade
 
         for k, v in payload.model_dump(exclude_none=True).items():
             setattr(user, k, v)
-        
+
+        username = user.username
+        auth.record_user_change(db, username)
         db.commit()
-        return {"ok": True}
+
+    auth.forget_user(username)
+    return {"ok": True}
 
 
 class PasswordChange(BaseModel):
@@ -299,17 +741,26 @@ class PasswordChange(BaseModel):
 
 
 @app.post("/admin/users/{uid}/password")
-def change_password(uid: int, payload: PasswordChange, authorization: str | None = Header(default=None)):
-    require_admin(authorization)
+async def change_password(uid: int, payload: PasswordChange, authorization: str | None = Header(default=None)):
+    await run_in_threadpool(require_admin, authorization)
+    # bcrypt chạy trong password_pool, không giữ slot threadpool
+    hashed = await auth.hash_password_async(payload.new_password)
+    await run_in_threadpool(set_password, uid, hashed)
+    return {"ok": True}
+
 
+def set_password(uid: int, hashed: str):
     with get_session() as db:
         user = db.query(User).filter(User.id == uid).first()
         if not user:
             raise HTTPException(404, "User not found")
 
-        user.hashed_password = auth.hash_password(payload.new_password)
+        user.hashed_password = hashed
+        username = user.username
+        auth.record_user_change(db, username)
         db.commit()
-        return {"ok": True}
+
+    auth.forget_user(username)
 
 
 @app.delete("/admin/users/{uid}")
@@ -321,8 +772,12 @@ def delete_user(uid: int, authorization: str | None = Header(default=None)):
         if not user:
             raise HTTPException(404)
 
+        username = user.username
         db.delete(user)
-        return {"ok": True}
+        auth.record_user_change(db, username)
+
+    auth.forget_user(username)
+    return {"ok": True}
 
 # =======================
 # ADMIN – KNOWLEDGE
@@ -338,20 +793,89 @@ class KnowledgeUpdate(BaseModel):
     content: str | None = None
     keywords: str | None = None
 
+KNOWLEDGE_SNIPPET_CHARS = 160
+
+# dòng rút gọn cho danh sách: độ dài content thay cho cả content
+KNOWLEDGE_SUMMARY_COLUMNS = (
+    Knowledge.id,
+    Knowledge.title,
+    Knowledge.keywords,
+    Knowledge.intent,
+    func.char_length(Knowledge.content)
+)
+
+def knowledge_summaries(db, ids: list) -> dict:
+    """id -> dòng rút gọn, một câu IN cho mỗi 1000 id."""
+    rows = {}
+    for i in range(0, len(ids), 1000):
+        for r in db.query(*KNOWLEDGE_SUMMARY_COLUMNS).filter(Knowledge.id.in_(ids[i:i + 1000])):
+            rows[r[0]] = r
+    return rows
+
+
+def knowledge_summary(r) -> dict:
+    return {
+        "id": r[0],
+        "title": r[1],
+        "keywords": r[2],
+        "intent": r[3],
+        "content_length": r[4] or 0
+    }
+
+
 @app.get("/admin/knowledge")
-def get_knowledge(authorization: str | None = Header(default=None)):
+def get_knowledge(
+    q: str | None = None,
+    cursor: str | None = None,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, ge=1, le=200),
+    authorization: str | None = Header(default=None),
+):
+    # danh sách rút gọn; content đầy đủ lấy qua GET /admin/knowledge/{kid}
     require_admin(authorization)
+
+    if q and q.strip():
+        # tìm qua index truy xuất trong bộ nhớ, rồi lấy dòng rút gọn theo id từ DB
+        ranked = bot.search_knowledge(q, min(offset + limit + 1, config.KNOWLEDGE_SEARCH_MAX))
+        page = ranked[offset:offset + limit]
+        with get_session() as db:
+            rows = knowledge_summaries(db, [doc.id for _, doc in page])
+        items = []
+        for score, doc in page:
+            if doc.id not in rows:
+                continue
+            content = (doc.content or "").strip()
+            items.append({
+                **knowledge_summary(rows[doc.id]),
+                "score": round(float(score), 3),
+                "snippet": content[:KNOWLEDGE_SNIPPET_CHARS] + ("..." if len(content) > KNOWLEDGE_SNIPPET_CHARS else "")
+            })
+        more = len(ranked) > offset + limit
+        return {
+            "items": items,
+            "next_cursor": None,
+            "next_offset": offset + limit if more else None,
+        }
+
     with get_session() as db:
-        items = db.query(Knowledge).all()
-        return [
-            {
-                "id": item.id,
-                "title": item.title,
-                "content": item.content,
-                "keywords": item.keywords
-            }
-            for item in items
-        ]
+        query = db.query(*KNOWLEDGE_SUMMARY_COLUMNS).order_by(Knowledge.id)
+        if cursor:
+            (last_id,) = decode_cursor(cursor, cursor_int)
+            query = query.filter(Knowledge.id > last_id)
+        elif offset:
+            query = query.offset(offset)
+        rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0])
+
+    return {
+        "items": [knowledge_summary(r) for r in rows],
+        "next_cursor": next_cursor,
+        "next_offset": offset + limit if next_cursor and not cursor else None,
+    }
 
 
 @app.post("/admin/knowledge")
@@ -364,14 +888,61 @@ def create_knowledge(payload: KnowledgeCreate, authorization: str | None = Heade
             keywords=payload.keywords
         )
         db.add(item)
+        db.flush()
+        db.add(KnowledgeChange(knowledge_id=item.id, op="upsert"))
         db.commit()
         db.refresh(item)
+        bot.upsert_knowledge(item)
         return {
             "id": item.id,
             "title": item.title,
             "content": item.content
         }
 
+@app.post("/admin/knowledge/import")
+def import_knowledge(
+    file: UploadFile = File(...),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    authorization: str | None = Header(default=None),
+):
+    # file đã được spool ra đĩa; đọc từng bản ghi, ghi + cập nhật index theo lô
+    require_admin(authorization)
+    try:
+        report = knowledge_io.import_records(
+            knowledge_io.READERS[format](file.file),
+            on_batch=bot.apply_knowledge,
+            batch_size=config.KNOWLEDGE_IMPORT_BATCH,
+            max_errors=config.KNOWLEDGE_IMPORT_MAX_ERRORS,
+        )
+    except ValueError as e:
+        raise HTTPException(400, f"File không hợp lệ: {e}")
+    return report.to_dict()
+
+
+@app.get("/admin/knowledge/export")
+def export_knowledge(authorization: str | None = Header(default=None)):
+    require_admin(authorization)
+    return StreamingResponse(
+        knowledge_io.export_ndjson(config.KNOWLEDGE_EXPORT_PAGE),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="knowledge.ndjson"'},
+    )
+
+@app.get("/admin/knowledge/{kid}")
+def get_knowledge_item(kid: int, authorization: str | None = Header(default=None)):
+    require_admin(authorization)
+    with get_session() as db:
+        item = db.query(Knowledge).filter(Knowledge.id == kid).first()
+        if not item:
+            raise HTTPException(404, "Knowledge not found")
+        return {
+            "id": item.id,
+            "title": item.title,
+            "content": item.content,
+            "keywords": item.keywords,
+            "intent": item.intent
+        }
+
 @app.put("/admin/knowledge/{kid}")
 def update_knowledge(kid: int, payload: KnowledgeUpdate, authorization: str | None = Header(default=None)):
     require_admin(authorization)
@@ -382,11 +953,15 @@ def update_knowledge(kid: int, payload: KnowledgeUpdate, authorization: str | No
         
         if payload.title is not None:
             item.title = payload.title
+        if payload.content is not None:
+            item.content = payload.content
         if payload.keywords is not None:
             item.keywords = payload.keywords
         
+        db.add(KnowledgeChange(knowledge_id=item.id, op="upsert"))
         db.commit()
         db.refresh(item)
+        bot.upsert_knowledge(item)
         return {
             "id": item.id,
             "title": item.title,
@@ -404,9 +979,97 @@ def delete_knowledge(kid: int, authorization: str | None = Header(default=None))
             raise HTTPException(404, "Knowledge not found")
         
         db.delete(item)
+        db.add(KnowledgeChange(knowledge_id=kid, op="delete"))
         db.commit()
+        bot.remove_knowledge(kid)
         return {"ok": True}
 
+# =======================
+# ADMIN – SYSTEM
+# =======================
+
+@app.get("/admin/db/pool")
+def db_pool_stats(authorization: str | None = Header(default=None)):
+    # thời gian chờ checkout connection: wait_max_ms / timeouts tăng -> pool quá nhỏ
+    require_admin(authorization)
+    return pool_metrics()
+
+
+@app.get("/admin/passwords")
+def password_pool_stats(authorization: str | None = Header(default=None)):
+    # queued / wait_max_ms tăng, rejected > 0 -> thêm PASSWORD_WORKERS
+    require_admin(authorization)
+    return auth.password_pool.stats()
+
+
+@app.get("/admin/cache")
+def cache_stats(authorization: str | None = Header(default=None)):
+    require_admin(authorization)
+    return {
+        "answers": bot.cache_stats(),
+        "users": auth.user_cache.stats(),
+        "tokens": auth.token_cache.stats(),
+        "contexts": bot.contexts.stats(),
+        "conversation_owners": conversation_owners.stats(),
+    }
+
+
+def collect_pool():
+    for engine, snap in pool_metrics().items():
+        labels = {"engine": engine}
+        yield "chatbot_db_pool_checkouts_total", "counter", "Số lần lấy connection", labels, snap["checkouts"]
+        yield "chatbot_db_pool_timeouts_total", "counter", "Số lần chờ connection quá hạn", labels, snap["timeouts"]
+        yield "chatbot_db_pool_wait_max_seconds", "gauge", "Thời gian chờ connection lâu nhất", labels, snap["wait_max_ms"] / 1e3
+        # chỉ QueuePool có size / checked_out / overflow (StaticPool, NullPool,
+        # engine async chưa dùng lần nào thì không)
+        for key, name, help in (
+            ("size", "chatbot_db_pool_size", "Kích thước pool"),
+            ("checked_out", "chatbot_db_pool_checked_out", "Connection đang được dùng"),
+            ("overflow", "chatbot_db_pool_overflow", "Connection vượt pool_size"),
+        ):
+            value = snap.get(key)
+            if value is not None:
+                yield name, "gauge", help, labels, value
+
+
+def collect_caches():
+    for name, stats in (
+        ("answers", bot.cache_stats()),
+        ("users", auth.user_cache.stats()),
+        ("tokens", auth.token_cache.stats()),
+        ("contexts", bot.contexts.stats()),
+        ("conversation_owners", conversation_owners.stats()),
+    ):
+        labels = {"cache": name}
+        lookups = stats["hits"] + stats["misses"]
+        yield "chatbot_cache_hits_total", "counter", "Số lần trúng cache", labels, stats["hits"]
+        yield "chatbot_cache_misses_total", "counter", "Số lần trượt cache", labels, stats["misses"]
+        yield "chatbot_cache_evictions_total", "counter", "Số mục bị đẩy ra", labels, stats["evictions"]
+        yield "chatbot_cache_size", "gauge", "Số mục đang giữ", labels, stats["size"]
+        yield "chatbot_cache_hit_ratio", "gauge", "Tỉ lệ trúng từ lúc khởi động", labels, stats["hits"] / lookups if lookups else 0.0
+
+
+def collect_workers():
+    pw = auth.password_pool.stats()
+    yield "chatbot_password_pending", "gauge", "Việc bcrypt đang chờ + đang chạy", {}, pw["pending"]
+    yield "chatbot_password_completed_total", "counter", "Việc bcrypt đã xong", {}, pw["completed"]
+    yield "chatbot_password_rejected_total", "counter", "Việc bcrypt bị từ chối (503)", {}, pw["rejected"]
+    yield "chatbot_history_flushed_rows_total", "counter", "Dòng chat_history đã ghi", {}, history_writer.flushed_rows
+    yield "chatbot_history_failed_batches_total", "counter", "Lô chat_history ghi lỗi", {}, history_writer.failed_batches
+    yield "chatbot_history_dropped_rows_total", "counter", "Dòng chat_history bỏ vì không ghi được", {}, history_writer.dropped_rows
+
+
+for collector in (collect_pool, collect_caches, collect_workers):
+    metrics.register_collector(collector)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    # Prometheus scrape; để sau reverse proxy / mạng nội bộ, không cần token
+    if not metrics.ENABLED:
+        raise HTTPException(404, "Metrics đang tắt")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # =======================
 # FRONTEND
 # =======================
@@ -425,51 +1088,48 @@ def admin_page():
 # =======================
 
 @app.get("/create-admin")
-def create_admin_endpoint(username: str = "admin", password: str = "admin123", email: str = "admin@example.com"):
+async def create_admin_endpoint(username: str = "admin", password: str = "admin123", email: str = "admin@example.com"):
     """Endpoint tạm thời để tạo admin user - XÓA SAU KHI TẠO XONG"""
     try:
-        import bcrypt
-        
-        password_bytes = password.encode('utf-8')
-        if len(password_bytes) > 72:
-            password_bytes = password_bytes[:72]
-        
-        salt = bcrypt.gensalt(rounds=12)
-        hashed_password = bcrypt.hashpw(password_bytes, salt).decode('utf-8')
-        
-        with get_session() as db:
-            user = db.query(User).filter(User.username == username).first()
-            
-            if user:
-                user.is_admin = True
-                user.is_active = True
-                user.hashed_password = hashed_password
-                if email:
-                    user.email = email
-                db.commit()
-                db.refresh(user)
-                return {
-                    "success": True, 
-                    "message": f"Đã cập nhật user '{username}' thành admin"
-                }
-            else:
-                user = User(
-                    username=username,
-                    email=email,
-                    hashed_password=hashed_password,
-                    is_admin=True,
-                    is_active=True
-                )
-                db.add(user)
-                db.commit()
-                db.refresh(user)
-                return {
-                    "success": True, 
-                    "message": f"Đã tạo admin user '{username}' thành công"
-                }
+        hashed_password = await auth.hash_password_async(password)
+        return await run_in_threadpool(upsert_admin, username, email, hashed_password)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
+def upsert_admin(username: str, email: str, hashed_password: str) -> dict:
+    with get_session() as db:
+        user = db.query(User).filter(User.username == username).first()
+        
+        if user:
+            user.is_admin = True
+            user.is_active = True
+            user.hashed_password = hashed_password
+            if email:
+                user.email = email
+            auth.record_user_change(db, username)
+            db.commit()
+            auth.forget_user(username)
+            return {
+                "success": True, 
+                "message": f"Đã cập nhật user '{username}' thành admin"
+            }
+        else:
+            user = User(
+                username=username,
+                email=email,
+                hashed_password=hashed_password,
+                is_admin=True,
+                is_active=True
+            )
+            db.add(user)
+            db.commit()
+            db.refresh(user)
+            return {
+                "success": True, 
+                "message": f"Đã tạo admin user '{username}' thành công"
+            }
+
+
 if os.path.exists(FRONTEND_DIR):
     app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
@@ -0,0 +1,221 @@
+"""
+Số liệu hiệu năng dạng Prometheus text (GET /metrics), không cần thư viện ngoài:
+- histogram thời gian theo bước xử lý (stage): jwt, tra user, tách token,
+  truy xuất, ghi lịch sử... và theo route HTTP
+- số câu SQL + thời gian theo loại lệnh (SQLAlchemy engine events)
+- gauge đọc lúc scrape qua collector: pool DB, cache, password pool...
+
+METRICS_ENABLED=0: stage() trả context rỗng dùng chung, không gắn event SQL
+hay middleware -> gần như không tốn gì trên đường nóng.
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import config
+
+ENABLED = config.METRICS_ENABLED
+
+# giây; đường nóng chủ yếu dưới vài ms
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Một nhóm histogram cùng tên, mỗi bộ giá trị nhãn một series."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # nhãn -> [đếm theo bucket (không cộng dồn) + bucket +Inf, tổng, số lần]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(k, list(s[0]), s[1], s[2]) for k, s in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        bounds = [repr(float(b)) for b in self.buckets] + ["+Inf"]
+        for values, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for le, n in zip(bounds, counts):
+                cumulative += n
+                bucket = _labels(self.labels, values, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {count}")
+        return lines
+
+
+STAGES = Histogram("chatbot_stage_seconds", "Thời gian từng bước xử lý", ("stage",))
+HTTP = Histogram("chatbot_http_request_seconds", "Thời gian xử lý request HTTP", ("method", "route", "status"))
+SQL = Histogram("chatbot_sql_query_seconds", "Thời gian câu SQL theo loại lệnh", ("operation",))
+
+_histograms: List[Histogram] = [STAGES, HTTP, SQL]
+
+
+# ======================
+# STAGE TIMER
+# ======================
+
+class _StageTimer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGES.observe(time.perf_counter() - self.start, self.name)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullTimer()
+
+
+def stage(name: str):
+    """with stage("retrieve"): ... -> một mẫu trong chatbot_stage_seconds{stage="retrieve"}."""
+    return _StageTimer(name) if ENABLED else _NULL
+
+
+# ======================
+# SQL (engine events)
+# ======================
+
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    op = statement.lstrip()[:6].upper()
+    SQL.observe(elapsed, op if op in SQL_OPERATIONS else "OTHER")
+
+
+def _handle_error(context):
+    conn = context.connection
+    if conn is not None:
+        starts = conn.info.get("metrics_query_start")
+        if starts:
+            starts.pop()
+
+
+_instrumented = False
+
+
+def instrument_sql():
+    """Gắn event cho mọi Engine (engine async cũng chạy qua Engine sync bên dưới)."""
+    global _instrumented
+    if not ENABLED or _instrumented:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+    _instrumented = True
+
+
+# ======================
+# HTTP (ASGI middleware)
+# ======================
+
+class MetricsMiddleware:
+    """Đo tới khi gửi xong body (tính cả response stream), nhãn route theo path mẫu."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP.observe(time.perf_counter() - start, scope["method"], route, str(status[0]))
+
+
+# ======================
+# COLLECTORS + RENDER
+# ======================
+
+# mỗi collector trả các mẫu (tên, kiểu, help, {nhãn: giá trị}, số)
+Sample = tuple[str, str, str, Dict[str, str], float]
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+
+
+def register_collector(fn: Callable[[], Iterable[Sample]]):
+    _collectors.append(fn)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for histogram in _histograms:
+        lines.extend(histogram.render())
+
+    grouped: Dict[str, list] = {}
+    for collect in _collectors:
+        for name, kind, help, labels, value in collect():
+            grouped.setdefault(name, [kind, help, []])[2].append((labels, value))
+    for name, (kind, help, samples) in grouped.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {float(value)}")
+    return "\n".join(lines) + "\n"
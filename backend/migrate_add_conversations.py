@@ -0,0 +1,73 @@
+"""
+Script migration tạo bảng conversations (tóm tắt hội thoại cho sidebar),
+thêm index phân trang tin nhắn cho chat_history và điền dữ liệu từ
+chat_history sẵn có.
+Chạy script này một lần sau khi cập nhật code; chạy lại không sao
+(chỉ thêm các hội thoại chưa có).
+"""
+import sys
+
+from sqlalchemy import case, func, insert, select
+
+from db import ChatHistory, Conversation, engine, get_session, init_db
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+
+def migrate():
+    try:
+        # Tạo bảng conversations + index (user_id, is_pinned, last_message_at)
+        init_db()
+        # create_all không thêm index vào bảng chat_history đã có sẵn
+        for index in ChatHistory.__table__.indexes:
+            index.create(engine, checkfirst=True)
+
+        missing = ~select(Conversation.id).where(
+            Conversation.id == ChatHistory.conversation_id
+        ).exists()
+
+        summary = (
+            select(
+                ChatHistory.conversation_id,
+                func.min(ChatHistory.user_id),
+                # giữ đúng tiêu đề mà sidebar cũ hiển thị
+                func.min(ChatHistory.question),
+                func.min(ChatHistory.created_at),
+                func.max(ChatHistory.created_at),
+                func.count(),
+                func.max(case((ChatHistory.is_pinned == True, 1), else_=0)),
+            )
+            .where(ChatHistory.conversation_id.is_not(None), missing)
+            .group_by(ChatHistory.conversation_id)
+        )
+
+        with get_session() as db:
+            rows = db.execute(summary).all()
+
+            for i in range(0, len(rows), 1000):
+                db.execute(insert(Conversation), [
+                    {
+                        "id": cid,
+                        "user_id": user_id,
+                        "title": (title or "")[:255],
+                        "created_at": first_at,
+                        "last_message_at": last_at,
+                        "message_count": count,
+                        "is_pinned": bool(pinned),
+                    }
+                    for cid, user_id, title, first_at, last_at, count, pinned in rows[i:i + 1000]
+                ])
+
+        print(f"[OK] Da them {len(rows)} hoi thoai vao bang conversations.")
+
+    except Exception as e:
+        print(f"[ERROR] Loi migration: {e}")
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("Migration: Tao bang conversations tu chat_history")
+    print("=" * 50)
+    migrate()
@@ -0,0 +1,158 @@
+"""
+Băm / kiểm tra mật khẩu bcrypt trong process pool riêng:
+- mỗi lần bcrypt (rounds=12) tốn vài trăm ms CPU; chạy inline thì giữ luôn một
+  slot threadpool của worker uvicorn -> đợt đăng nhập dồn dập làm /chat chờ theo
+- số việc đang chờ + đang chạy bị giới hạn (max_pending): vượt quá thì từ chối
+  ngay (PasswordPoolBusy -> 503) thay vì xếp hàng vô hạn
+- verify_and_update: mật khẩu đúng nhưng hash cũ dùng cost khác cấu hình hiện
+  tại -> trả thêm hash mới để lưu lại (rehash khi đăng nhập)
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+
+def make_context(rounds: int) -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+# ======================
+# CHẠY TRONG PROCESS CON
+# ======================
+
+_contexts: Dict[int, CryptContext] = {}
+
+
+def _context(rounds: int) -> CryptContext:
+    ctx = _contexts.get(rounds)
+    if ctx is None:
+        ctx = _contexts[rounds] = make_context(rounds)
+    return ctx
+
+
+def _hash(password: str, rounds: int) -> tuple[str, float]:
+    start = time.perf_counter()
+    hashed = _context(rounds).hash(password)
+    return hashed, time.perf_counter() - start
+
+
+def _verify_and_update(password: str, hashed: str, rounds: int) -> tuple[tuple[bool, str | None], float]:
+    start = time.perf_counter()
+    try:
+        result = _context(rounds).verify_and_update(password, hashed)
+    except ValueError:
+        # hash hỏng / không nhận dạng được
+        result = (False, None)
+    return result, time.perf_counter() - start
+
+
+# ======================
+# POOL
+# ======================
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class PasswordPool:
+    """
+    workers = 0: không tạo process, chạy trên executor mặc định của event loop
+    (vẫn giới hạn bằng max_pending và có số liệu).
+    """
+
+    def __init__(self, workers: int, max_pending: int, rounds: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+        self.pending = 0
+        self.peak_pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.run_total = 0.0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._executor is None and self.workers > 0:
+                # spawn: không fork tiến trình đang có thread + connection DB
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _acquire(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordPoolBusy()
+            self.pending += 1
+            self.submitted += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+
+    def _release(self, elapsed: float | None, run: float = 0.0):
+        with self._lock:
+            self.pending -= 1
+            if elapsed is None:
+                return
+            wait = max(0.0, elapsed - run)
+            self.completed += 1
+            self.run_total += run
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    async def _run(self, fn, *args):
+        self._acquire()
+        start = time.perf_counter()
+        try:
+            if self.workers > 0 and self._executor is None:
+                self.start()
+            result, run = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        self._release(time.perf_counter() - start, run)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password, self.rounds)
+
+    async def verify_and_update(self, password: str, hashed: str) -> tuple[bool, str | None]:
+        """(đúng mật khẩu?, hash mới nếu cần băm lại theo cost hiện tại)."""
+        return await self._run(_verify_and_update, password, hashed, self.rounds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.completed or 1
+            return {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                # đang chờ process rảnh (phần còn lại đang chạy)
+                "queued": max(0, self.pending - max(self.workers, 1)),
+                "peak_pending": self.peak_pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_run_ms": round(self.run_total / done * 1e3, 2),
+                "avg_wait_ms": round(self.wait_total / done * 1e3, 2),
+                "wait_max_ms": round(self.wait_max * 1e3, 2),
+            }
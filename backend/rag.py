@@ -1,19 +1,80 @@
+import heapq
+import itertools
+import json
 import re
-from typing import List, Set
+import threading
+import time
+import unicodedata
+import zlib
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set
+import numpy as np
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from db import Knowledge, get_session
+
+import config
+from cache import SQLiteCache, TTLCache
+from db import ChatHistory, Knowledge, KnowledgeChange, get_session
+from dense import DenseIndex, VectorStore, make_embedder
+from fuzzy import FuzzyIndex
+from metrics import stage
+from chat_context import ContextWindows, Turn
+from scorers import BM25Scorer, Query, Scorer, Terms, term_weights, top_k_csr
 
 
 # ======================
 # TEXT PROCESSING
 # ======================
 
+TOKEN_RE = re.compile(r"[a-zA-Z0-9_À-ỹ]+")
+
+
 def normalize_text(text: str) -> str:
-    return text.lower().strip()
+    # NFC: bàn phím gõ dấu tổ hợp (NFD) vẫn ra cùng token
+    return unicodedata.normalize("NFC", text).lower().strip()
 
 
 def tokenize(text: str) -> List[str]:
-    return re.findall(r"[a-zA-Z0-9_À-ỹ]+", normalize_text(text))
+    return TOKEN_RE.findall(normalize_text(text))
+
+
+def _fold_char(ch: str) -> str:
+    return "d" if ch in "đĐ" else "".join(
+        c for c in unicodedata.normalize("NFD", ch) if not unicodedata.combining(c)
+    )
+
+
+# bỏ dấu tiếng Việt: "đăng nhập" -> "dang nhap" (str.translate);
+# chỉ thay 1 ký tự bằng 1 ký tự vẫn thuộc TOKEN_RE nên token vẫn là token
+FOLD_TABLE = {
+    cp: folded
+    for cp, folded in ((cp, _fold_char(chr(cp))) for cp in range(0xC0, 0x1EFA))
+    if folded != chr(cp) and len(folded) == 1 and TOKEN_RE.fullmatch(folded)
+}
+
+
+def fold_text(text: str) -> str:
+    return text.translate(FOLD_TABLE)
+
+
+def split_passages(text: str, max_chars: int) -> List[tuple[int, int]]:
+    """
+    Cắt nội dung thành các đoạn (start, end) theo dòng trống, gộp các đoạn
+    ngắn liền nhau tới khoảng max_chars; không cắt giữa một đoạn văn.
+    """
+    spans: List[tuple[int, int]] = []
+    start = end = None
+    for m in re.finditer(r"\S(?:.*?\S)?(?=\s*\n\s*\n|\s*$)", text, re.S):
+        if start is None:
+            start, end = m.start(), m.end()
+        elif m.end() - start <= max_chars:
+            end = m.end()
+        else:
+            spans.append((start, end))
+            start, end = m.start(), m.end()
+    if start is not None:
+        spans.append((start, end))
+    return spans
 
 
 STOPWORDS = {
@@ -27,90 +88,975 @@ STOPWORDS = {
 # INTENT DETECTION
 # ======================
 
+class IntentMatcher:
+    """
+    Bảng intent (intents.json) dựng sẵn thành matcher:
+    - "words": khớp đúng một token có dấu ("đăng" khác "đang")
+    - "phrases": một hoặc nhiều từ, khớp không phân biệt dấu trên chuỗi token
+      ("đăng nhập" khớp cả "dang nhap"), bằng automaton Aho-Corasick
+      với bảng chữ cái là token đã bỏ dấu
+    """
+
+    KEY_CACHE_SIZE = 100_000
+
+    def __init__(self, table: Dict[str, dict]):
+        self.words: Dict[str, Set[str]] = {}
+        self._keys: Dict[str, str] = {}
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[Set[str]] = [set()]
+
+        for intent, spec in table.items():
+            for word in spec.get("words", ()):
+                self.words.setdefault(normalize_text(word), set()).add(intent)
+            for phrase in spec.get("phrases", ()):
+                node = 0
+                for tok in tokenize(fold_text(phrase)):
+                    nxt = self._goto[node].get(tok)
+                    if nxt is None:
+                        nxt = self._goto[node][tok] = len(self._goto)
+                        self._goto.append({})
+                        self._out.append(set())
+                    node = nxt
+                if node:
+                    self._out[node].add(intent)
+
+        self._alphabet = {tok for edges in self._goto for tok in edges}
+
+        # failure link theo BFS; out của node gộp luôn out của đích failure
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for tok, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and tok not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[child] = self._goto[f].get(tok, 0) if node else 0
+                self._out[child] |= self._out[self._fail[child]]
+
+    @classmethod
+    def from_file(cls, path: str) -> "IntentMatcher":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _key(self, tok: str) -> str:
+        # token -> token bỏ dấu nếu có trong phrase nào, ngược lại "" (về gốc automaton);
+        # cache theo token thay vì translate cả câu mỗi lần
+        key = self._keys.get(tok)
+        if key is None:
+            key = tok.translate(FOLD_TABLE)
+            if key not in self._alphabet:
+                key = ""
+            if len(self._keys) < self.KEY_CACHE_SIZE:
+                self._keys[tok] = key
+        return key
+
+    def _scan(self, tokens: Iterable[str]) -> tuple[List[str], Set[str]]:
+        goto, fail, out, words = self._goto, self._fail, self._out, self.words
+        phrases = len(goto) > 1
+        kept: List[str] = []
+        intents: Set[str] = set()
+        state = 0
+
+        for tok in tokens:
+            if phrases:
+                key = self._key(tok)
+                while state and key not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(key, 0)
+                if state and out[state]:
+                    intents |= out[state]
+
+            if len(tok) > 2 and tok not in STOPWORDS:
+                kept.append(tok)
+                hit = words.get(tok)
+                if hit:
+                    intents |= hit
+
+        return kept, intents
+
+    def analyze(self, text: str) -> tuple[List[str], Set[str]]:
+        """Một lượt qua câu hỏi (đã normalize_text): token đã lọc + intent."""
+        return self._scan(TOKEN_RE.findall(text))
+
+    def detect(self, tokens: List[str]) -> Set[str]:
+        return self._scan(tokens)[1]
+
+
+intent_matcher = IntentMatcher.from_file(config.INTENTS_PATH)
+
+
 def detect_intents(tokens: List[str]) -> Set[str]:
-    intents = set()
+    return intent_matcher.detect(tokens)
+
+
+# ======================
+# KNOWLEDGE DOC
+# ======================
+
+# Mỗi trường một bit; điểm của một token = tổng điểm các trường chứa nó
+FIELD_KEYWORDS = 1
+FIELD_TITLE = 2
+FIELD_CONTENT = 4
+
+KEYWORD_WEIGHT = 5
+TITLE_WEIGHT = 3
+CONTENT_WEIGHT = 2
+INTENT_WEIGHT = 8
+
+# FIELD_POINTS[mask] -> điểm, tra bảng thay vì cộng từng trường
+FIELD_POINTS = tuple(
+    (KEYWORD_WEIGHT if m & FIELD_KEYWORDS else 0)
+    + (TITLE_WEIGHT if m & FIELD_TITLE else 0)
+    + (CONTENT_WEIGHT if m & FIELD_CONTENT else 0)
+    for m in range(8)
+)
+
+
+class KnowledgeDoc:
+    """
+    Bản chụp một dòng Knowledge, dùng được cả sau khi session đã đóng.
+
+    Phần chuẩn hoá (lower + tách token) làm một lần khi ghi/nạp knowledge,
+    không lặp lại ở mỗi câu hỏi.
+    """
+
+    __slots__ = (
+        "id", "title", "content", "keywords", "intent", "intent_key", "terms",
+        "passages",
+    )
 
-    for w in tokens:
-        if w in {"login", "đăng", "nhập"}:
-            intents.add("login_issue")
-        if w in {"báo", "cáo", "report"}:
-            intents.add("report")
-        if w in {"lỗi", "sai", "lệch"}:
-            intents.add("report_error")
-        if w in {"chậm", "lag", "treo"}:
-            intents.add("performance")
+    def __init__(self, id: int, title: str | None, content: str,
+                 keywords: str | None, intent: str | None):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.keywords = keywords
+        self.intent = intent
+        self.intent_key = normalize_text(intent or "")
 
-    return intents
+        # term -> bitmask các trường chứa term
+        terms: Dict[str, int] = {}
+        for field, bit in (
+            (keywords, FIELD_KEYWORDS),
+            (title, FIELD_TITLE),
+            (content, FIELD_CONTENT),
+        ):
+            if field:
+                for term in tokenize(field):
+                    terms[term] = terms.get(term, 0) | bit
+        self.terms = terms
+
+        # (start, end, term của đoạn) – chỉ tách khi bài dài hơn một đoạn
+        self.passages: tuple = ()
+        if content and len(content) > config.RAG_PASSAGE_CHARS:
+            spans = split_passages(content, config.RAG_PASSAGE_CHARS)
+            if len(spans) > 1:
+                self.passages = tuple(
+                    (s, e, frozenset(tokenize(content[s:e]))) for s, e in spans
+                )
+
+    @classmethod
+    def from_row(cls, row: Knowledge) -> "KnowledgeDoc":
+        return cls(row.id, row.title, row.content, row.keywords, row.intent)
 
 
 # ======================
-# SCORING
+# HEURISTIC SCORER
 # ======================
 
-def score_knowledge(tokens: List[str], doc: Knowledge, intents: Set[str]) -> int:
-    score = 0
+# Số token hỏi tối đa được nhớ postings đã gộp
+EXPAND_CACHE_SIZE = 1024
+# Độ dài tối đa của n-gram trong chỉ mục chuỗi con (term -> mọi n-gram 1..GRAM_MAX)
+GRAM_MAX = 3
+
+
+def substrings(term: str, max_len: int | None = None) -> Set[str]:
+    """Mọi chuỗi con (dài tối đa max_len) của term."""
+    n = len(term)
+    max_len = n if max_len is None else min(max_len, n)
+    return {term[i:i + size] for size in range(1, max_len + 1) for i in range(n - size + 1)}
+
+
+class HeuristicScorer(Scorer):
+    """
+    Inverted index: term -> {doc id: bitmask trường chứa term}.
+
+    Mỗi token hỏi được FIELD_POINTS điểm theo các trường chứa nó (so khớp theo
+    chuỗi con, như `w in keywords` trước đây), cùng intent thì cộng
+    INTENT_WEIGHT. Token hỏi chỉ gồm ký tự chữ/số nên
+    nếu nó nằm trong một trường thì nó nằm gọn trong một token của trường đó
+    -> gộp postings của mọi term chứa token hỏi (nhớ lại theo token) là đủ để
+    chấm điểm mọi document liên quan mà không đụng tới chuỗi gốc.
+
+    Tìm các term chứa token qua chỉ mục n-gram (n-gram -> term), không quét cả
+    từ điển: token ngắn (<= GRAM_MAX) tra thẳng, token dài lấy tập term của
+    n-gram hiếm nhất rồi kiểm tra lại `token in term`.
+    """
+
+    name = "heuristic"
+
+    def __init__(self, threshold: float):
+        super().__init__(threshold)
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._by_intent: Dict[str, Set[int]] = {}
+        # token -> postings đã gộp; dict giữ thứ tự chèn -> đầy thì bỏ mục cũ nhất
+        self._expand_cache: Dict[str, Dict[int, int]] = {}
+
+    # ---------- delta ----------
+
+    def load(self, docs: Iterable[KnowledgeDoc]):
+        self._postings = {}
+        self._grams = {}
+        self._by_intent = {}
+        self._expand_cache = {}
+        for doc in docs:
+            self._add(doc)
+
+    def upsert(self, doc: KnowledgeDoc):
+        self._add(doc)
+        self._invalidate(doc.terms)
+
+    def remove(self, doc: KnowledgeDoc):
+        for term in doc.terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc.id, None)
+                if not postings:
+                    del self._postings[term]
+                    self._unindex_term(term)
+        ids = self._by_intent.get(doc.intent_key)
+        if ids is not None:
+            ids.discard(doc.id)
+            if not ids:
+                del self._by_intent[doc.intent_key]
+        self._invalidate(doc.terms)
+
+    def _add(self, doc: KnowledgeDoc):
+        for term, bits in doc.terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                for gram in substrings(term, GRAM_MAX):
+                    self._grams.setdefault(gram, set()).add(term)
+            postings[doc.id] = bits
+        if doc.intent_key:
+            self._by_intent.setdefault(doc.intent_key, set()).add(doc.id)
+
+    def _unindex_term(self, term: str):
+        for gram in substrings(term, GRAM_MAX):
+            terms = self._grams.get(gram)
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del self._grams[gram]
+
+    def _invalidate(self, terms: Iterable[str]):
+        # chỉ token là chuỗi con của term vừa đổi mới có postings gộp bị ảnh hưởng
+        if not self._expand_cache:
+            return
+        for term in terms:
+            for token in substrings(term):
+                self._expand_cache.pop(token, None)
+
+    # ---------- query ----------
+
+    def _terms_containing(self, token: str) -> Iterable[str]:
+        if len(token) <= GRAM_MAX:
+            return self._grams.get(token, ())
+        candidates = None
+        for gram in {token[i:i + GRAM_MAX] for i in range(len(token) - GRAM_MAX + 1)}:
+            terms = self._grams.get(gram)
+            if terms is None:
+                return ()
+            if candidates is None or len(terms) < len(candidates):
+                candidates = terms
+        return [term for term in candidates if token in term]
+
+    def _expand(self, token: str) -> Dict[int, int]:
+        """doc id -> bitmask các trường có chứa `token` (theo chuỗi con)."""
+        merged = self._expand_cache.get(token)
+        if merged is None:
+            merged = {}
+            for term in self._terms_containing(token):
+                for doc_id, bits in self._postings[term].items():
+                    merged[doc_id] = merged.get(doc_id, 0) | bits
+            if len(self._expand_cache) >= EXPAND_CACHE_SIZE:
+                del self._expand_cache[next(iter(self._expand_cache))]
+            self._expand_cache[token] = merged
+        return merged
 
-    title = normalize_text(doc.title or "")
-    content = normalize_text(doc.content or "")
-    keywords = normalize_text(doc.keywords or "")
-    intent = normalize_text(doc.intent or "")
+    def scores(self, tokens: Terms, intents: Set[str]) -> Dict[int, float]:
+        """Điểm của mọi document có điểm > 0."""
+        scores: Dict[int, float] = {}
+        for w, n in term_weights(tokens).items():
+            for doc_id, bits in self._expand(w).items():
+                scores[doc_id] = scores.get(doc_id, 0) + n * FIELD_POINTS[bits]
+        for intent in intents:
+            for doc_id in self._by_intent.get(intent, ()):
+                scores[doc_id] = scores.get(doc_id, 0) + INTENT_WEIGHT
+        return scores
 
-    # keyword / title / content
-    for w in tokens:
-        if w in keywords:
-            score += 5
-        if w in title:
-            score += 3
-        if w in content:
-            score += 2
+    def top_k_many(self, queries: Sequence[Query], k: int) -> List[List[tuple[float, int]]]:
+        """
+        Cả lô như một phép nhân ma trận: mỗi token khác nhau của lô chỉ expand
+        một lần thành một hàng (document -> FIELD_POINTS), cột là các document
+        có mặt trong lô (id tăng dần).
+        """
+        vocab: Dict[str, int] = {}
+        for tokens, _ in queries:
+            for w in tokens:
+                vocab.setdefault(w, len(vocab))
+        points = np.asarray(FIELD_POINTS, dtype=np.float64)
+        expanded = [self._expand(w) for w in vocab]
+        ids_per_row = [np.fromiter(m, dtype=np.int64, count=len(m)) for m in expanded]
+        data_per_row = [points[np.fromiter(m.values(), dtype=np.int64, count=len(m))] for m in expanded]
+        intent_ids = {
+            intent: np.fromiter(self._by_intent[intent], dtype=np.int64)
+            for intent in {i for _, intents in queries for i in intents}
+            if intent in self._by_intent
+        }
 
-    # intent match (ưu tiên cao)
-    if intent and intent in intents:
-        score += 8
+        doc_ids = np.unique(np.concatenate([np.zeros(0, dtype=np.int64), *ids_per_row, *intent_ids.values()]))
+        lens = np.fromiter((len(ids) for ids in ids_per_row), dtype=np.int64, count=len(ids_per_row))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(lens, out=indptr[1:])
+        indices = np.searchsorted(doc_ids, np.concatenate([np.zeros(0, dtype=np.int64), *ids_per_row]))
+        data = np.concatenate([np.zeros(0), *data_per_row])
+        intent_cols = {intent: np.searchsorted(doc_ids, ids) for intent, ids in intent_ids.items()}
 
-    return score
+        return top_k_csr(queries, k, vocab, indptr, indices, data, doc_ids, intent_cols, INTENT_WEIGHT)
+
+
+
+def make_scorer(name: str | None = None) -> Scorer:
+    name = (name or config.RAG_SCORER).lower()
+    if name == HeuristicScorer.name:
+        return HeuristicScorer(config.RAG_MIN_SCORE[name])
+    if name == BM25Scorer.name:
+        return BM25Scorer(
+            config.RAG_MIN_SCORE[name],
+            analyzer=tokenize,
+            k1=config.BM25_K1,
+            b=config.BM25_B,
+            intent_boost=config.BM25_INTENT_BOOST,
+        )
+    raise ValueError(f"RAG_SCORER không hợp lệ: {name}")
 
 
+# ======================
+# KNOWLEDGE INDEX
+# ======================
+
+def fuzzy_entry(doc: KnowledgeDoc) -> tuple[int, Dict[str, int], str]:
+    # chỉ keywords + title: ngắn, ít nhiễu, đủ để đoán ý câu gõ không dấu / sai chính tả
+    mask = FIELD_KEYWORDS | FIELD_TITLE
+    terms = {term: bits & mask for term, bits in doc.terms.items() if bits & mask}
+    return doc.id, terms, doc.intent_key
+
+
+def make_fuzzy_index() -> FuzzyIndex:
+    return FuzzyIndex(fold_text, FIELD_POINTS, INTENT_WEIGHT, config.RAG_FUZZY_MIN_SIMILARITY)
+
+
+def dense_text(doc: KnowledgeDoc) -> str:
+    # content dài chỉ lấy phần đầu: đủ ý chính, embed nhanh
+    return "\n".join(
+        part for part in (doc.title, doc.keywords, (doc.content or "")[:config.DENSE_MAX_CHARS]) if part
+    )
+
+
+def query_terms(text: str) -> List[str]:
+    return intent_matcher.analyze(normalize_text(text))[0]
+
+
+def make_dense_index() -> DenseIndex:
+    embedder = make_embedder(
+        config.DENSE_EMBEDDER, config.DENSE_MODEL, config.DENSE_DIM, query_terms, fold_text
+    )
+    return DenseIndex(
+        embedder, VectorStore(config.DENSE_STORE_DIR), dense_text,
+        ann=config.DENSE_ANN, nprobe=config.DENSE_IVF_NPROBE,
+    )
+
+
+def fuse_rankings(rankings: List[List[tuple[float, KnowledgeDoc]]], k: int) -> List[tuple[float, KnowledgeDoc]]:
+    """Reciprocal rank fusion: không cần đưa điểm keyword và cosine về cùng thang."""
+    fused: Dict[int, float] = {}
+    docs: Dict[int, KnowledgeDoc] = {}
+    for ranking in rankings:
+        for rank, (_, doc) in enumerate(ranking):
+            fused[doc.id] = fused.get(doc.id, 0.0) + 1.0 / (config.RAG_RRF_K + rank + 1)
+            docs[doc.id] = doc
+    best = heapq.nlargest(k, fused.items(), key=lambda kv: (kv[1], -kv[0]))
+    return [(score, docs[doc_id]) for doc_id, score in best]
+
+
+class KnowledgeIndex:
+    """Kho KnowledgeDoc trong bộ nhớ + scorer đang dùng, cập nhật theo delta."""
+
+    def __init__(self, scorer: Scorer | None = None, dense: DenseIndex | None = None):
+        self._lock = threading.RLock()
+        self.scorer = scorer or make_scorer()
+        self.fuzzy = make_fuzzy_index()
+        self.dense = dense
+        self.docs: Dict[int, KnowledgeDoc] = {}
+        self.loaded = False
+        # id lớn nhất của knowledge_change đã áp dụng vào index (id nhỏ hơn
+        # chưa commit lúc đọc thì nằm trong RAGChatbot._gaps)
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def load(self, docs: Iterable[KnowledgeDoc], generation: int = 0):
+        with self._lock:
+            self.docs = {doc.id: doc for doc in docs}
+            self.scorer.load(self.docs.values())
+            self.fuzzy.load(fuzzy_entry(doc) for doc in self.docs.values())
+            if self.dense is not None:
+                self.dense.load(self.docs.values())
+            self.generation = generation
+            self.loaded = True
+
+    def upsert(self, doc: KnowledgeDoc):
+        self.apply([doc], ())
+
+    def remove(self, doc_id: int):
+        self.apply((), [doc_id])
+
+    def apply(self, upserts: Sequence[KnowledgeDoc], removed: Iterable[int]):
+        """Áp dụng một lô thay đổi dưới một lần khóa; vector mới embed chung một lượt."""
+        with self._lock:
+            for doc_id in removed:
+                old = self.docs.pop(doc_id, None)
+                if old is not None:
+                    self.scorer.remove(old)
+                self.fuzzy.remove(doc_id)
+                if self.dense is not None:
+                    self.dense.remove(doc_id)
+            for doc in upserts:
+                old = self.docs.get(doc.id)
+                if old is not None:
+                    self.scorer.remove(old)
+                self.docs[doc.id] = doc
+                self.scorer.upsert(doc)
+                self.fuzzy.add(*fuzzy_entry(doc))
+            if self.dense is not None and upserts:
+                self.dense.upsert_many(upserts)
+        # gộp delta của scorer (nếu đủ lớn) trên thread đang áp dụng, không trong câu hỏi
+        self.scorer.compact(self._lock)
+
+    def refresh_dense(self):
+        # build_embeddings.py vừa ghi store mới -> mmap bản mới, bỏ delta đã có trong đó
+        if self.dense is not None and self.dense.store_changed():
+            with self._lock:
+                self.dense.load(self.docs.values())
+
+    def top_k(self, tokens: List[str], intents: Set[str], k: int) -> List[tuple[float, KnowledgeDoc]]:
+        with self._lock:
+            scores = self.scorer.scores(tokens, intents)
+            # heap k phần tử thay vì sort toàn bộ; bằng điểm thì id nhỏ hơn
+            # đứng trước, giống thứ tự duyệt bảng trước đây
+            best = heapq.nlargest(k, scores.items(), key=lambda kv: (kv[1], -kv[0]))
+            return [(score, self.docs[doc_id]) for doc_id, score in best]
+
+    def top_k_many(self, queries: Sequence[Query], k: int) -> List[List[tuple[float, KnowledgeDoc]]]:
+        """Như top_k cho cả lô câu hỏi, chấm một lượt (scorer.top_k_many)."""
+        with self._lock:
+            return [
+                [(score, self.docs[doc_id]) for score, doc_id in found]
+                for found in self.scorer.top_k_many(queries, k)
+            ]
+
+    def dense_top_k(self, queries: List[List[str]], k: int) -> List[List[tuple[float, KnowledgeDoc]]]:
+        """Mỗi câu hỏi (danh sách token) -> k cặp (cosine, doc); cả lô một phép nhân ma trận."""
+        vectors = self.dense.embed_queries([" ".join(tokens) for tokens in queries])
+        with self._lock:
+            return [
+                [(score, self.docs[doc_id]) for score, doc_id in found if doc_id in self.docs]
+                for found in self.dense.search(vectors, k)
+            ]
+
+    def fuzzy_top_k(self, tokens: List[str], intents: Set[str], k: int) -> List[tuple[float, KnowledgeDoc]]:
+        with self._lock:
+            return [(score, self.docs[doc_id]) for score, doc_id in self.fuzzy.top_k(tokens, intents, k)]
+
+    def search(self, tokens: List[str], intents: Set[str]) -> tuple[float, Optional[KnowledgeDoc]]:
+        best = self.top_k(tokens, intents, 1)
+        return best[0] if best else (0, None)
+
+
+class RetrievalHit:
+    """Một document trong kết quả top-k cùng các đoạn liên quan nhất."""
+
+    __slots__ = ("doc", "score", "text")
+
+    def __init__(self, doc: KnowledgeDoc, score: float, text: str):
+        self.doc = doc
+        self.score = score
+        self.text = text
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.doc.id,
+            "title": self.doc.title,
+            "score": round(float(self.score), 4),
+            "text": self.text,
+        }
+
+
+def select_passages(doc: KnowledgeDoc, tokens: List[str], limit: int) -> str:
+    """Ghép `limit` đoạn khớp câu hỏi nhiều nhất (giữ thứ tự trong bài)."""
+    if not doc.passages:
+        return doc.content.strip()
+
+    def relevance(i: int) -> tuple:
+        terms = doc.passages[i][2]
+        matched = sum(1 for w in tokens if any(w in t for t in terms))
+        return matched, -i
+
+    chosen = sorted(heapq.nlargest(limit, range(len(doc.passages)), key=relevance))
+    return "\n\n".join(doc.content[doc.passages[i][0]:doc.passages[i][1]] for i in chosen)
+
+
+def answer_chunks(answer: str, max_chars: int) -> List[str]:
+    """Cắt câu trả lời theo đoạn văn để stream; ghép lại đúng bằng `answer`."""
+    spans = split_passages(answer, max_chars)
+    if len(spans) <= 1:
+        return [answer]
+    ends = [end for _, end in spans[:-1]] + [len(answer)]
+    return [answer[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+
+# Sinh câu trả lời từng phần (vd. LLM stream token) từ câu hỏi + tài liệu đã chọn
+AnswerGenerator = Callable[[str, List[RetrievalHit]], Iterable[str]]
+
+# ======================
+# ANSWER CACHE
+# ======================
+
+def make_answer_cache(backend: str | None = None):
+    backend = backend or config.ANSWER_CACHE_BACKEND
+    if backend == "memory":
+        return TTLCache(config.ANSWER_CACHE_SIZE, config.ANSWER_CACHE_TTL)
+    if backend == "sqlite":
+        return SQLiteCache(config.ANSWER_CACHE_PATH, config.ANSWER_CACHE_SIZE, config.ANSWER_CACHE_TTL)
+    raise ValueError(f"ANSWER_CACHE_BACKEND không hỗ trợ: {backend}")
+
+
+def answer_cache_key(generation: str, tokens: Terms, intents: Set[str], k: int) -> str:
+    # thứ tự token không đổi điểm (cộng dồn) nên sắp xếp; giữ token lặp vì có cộng điểm
+    if isinstance(tokens, dict):
+        # câu hỏi mở rộng theo ngữ cảnh: trọng số là một phần của khóa
+        terms = sorted([w, round(n, 4)] for w, n in tokens.items())
+    else:
+        terms = sorted(tokens)
+    return json.dumps(
+        [generation, terms, sorted(intents), k],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+
+
+def expand_query(tokens: List[str], intents: Set[str], context: Sequence[Turn], decay: float) -> Query:
+    """
+    Mở rộng câu hỏi theo các lượt trước (mới nhất trước): token câu hiện tại
+    trọng số 1, lượt trước decay, lượt trước nữa decay², ... Câu hiện tại
+    không có intent ("còn cái kia thì sao?") thì lấy intent của lượt gần nhất có.
+    """
+    if not context:
+        return tokens, intents
+    weights = dict(term_weights(tokens))
+    weight = 1.0
+    for past_tokens, past_intents in context:
+        weight *= decay
+        for w, n in term_weights(past_tokens).items():
+            weights[w] = weights.get(w, 0) + n * weight
+    if not intents:
+        intents = next((set(i) for _, i in context if i), set())
+    return weights, intents
+
 # ======================
 # RAG CHATBOT
 # ======================
 
 class RAGChatbot:
 
-    def answer(self, question: str) -> str:
-        question = normalize_text(question)
-        if not question:
-            return "Bạn hãy nhập câu hỏi cụ thể hơn nhé."
+    def __init__(self, scorer: Scorer | None = None, answer_cache=None,
+                 generator: AnswerGenerator | None = None, dense: DenseIndex | None = None):
+        if dense is None and config.RAG_RETRIEVAL != "keyword":
+            dense = make_dense_index()
+        self.index = KnowledgeIndex(scorer, dense)
+        self.generator = generator
+        self._sync_lock = threading.Lock()
+        self._next_poll = 0.0
+        # id knowledge_change <= generation chưa thấy lúc đọc -> hạn chờ (monotonic).
+        # Chỉ thay cả dict (dưới _sync_lock), không sửa tại chỗ: _cache_generation đọc không khóa
+        self._gaps: Dict[int, float] = {}
+
+        self.answer_cache = answer_cache if answer_cache is not None else make_answer_cache()
+        self._shared_cache = isinstance(self.answer_cache, SQLiteCache)
+        # sửa knowledge ngay trong worker này (upsert/remove) mà chưa qua _catch_up:
+        # generation chưa đổi nên khóa cache dùng chung chưa phản ánh được
+        self._edit_counter = itertools.count(1)
+        self._local_edits = 0
+        self._synced_edits = 0
+
+        self.contexts = ContextWindows(
+            config.CONTEXT_TURNS, config.CONTEXT_MAX_CONVERSATIONS, self._load_context
+        )
+
+    def load_index(self):
+        # 🔒 LẤY DATA TRONG SESSION, CHỈ MỘT LẦN
+        with get_session() as db:  # type: Session
+            generation = db.query(func.max(KnowledgeChange.id)).scalar() or 0
+            present = {
+                cid for (cid,) in db.query(KnowledgeChange.id)
+                .filter(KnowledgeChange.id > generation - config.INDEX_GAP_LOOKBACK)
+            }
+            docs = [
+                KnowledgeDoc.from_row(row)
+                for row in db.query(Knowledge).order_by(Knowledge.id).all()
+            ]
+        self.index.load(docs, generation)
+        self._gaps = self._with_gaps(
+            {}, max(1, generation - config.INDEX_GAP_LOOKBACK + 1), generation, present
+        )
+        self._invalidate_answers()
+
+    @staticmethod
+    def _with_gaps(gaps: Dict[int, float], low: int, high: int, present: Set[int]) -> Dict[int, float]:
+        """
+        gaps + các id trong [low, high] không có trong present. Id tự tăng được
+        cấp lúc INSERT nhưng chỉ thấy được khi commit: transaction commit muộn
+        để lại id nhỏ hơn watermark, phải hỏi lại tới khi thấy hoặc hết hạn.
+        """
+        deadline = time.monotonic() + config.INDEX_GAP_GRACE_SECONDS
+        missing = {cid: deadline for cid in range(low, high + 1) if cid not in present}
+        return {**missing, **gaps} if missing else gaps
+
+    # ---------- delta từ admin endpoints ----------
+
+    def upsert_knowledge(self, row: Knowledge):
+        self.apply_knowledge([KnowledgeDoc.from_row(row)])
+
+    def remove_knowledge(self, kid: int):
+        self.apply_knowledge((), [kid])
 
-        tokens = [
-            t for t in tokenize(question)
-            if t not in STOPWORDS and len(t) > 2
+    def apply_knowledge(self, upserts: Sequence[KnowledgeDoc], removed: Iterable[int] = ()):
+        # nhập hàng loạt: một lần cập nhật index + xóa cache cho cả lô
+        self.index.apply(upserts, removed)
+        self._local_edits = next(self._edit_counter)
+        self._invalidate_answers()
+
+    def _invalidate_answers(self):
+        # cache dùng chung: khóa đã chứa generation, phần tử cũ tự bị LRU đẩy ra
+        if not self._shared_cache:
+            self.answer_cache.clear()
+
+    # ---------- bắt kịp thay đổi của worker khác ----------
+
+    def needs_sync(self) -> bool:
+        # handler async dùng để chỉ đẩy sync() sang thread khi thật sự phải đọc DB
+        return not self.index.loaded or time.monotonic() >= self._next_poll
+
+    def sync(self, force: bool = False):
+        if not self.index.loaded:
+            with self._sync_lock:
+                if not self.index.loaded:
+                    self.load_index()
+                    self._next_poll = time.monotonic() + config.INDEX_POLL_SECONDS
+            return
+
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return
+        # worker khác đang poll thì thôi, dùng index hiện tại
+        if not self._sync_lock.acquire(blocking=force):
+            return
+        try:
+            self._next_poll = now + config.INDEX_POLL_SECONDS
+            with stage("index_sync"):
+                self._catch_up()
+                self.index.refresh_dense()
+        finally:
+            self._sync_lock.release()
+
+    def _catch_up(self):
+        # sửa cục bộ đã commit knowledge_change trước khi upsert -> watermark đọc sau đây có nó
+        edits = self._local_edits
+        generation = self.index.generation
+        # id bỏ trống quá hạn: transaction đã rollback (hoặc sequence nhảy số), thôi chờ
+        now = time.monotonic()
+        gaps = {cid: deadline for cid, deadline in self._gaps.items() if deadline > now}
+        with get_session() as db:  # type: Session
+            watermark = max(db.query(func.max(KnowledgeChange.id)).scalar() or 0, generation)
+            if watermark == generation and not gaps:
+                self._gaps = gaps
+                self._synced_edits = edits
+                return
+
+            changes = (
+                db.query(KnowledgeChange.id, KnowledgeChange.knowledge_id)
+                .filter(
+                    KnowledgeChange.id >= min(gaps, default=generation + 1),
+                    KnowledgeChange.id <= watermark,
+                )
+                .all()
+            )
+            fresh = [(cid, kid) for cid, kid in changes if cid > generation or cid in gaps]
+            gaps = self._with_gaps(gaps, generation + 1, watermark, {cid for cid, _ in changes})
+            for cid, _ in fresh:
+                gaps.pop(cid, None)
+
+            rows: Dict[int, KnowledgeDoc] = {}
+            ids = sorted({kid for _, kid in fresh})
+            # chia nhỏ IN (...) – MSSQL giới hạn ~2100 tham số mỗi câu lệnh
+            for i in range(0, len(ids), 1000):
+                for row in db.query(Knowledge).filter(Knowledge.id.in_(ids[i:i + 1000])):
+                    rows[row.id] = KnowledgeDoc.from_row(row)
+
+        # áp dụng theo trạng thái hiện tại của từng dòng, không phát lại từng op
+        if ids:
+            self.index.apply(
+                [rows[kid] for kid in ids if kid in rows],
+                [kid for kid in ids if kid not in rows],
+            )
+        self.index.generation = watermark
+        self._gaps = gaps
+        self._synced_edits = edits
+        if ids:
+            self._invalidate_answers()
+
+    # ---------- truy xuất ----------
+
+    def _retrieval_mode(self) -> str:
+        return config.RAG_RETRIEVAL if self.index.dense is not None else "keyword"
+
+    def embeds_queries(self) -> bool:
+        # dense / hybrid: mỗi câu hỏi phải qua embedder (tốn CPU, có thể gọi mạng)
+        # -> handler async chạy respond trên thread thay vì trên event loop
+        return self._retrieval_mode() != "keyword"
+
+    def _retrieve(self, tokens: List[str], intents: Set[str], k: int) -> List[RetrievalHit]:
+        mode = self._retrieval_mode()
+        if mode == "keyword":
+            ranked = self._keyword_ranked(tokens, intents, k)
+        elif mode == "dense":
+            ranked = self._dense_ranked(tokens, k)
+        else:
+            # hybrid: lấy rộng ở mỗi bên rồi trộn theo thứ hạng
+            n = max(k, config.RAG_HYBRID_CANDIDATES)
+            ranked = fuse_rankings(
+                [self._keyword_ranked(tokens, intents, n), self._dense_ranked(tokens, n)], k
+            )
+        return self._hits(tokens, intents, k, ranked)
+
+    def _retrieve_many(self, queries: List[Query], k: int) -> List[List[RetrievalHit]]:
+        """Như _retrieve cho cả lô: keyword một ma trận điểm, dense một lần embed + nhân ma trận."""
+        if len(queries) == 1:
+            return [self._retrieve(*queries[0], k)]
+        mode = self._retrieval_mode()
+        if mode == "keyword":
+            rankings = self._keyword_ranked_many(queries, k)
+        elif mode == "dense":
+            rankings = self._dense_ranked_many(queries, k)
+        else:
+            n = max(k, config.RAG_HYBRID_CANDIDATES)
+            rankings = [
+                fuse_rankings([keyword, dense], k)
+                for keyword, dense in zip(self._keyword_ranked_many(queries, n), self._dense_ranked_many(queries, n))
+            ]
+        return [self._hits(tokens, intents, k, ranked) for (tokens, intents), ranked in zip(queries, rankings)]
+
+    def _hits(self, tokens: List[str], intents: Set[str], k: int,
+              ranked: List[tuple[float, KnowledgeDoc]]) -> List[RetrievalHit]:
+        if not ranked and config.RAG_FUZZY:
+            # gõ không dấu / sai chính tả: thử lại trên keywords + title đã bỏ dấu
+            with stage("fuzzy"):
+                ranked = [
+                    (s, doc) for s, doc in self.index.fuzzy_top_k(tokens, intents, k)
+                    if s >= config.RAG_FUZZY_MIN_SCORE
+                ]
+
+        limit = config.RAG_ANSWER_PASSAGES if config.RAG_PASSAGES else 0
+        return [
+            RetrievalHit(doc, score, select_passages(doc, tokens, limit) if limit else doc.content.strip())
+            for score, doc in ranked
         ]
 
+    def _keyword_ranked(self, tokens: List[str], intents: Set[str], k: int) -> List[tuple[float, KnowledgeDoc]]:
+        threshold = self.index.scorer.threshold
+        with stage("score"):
+            return [(s, doc) for s, doc in self.index.top_k(tokens, intents, k) if s >= threshold]
+
+    def _dense_ranked(self, tokens: List[str], k: int) -> List[tuple[float, KnowledgeDoc]]:
+        return self._dense_ranked_many([(tokens, set())], k)[0]
+
+    def _keyword_ranked_many(self, queries: List[Query], k: int) -> List[List[tuple[float, KnowledgeDoc]]]:
+        threshold = self.index.scorer.threshold
+        with stage("score"):
+            return [
+                [(s, doc) for s, doc in ranked if s >= threshold]
+                for ranked in self.index.top_k_many(queries, k)
+            ]
+
+    def _dense_ranked_many(self, queries: List[Query], k: int) -> List[List[tuple[float, KnowledgeDoc]]]:
+        with stage("dense"):
+            return [
+                [(s, doc) for s, doc in ranked if s >= config.DENSE_MIN_SCORE]
+                for ranked in self.index.dense_top_k([tokens for tokens, _ in queries], k)
+            ]
+
+    def _index_version(self) -> str:
+        # trạng thái index = generation + các id còn chờ: worker khác chỉ dùng
+        # chung cache khi đã áp dụng đúng cùng tập thay đổi
+        generation, gaps = self.index.generation, self._gaps
+        if not gaps:
+            return str(generation)
+        return f"{generation}~{zlib.crc32(','.join(map(str, sorted(gaps))).encode()):08x}"
+
+    def _cache_generation(self) -> Optional[str]:
+        if self._local_edits == self._synced_edits:
+            return self._index_version()
+        if self._shared_cache:
+            # worker khác cùng generation vẫn thấy dữ liệu cũ -> bỏ qua cache tới lần poll sau
+            return None
+        return f"{self._index_version()}+{self._local_edits}"
+
+    def _cached_retrieve(self, tokens: List[str], intents: Set[str], k: int) -> List[RetrievalHit]:
+        return self._cached_retrieve_many([(tokens, intents)], k)[0]
+
+    def _cached_retrieve_many(self, queries: List[Query], k: int, sync: bool = True) -> List[List[RetrievalHit]]:
+        """Câu nào có trong answer cache thì lấy ra, phần còn lại truy xuất chung một lô."""
+        if sync:
+            self.sync()
+        generation = self._cache_generation()
+        if generation is None or self.answer_cache.maxsize <= 0:
+            return self._retrieve_many(queries, k)
+
+        results: List[Optional[List[RetrievalHit]]] = [None] * len(queries)
+        keys = [answer_cache_key(generation, tokens, intents, k) for tokens, intents in queries]
+        docs = self.index.docs
+        for i, key in enumerate(keys):
+            cached = self.answer_cache.get(key)
+            if cached is not None and all(doc_id in docs for doc_id, _, _ in cached):
+                results[i] = [RetrievalHit(docs[doc_id], score, text) for doc_id, score, text in cached]
+
+        missing = [i for i, hits in enumerate(results) if hits is None]
+        if missing:
+            for i, hits in zip(missing, self._retrieve_many([queries[i] for i in missing], k)):
+                self.answer_cache.set(keys[i], [(h.doc.id, float(h.score), h.text) for h in hits])
+                results[i] = hits
+        return results
+
+    def cache_stats(self) -> dict:
+        return {"backend": "sqlite" if self._shared_cache else "memory", **self.answer_cache.stats()}
+
+    def retrieve(self, question: str, k: int | None = None) -> List[RetrievalHit]:
+        """Top-k document đủ ngưỡng tin cậy, điểm giảm dần."""
+        tokens, intents = intent_matcher.analyze(normalize_text(question))
         if not tokens:
-            return "Bạn có thể hỏi rõ hơn về vấn đề báo cáo web không?"
+            return []
+        return self._cached_retrieve(tokens, intents, k or config.RAG_TOP_K)
 
-        intents = detect_intents(tokens)
+    def search_knowledge(self, query: str, limit: int) -> List[tuple[float, KnowledgeDoc]]:
+        """Tìm cho trang admin: xếp hạng như truy xuất nhưng không cắt theo ngưỡng tin cậy."""
+        self.sync()
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        ranked = self.index.top_k(tokens, set(), limit)
+        if not ranked and config.RAG_FUZZY:
+            ranked = self.index.fuzzy_top_k(tokens, set(), limit)
+        return [(s, doc) for s, doc in ranked if s > 0]
 
-        best_score = 0
-        best_answer: str | None = None
+    # ---------- ngữ cảnh hội thoại ----------
 
-        # 🔒 LẤY DATA TRONG SESSION
+    def _load_context(self, conversation_id: int, user_id: int, n: int) -> List[Turn]:
+        """Cold miss: n câu hỏi cuối của hội thoại trong chat_history, cũ trước."""
         with get_session() as db:  # type: Session
-            docs = db.query(Knowledge).all()
-
-            for doc in docs:
-                score = score_knowledge(tokens, doc, intents)
-                if score > best_score:
-                    best_score = score
-                    best_answer = doc.content  # ⭐ COPY TEXT
-
-        # ❌ Không đủ tin cậy → hỏi lại
-        if not best_answer or best_score < 8:
-            return (
-                "Mình chưa xác định rõ vấn đề bạn đang gặp.\n"
-                "💡 Bạn đang hỏi về **lỗi, báo cáo hay hiệu năng** của hệ thống?"
+            rows = (
+                db.query(ChatHistory.question)
+                .filter(ChatHistory.conversation_id == conversation_id, ChatHistory.user_id == user_id)
+                .order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc())
+                .limit(n)
+                .all()
             )
+        return [intent_matcher.analyze(normalize_text(q)) for (q,) in reversed(rows)]
+
+    def conversation_context(self, conversation_id: int, user_id: int) -> List[Turn]:
+        """Các lượt hỏi trước (mới nhất trước); có thể đọc DB -> gọi trên thread."""
+        return self.contexts.get(conversation_id, user_id)
+
+    def remember_turn(self, conversation_id: int, user_id: int, question: str, new: bool = False):
+        """Ghi lượt hỏi vừa trả lời vào cửa sổ ngữ cảnh (new: hội thoại vừa tạo)."""
+        if not self.contexts.enabled:
+            return
+        tokens, intents = intent_matcher.analyze(normalize_text(question))
+        if tokens:
+            self.contexts.record(conversation_id, user_id, (tokens, intents), new)
+
+    # ---------- trả lời ----------
+
+    def respond(self, question: str, k: int = 1, context: Sequence[Turn] = (),
+                sync: bool = True) -> tuple[str, List[RetrievalHit]]:
+        return self.respond_many([question], k, [context], sync)[0]
+
+    def respond_many(self, questions: Sequence[str], k: int = 1,
+                     contexts: Sequence[Sequence[Turn]] | None = None,
+                     sync: bool = True) -> List[tuple[str, List[RetrievalHit]]]:
+        """
+        respond cho cả lô câu hỏi; phần truy xuất chấm chung một lượt.
+        contexts[i]: các lượt trước của câu i (mới nhất trước) để mở rộng truy vấn.
+        sync=False: không nạp / poll index (không chạm DB) – handler async đã
+        gọi sync() trên thread ngay trước đó.
+        """
+        results: List[Optional[tuple[str, List[RetrievalHit]]]] = [None] * len(questions)
+        pending: List[int] = []
+        queries: List[Query] = []
+        with stage("analyze"):
+            for i, question in enumerate(questions):
+                question = normalize_text(question)
+                if not question:
+                    results[i] = "Bạn hãy nhập câu hỏi cụ thể hơn nhé.", []
+                    continue
+                tokens, intents = intent_matcher.analyze(question)
+                context = contexts[i] if contexts else ()
+                # câu hỏi nối tiếp có thể không còn token nào đáng kể -> dựa vào ngữ cảnh
+                if not tokens and not context:
+                    results[i] = "Bạn có thể hỏi rõ hơn về vấn đề báo cáo web không?", []
+                    continue
+                pending.append(i)
+                queries.append(expand_query(tokens, intents, context, config.CONTEXT_DECAY))
+
+        if queries:
+            with stage("retrieve"):
+                found = self._cached_retrieve_many(queries, max(k, 1), sync)
+            for i, hits in zip(pending, found):
+                # ❌ Không đủ tin cậy → hỏi lại
+                if not hits or not hits[0].text:
+                    results[i] = (
+                        "Mình chưa xác định rõ vấn đề bạn đang gặp.\n"
+                        "💡 Bạn đang hỏi về **lỗi, báo cáo hay hiệu năng** của hệ thống?"
+                    ), []
+                else:
+                    results[i] = hits[0].text, hits
+        return results
+
+    def stream(self, question: str, k: int = 1, context: Sequence[Turn] = (),
+               sync: bool = True) -> tuple[Iterable[str], List[RetrievalHit]]:
+        """
+        Câu trả lời dạng các phần nối tiếp nhau: có generator thì lấy từ
+        generator (có thể chặn giữa các phần), không thì cắt theo đoạn văn.
+        """
+        answer, hits = self.respond(question, k, context, sync)
+        if hits and self.generator is not None:
+            return self.generator(question, hits), hits
+        return answer_chunks(answer, config.CHAT_STREAM_CHUNK_CHARS), hits
 
+    def answer(self, question: str, context: Sequence[Turn] = ()) -> str:
         # ✅ CHỈ RETURN STRING
-        return best_answer.strip()
+        return self.respond(question, context=context)[0]
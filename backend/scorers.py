@@ -0,0 +1,504 @@
+"""
+Các bộ chấm điểm knowledge cho RAGChatbot.
+
+Scorer nhận delta (load / upsert / remove) từ KnowledgeIndex và trả về
+{doc id: điểm} cho một câu hỏi đã tách token, hoặc top-k của cả lô câu hỏi
+(top_k_many: ma trận câu hỏi x document).
+
+Token của câu hỏi là danh sách (token lặp = cộng điểm thêm lần nữa) hoặc dict
+token -> trọng số (câu hỏi mở rộng theo các lượt trước trong hội thoại); điểm
+tuyến tính theo trọng số, danh sách tương đương dict đếm số lần.
+"""
+import heapq
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Sequence, Set, Union
+
+import numpy as np
+
+# số ô tối đa của một ma trận điểm câu hỏi x document (float64, ~32 MB);
+# lô lớn hơn thì chấm theo từng phần
+MATRIX_CELLS = 1 << 22
+
+Terms = Union[List[str], Dict[str, float]]
+Query = tuple[Terms, Set[str]]
+
+
+def term_weights(tokens: Terms) -> Dict[str, float]:
+    if isinstance(tokens, dict):
+        return tokens
+    counts: Dict[str, float] = {}
+    for w in tokens:
+        counts[w] = counts.get(w, 0) + 1
+    return counts
+
+
+def query_rows(queries: Sequence[Query], vocab: Dict[str, int]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(câu hỏi, hàng term, số lần lặp) cho mọi term của lô có trong vocab."""
+    q_idx: List[int] = []
+    rows: List[int] = []
+    reps: List[int] = []
+    for i, (tokens, _) in enumerate(queries):
+        counts: Dict[int, float] = {}
+        for w, n in term_weights(tokens).items():
+            row = vocab.get(w)
+            if row is not None:
+                counts[row] = counts.get(row, 0) + n
+        q_idx.extend([i] * len(counts))
+        rows.extend(counts)
+        reps.extend(counts.values())
+    return (
+        np.asarray(q_idx, dtype=np.int64),
+        np.asarray(rows, dtype=np.int64),
+        np.asarray(reps, dtype=np.float64),
+    )
+
+
+def score_matrix(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray,
+                 q_idx: np.ndarray, rows: np.ndarray, reps: np.ndarray,
+                 n_queries: int, n_cols: int) -> np.ndarray:
+    """
+    (câu hỏi x term) nhân (term x document, CSR) -> ma trận điểm dày
+    n_queries x n_cols: gom các hàng CSR của cả lô rồi một lần bincount
+    theo ô (câu hỏi, cột).
+    """
+    if not len(rows):
+        return np.zeros((n_queries, n_cols), dtype=np.float64)
+    starts = indptr[rows]
+    lens = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(lens.sum())
+    cells = np.repeat(q_idx, lens) * n_cols + indices[offsets]
+    weights = data[offsets] * np.repeat(reps, lens)
+    return np.bincount(cells, weights=weights, minlength=n_queries * n_cols).reshape(n_queries, n_cols)
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> List[List[tuple[float, int]]]:
+    """
+    Mỗi hàng -> tối đa k cặp (điểm, cột) có điểm > 0, điểm giảm dần, bằng điểm
+    thì cột nhỏ trước (cùng thứ tự với heapq.nlargest theo (điểm, -id)).
+    """
+    n_rows, n_cols = scores.shape
+    out: List[List[tuple[float, int]]] = [[] for _ in range(n_rows)]
+    if not n_cols or k <= 0:
+        return out
+    mask = scores > 0
+    if k < n_cols:
+        # ứng viên: >= điểm lớn thứ k của hàng (giữ đủ các ô bằng điểm ở biên)
+        kth = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+        mask &= scores >= kth[:, None]
+    rows, cols = np.nonzero(mask)
+    values = scores[rows, cols]
+    order = np.lexsort((cols, -values, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < k
+    for r, c, v in zip(rows[keep].tolist(), cols[keep].tolist(), values[keep].tolist()):
+        out[r].append((v, c))
+    return out
+
+
+def top_k_csr(queries: Sequence[Query], k: int, vocab: Dict[str, int],
+              indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, col_ids: np.ndarray,
+              intent_cols: Dict[str, np.ndarray], intent_boost: float) -> List[List[tuple[float, int]]]:
+    """
+    top-k (điểm, doc id) của cả lô trên ma trận term x document dạng CSR;
+    col_ids: doc id của từng cột, tăng dần -> bằng điểm thì id nhỏ trước.
+    """
+    q_idx, rows, reps = query_rows(queries, vocab)
+    n_cols = len(col_ids)
+    chunk = max(1, MATRIX_CELLS // max(n_cols, 1))
+
+    results: List[List[tuple[float, int]]] = []
+    for start in range(0, len(queries), chunk):
+        end = min(start + chunk, len(queries))
+        lo, hi = np.searchsorted(q_idx, (start, end))
+        scores = score_matrix(indptr, indices, data, q_idx[lo:hi] - start, rows[lo:hi], reps[lo:hi], end - start, n_cols)
+        for i, (_, intents) in enumerate(queries[start:end]):
+            for intent in intents:
+                cols = intent_cols.get(intent)
+                if cols is not None:
+                    scores[i, cols] += intent_boost
+        results.extend(
+            [(score, int(col_ids[col])) for score, col in row]
+            for row in top_k_rows(scores, k)
+        )
+    return results
+
+
+class Scorer(ABC):
+    name = ""
+
+    def __init__(self, threshold: float):
+        # điểm tối thiểu để coi là trả lời được
+        self.threshold = threshold
+
+    @abstractmethod
+    def load(self, docs: Iterable) -> None:
+        ...
+
+    @abstractmethod
+    def upsert(self, doc) -> None:
+        ...
+
+    @abstractmethod
+    def remove(self, doc) -> None:
+        ...
+
+    @abstractmethod
+    def scores(self, tokens: Terms, intents: Set[str]) -> Dict[int, float]:
+        ...
+
+    def top_k_many(self, queries: Sequence[Query], k: int) -> List[List[tuple[float, int]]]:
+        """Mỗi câu hỏi -> k cặp (điểm, doc id); mặc định chấm lần lượt từng câu."""
+        return [
+            [(score, doc_id) for doc_id, score in
+             heapq.nlargest(k, self.scores(tokens, intents).items(), key=lambda kv: (kv[1], -kv[0]))]
+            for tokens, intents in queries
+        ]
+
+    def compact(self, lock) -> None:
+        """
+        Gộp các delta tích lũy vào cấu trúc chính; KnowledgeIndex gọi sau mỗi
+        lô thay đổi, trên thread, ngoài khóa của index (lock: khóa đó, giữ khi
+        đọc / thay trạng thái). Mặc định không có gì để gộp.
+        """
+
+
+class _Segment:
+    """
+    Phần chính bất biến của BM25Scorer: tf thô dạng CSR term x document (cột
+    theo doc id tăng dần). Trọng số BM25 không tính sẵn mà tính lúc chấm từ
+    idf / avgdl hiện tại, nên delta không làm phần chính lỗi thời.
+    """
+
+    __slots__ = ("doc_ids", "col_of", "vocab", "indptr", "indices", "tf", "cell_lengths", "intent_cols")
+
+    def __init__(self, docs: Dict[int, tuple], intents: Dict[int, str]):
+        doc_ids = sorted(docs)
+
+        vocab: Dict[str, int] = {}
+        term_ids: List[int] = []
+        cols: List[int] = []
+        tfs: List[float] = []
+        lengths = np.zeros(len(doc_ids), dtype=np.float64)
+        for col, doc_id in enumerate(doc_ids):
+            tf, length = docs[doc_id]
+            lengths[col] = length
+            for term, count in tf.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                cols.append(col)
+                tfs.append(count)
+
+        term_arr = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_arr, kind="stable")
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_arr, minlength=len(vocab)), out=indptr[1:])
+
+        col_of = {doc_id: col for col, doc_id in enumerate(doc_ids)}
+        intent_cols: Dict[str, List[int]] = {}
+        for doc_id, intent in intents.items():
+            intent_cols.setdefault(intent, []).append(col_of[doc_id])
+
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        self.col_of = col_of
+        self.vocab = vocab
+        self.indptr = indptr
+        self.indices = np.asarray(cols, dtype=np.int32)[order]
+        self.tf = np.asarray(tfs, dtype=np.float32)[order]
+        # độ dài document của từng ô, đỡ một lần gom khi chấm
+        self.cell_lengths = lengths.astype(np.float32)[self.indices]
+        self.intent_cols = {k: np.asarray(v, dtype=np.int64) for k, v in intent_cols.items()}
+
+
+class BM25Scorer(Scorer):
+    """
+    BM25 trên ma trận thưa term x document (CSR: indptr / indices / tf).
+
+    Document nằm ở phần chính (_Segment, dựng một lần) hoặc ở delta nhỏ (các
+    document đổi sau lần dựng; bản cũ trong phần chính bị đánh dấu chết).
+    df / tổng độ dài cập nhật theo từng delta, nên điểm luôn bằng điểm của một
+    lần dựng lại từ đầu. Chấm một lô chỉ gom các hàng của term trong lô (cả hai
+    phần) thành một CSR nhỏ rồi cộng dồn theo cột bằng np.bincount; delta được
+    gộp vào phần chính trong compact(), không bao giờ trong câu hỏi.
+    So khớp theo token nguyên vẹn ("báo" không còn khớp vào từ dài hơn).
+    """
+
+    name = "bm25"
+
+    # gộp delta khi số document đổi từ lần dựng trước vượt ngưỡng này
+    DELTA_MIN_DOCS = 256
+    DELTA_RATIO = 0.05
+
+    def __init__(
+        self,
+        threshold: float,
+        analyzer: Callable[[str], List[str]],
+        k1: float = 1.2,
+        b: float = 0.75,
+        intent_boost: float = 2.0,
+        field_weights: tuple = (3, 2, 1),  # keywords, title, content
+    ):
+        super().__init__(threshold)
+        self.analyzer = analyzer
+        self.k1 = k1
+        self.b = b
+        self.intent_boost = intent_boost
+        self.field_weights = field_weights
+
+        # doc id -> (term -> tf có trọng số trường, độ dài), mọi document còn sống
+        self._tf: Dict[int, tuple] = {}
+        self._intent: Dict[int, str] = {}
+        # thống kê toàn cục cho idf / avgdl
+        self._df: Dict[str, int] = {}
+        self._total_len = 0.0
+
+        self._main = _Segment({}, {})
+        self._alive = np.ones(0, dtype=bool)
+        self._dead = 0
+        # document đổi sau lần dựng phần chính: doc id -> (tf, độ dài), và term -> {doc id: tf}
+        self._delta: Dict[int, tuple] = {}
+        self._delta_postings: Dict[str, Dict[int, float]] = {}
+        # doc id -> version của lần đổi cuối (để compact biết cái gì đổi trong lúc dựng)
+        self._version = 0
+        self._touched: Dict[int, int] = {}
+        self._compacting = False
+        # (doc id từng cột, cột của phần chính, doc id delta -> cột); None = cần tính lại
+        self._layout = None
+
+    # ---------- delta ----------
+
+    def _analyze(self, doc) -> tuple:
+        tf: Dict[str, float] = {}
+        length = 0.0
+        for field, weight in zip((doc.keywords, doc.title, doc.content), self.field_weights):
+            if not field:
+                continue
+            for term in self.analyzer(field):
+                tf[term] = tf.get(term, 0.0) + weight
+                length += weight
+        return tf, length
+
+    def _count(self, tf: Dict[str, float], length: float, sign: int):
+        for term in tf:
+            n = self._df.get(term, 0) + sign
+            if n:
+                self._df[term] = n
+            else:
+                del self._df[term]
+        self._total_len += sign * length
+
+    def load(self, docs: Iterable) -> None:
+        self._tf = {}
+        self._intent = {}
+        for doc in docs:
+            self._tf[doc.id] = self._analyze(doc)
+            if doc.intent_key:
+                self._intent[doc.id] = doc.intent_key
+        self._df = {}
+        self._total_len = 0.0
+        for tf, length in self._tf.values():
+            self._count(tf, length, 1)
+        self._install(_Segment(self._tf, self._intent), self._version)
+
+    def upsert(self, doc) -> None:
+        self._forget(doc.id)
+        entry = tf, length = self._analyze(doc)
+        self._tf[doc.id] = entry
+        self._count(tf, length, 1)
+        self._delta[doc.id] = entry
+        for term, count in tf.items():
+            self._delta_postings.setdefault(term, {})[doc.id] = count
+        if doc.intent_key:
+            self._intent[doc.id] = doc.intent_key
+        else:
+            self._intent.pop(doc.id, None)
+        self._touch(doc.id)
+
+    def remove(self, doc) -> None:
+        self._forget(doc.id)
+        self._intent.pop(doc.id, None)
+        self._touch(doc.id)
+
+    def _forget(self, doc_id: int):
+        """Bỏ bản hiện tại của document khỏi thống kê và khỏi delta / phần chính."""
+        entry = self._tf.pop(doc_id, None)
+        if entry is None:
+            return
+        self._count(entry[0], entry[1], -1)
+        if self._delta.pop(doc_id, None) is not None:
+            for term in entry[0]:
+                postings = self._delta_postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._delta_postings[term]
+        else:
+            self._alive[self._main.col_of[doc_id]] = False
+            self._dead += 1
+
+    def _touch(self, doc_id: int):
+        self._version += 1
+        self._touched[doc_id] = self._version
+        self._layout = None
+
+    def compact(self, lock) -> None:
+        """Dựng lại phần chính ngoài khóa khi delta đủ lớn; câu hỏi vẫn chạy trên bản cũ."""
+        with lock:
+            if self._compacting or len(self._touched) < max(self.DELTA_MIN_DOCS, self.DELTA_RATIO * len(self._tf)):
+                return
+            self._compacting = True
+            base = self._main
+            docs, intents, version = dict(self._tf), dict(self._intent), self._version
+        try:
+            main = _Segment(docs, intents)
+            with lock:
+                # load() chạy xen giữa thì bản vừa dựng đã cũ
+                if self._main is base:
+                    self._install(main, version)
+        finally:
+            self._compacting = False
+
+    def _install(self, main: _Segment, version: int):
+        """Thay phần chính bằng bản dựng tại version; những gì đổi sau đó vào delta."""
+        self._touched = {doc_id: v for doc_id, v in self._touched.items() if v > version}
+        self._main = main
+        self._alive = np.ones(len(main.doc_ids), dtype=bool)
+        self._delta = {}
+        self._delta_postings = {}
+        for doc_id in self._touched:
+            col = main.col_of.get(doc_id)
+            if col is not None:
+                self._alive[col] = False
+            entry = self._tf.get(doc_id)
+            if entry is not None:
+                self._delta[doc_id] = entry
+                for term, count in entry[0].items():
+                    self._delta_postings.setdefault(term, {})[doc_id] = count
+        self._dead = int(len(self._alive) - np.count_nonzero(self._alive))
+        self._layout = None
+
+    # ---------- ma trận ----------
+
+    def _columns(self) -> tuple:
+        """
+        Cột = doc id tăng dần của phần chính và delta trộn lại (bằng điểm thì id
+        nhỏ trước). Tính lại (vector hoá, không dựng ma trận) sau mỗi lần đổi.
+        """
+        if self._layout is None:
+            main_ids = self._main.doc_ids
+            delta_ids = np.fromiter(sorted(self._delta), dtype=np.int64, count=len(self._delta))
+            pos = np.searchsorted(main_ids, delta_ids)
+            delta_cols = pos + np.arange(len(delta_ids))
+            main_cols = np.arange(len(main_ids)) + np.searchsorted(pos, np.arange(len(main_ids)), side="right")
+            col_ids = np.empty(len(main_ids) + len(delta_ids), dtype=np.int64)
+            col_ids[main_cols] = main_ids
+            col_ids[delta_cols] = delta_ids
+            self._layout = (col_ids, main_cols, dict(zip(delta_ids.tolist(), delta_cols.tolist())))
+        return self._layout
+
+    def _cells(self, terms: Iterable[str]) -> tuple:
+        """
+        (vocab, hàng, cột, trọng số) của mọi ô khác 0 chỉ của các term cho trước,
+        trên cột của _columns(); trọng số BM25 tính từ tf thô với idf / avgdl
+        hiện tại. Ô của delta nằm cuối, chưa xếp theo hàng.
+        """
+        _, main_cols, delta_cols = self._columns()
+        main = self._main
+        n_docs = len(self._tf)
+        avgdl = max(self._total_len / n_docs, 1e-9) if n_docs else 1.0
+
+        vocab: Dict[str, int] = {}
+        dfs: List[int] = []
+        main_rows: List[int] = []
+        for term in terms:
+            df = self._df.get(term)
+            if df is None or term in vocab:
+                continue
+            vocab[term] = len(vocab)
+            dfs.append(df)
+            main_rows.append(main.vocab.get(term, -1))
+
+        # ô của phần chính: vị trí các ô của những hàng cần lấy, bỏ cột chết
+        rows = np.asarray(main_rows, dtype=np.int64)
+        present = np.flatnonzero(rows >= 0)
+        starts = main.indptr[rows[present]]
+        lens = main.indptr[rows[present] + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(lens.sum())
+        cell_rows = np.repeat(present, lens)
+        cols = main.indices[offsets]
+        tf = main.tf[offsets]
+        lengths = main.cell_lengths[offsets]
+        if self._dead:
+            keep = self._alive[cols]
+            cell_rows, cols, tf, lengths = cell_rows[keep], cols[keep], tf[keep], lengths[keep]
+        cols = main_cols[cols]
+
+        # ô của delta (ít document)
+        extra: List[tuple] = []
+        if self._delta_postings:
+            for term, row in vocab.items():
+                for doc_id, count in self._delta_postings.get(term, {}).items():
+                    extra.append((row, delta_cols[doc_id], count, self._delta[doc_id][1]))
+        if extra:
+            more = np.asarray(extra, dtype=np.float64)
+            cell_rows = np.concatenate((cell_rows, more[:, 0].astype(np.int64)))
+            cols = np.concatenate((cols, more[:, 1].astype(np.int64)))
+            tf = np.concatenate((tf, more[:, 2].astype(np.float32)))
+            lengths = np.concatenate((lengths, more[:, 3].astype(np.float32)))
+
+        df = np.asarray(dfs, dtype=np.float64)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = np.float32(self.k1 * (1 - self.b)) + lengths * np.float32(self.k1 * self.b / avgdl)
+        data = idf[cell_rows] * tf * np.float32(self.k1 + 1) / (tf + norm)
+        return vocab, cell_rows, cols, data
+
+    def _matrix(self, terms: Iterable[str]) -> tuple:
+        """CSR (vocab, indptr, indices, data) chỉ gồm các term của lô."""
+        vocab, cell_rows, cols, data = self._cells(terms)
+        if self._delta_postings:
+            order = np.argsort(cell_rows, kind="stable")
+            cell_rows, cols, data = cell_rows[order], cols[order], data[order]
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell_rows, minlength=len(vocab)), out=indptr[1:])
+        return vocab, indptr, cols, data
+
+    def _intent_columns(self, intents: Iterable[str]) -> Dict[str, np.ndarray]:
+        _, main_cols, delta_cols = self._columns()
+        out: Dict[str, np.ndarray] = {}
+        for intent in intents:
+            cols = self._main.intent_cols.get(intent)
+            if cols is not None and self._dead:
+                cols = cols[self._alive[cols]]
+            extra = [col for doc_id, col in delta_cols.items() if self._intent.get(doc_id) == intent]
+            if cols is None and not extra:
+                continue
+            cols = main_cols[cols] if cols is not None else np.zeros(0, dtype=np.int64)
+            out[intent] = np.concatenate((cols, np.asarray(extra, dtype=np.int64)))
+        return out
+
+    # ---------- query ----------
+
+    def score_vector(self, tokens: Terms, intents: Set[str]) -> np.ndarray:
+        """Điểm của mọi document (theo cột của _columns()) trong một lần bincount."""
+        weights = term_weights(tokens)
+        vocab, cell_rows, cols, data = self._cells(weights)
+        reps = np.fromiter((weights[term] for term in vocab), dtype=np.float32, count=len(vocab))
+        # ô rỗng thì bincount trả int64 -> ép về float để cộng điểm intent
+        scores = np.bincount(cols, weights=data * reps[cell_rows], minlength=len(self._columns()[0]))
+        scores = scores.astype(np.float64, copy=False)
+        for cols in self._intent_columns(intents).values():
+            scores[cols] += self.intent_boost
+        return scores
+
+    def scores(self, tokens: Terms, intents: Set[str]) -> Dict[int, float]:
+        vector = self.score_vector(tokens, intents)
+        hits = np.flatnonzero(vector > 0)
+        return dict(zip(self._columns()[0][hits].tolist(), vector[hits].tolist()))
+
+    def top_k_many(self, queries: Sequence[Query], k: int) -> List[List[tuple[float, int]]]:
+        """Cả lô trong vài phép toán ma trận thay vì score_vector từng câu."""
+        terms = {w for tokens, _ in queries for w in term_weights(tokens)}
+        intents = set().union(*(intents for _, intents in queries))
+        vocab, indptr, indices, data = self._matrix(terms)
+        return top_k_csr(
+            queries, k, vocab, indptr, indices, data,
+            self._columns()[0], self._intent_columns(intents), self.intent_boost,
+        )
@@ -0,0 +1,57 @@
+"""
+Cấu hình chung cho test: mọi test dùng một DB SQLite tạm (đặt DATABASE_URL
+trước khi import module nào của backend) và một app FastAPI đã chạy lifespan.
+
+Chạy từ thư mục backend:  python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='chatbot-test-')}/test.db"
+
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+from db import Knowledge, User, get_session
+
+
+def add_user(username: str, is_admin: bool = False) -> dict:
+    with get_session() as db:
+        db.add(User(
+            username=username, email=f"{username}@test.local",
+            hashed_password=auth.hash_password("pw123456"),
+            is_admin=is_admin, is_active=True,
+        ))
+    return {"Authorization": "Bearer " + auth.create_access_token({"sub": username})}
+
+
+@pytest.fixture(scope="session")
+def app():
+    import main
+
+    with get_session() as db:
+        db.add(Knowledge(
+            title="Lỗi đăng nhập", content="Xóa cache rồi đăng nhập lại.",
+            keywords="login,đăng nhập", intent="login_issue",
+        ))
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    with TestClient(app.app) as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+def admin(app) -> dict:
+    return add_user("admin_test", is_admin=True)
+
+
+@pytest.fixture(scope="session")
+def bob(app) -> dict:
+    return add_user("bob_test")
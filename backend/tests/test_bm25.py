@@ -0,0 +1,70 @@
+"""BM25Scorer: delta + gộp phải cho đúng điểm như dựng lại, và không dựng lại trong câu hỏi."""
+import random
+import statistics
+import time
+
+from benchmarks.synthetic import make_docs, make_questions
+from rag import KnowledgeDoc, KnowledgeIndex, make_scorer, tokenize
+
+
+def edited(doc: KnowledgeDoc, suffix: str, intent) -> KnowledgeDoc:
+    return KnowledgeDoc(doc.id, doc.title, doc.content + " " + suffix, doc.keywords, intent)
+
+
+def assert_same_as_rebuild(index: KnowledgeIndex, questions):
+    fresh = KnowledgeIndex(make_scorer("bm25"))
+    fresh.load(list(index.docs.values()))
+    for tokens in questions:
+        got = index.scorer.scores(tokens, {"report"})
+        want = fresh.scorer.scores(tokens, {"report"})
+        assert got.keys() == want.keys()
+        for doc_id, score in want.items():
+            assert abs(got[doc_id] - score) <= 1e-4 * max(1.0, score)
+        queries = [(tokens, {"report"})]
+        assert index.scorer.top_k_many(queries, 5) == fresh.scorer.top_k_many(queries, 5)
+
+
+def test_edits_and_compaction_match_full_rebuild():
+    docs = make_docs(2000)
+    questions = [tokenize(q) for q in make_questions(50)]
+    index = KnowledgeIndex(make_scorer("bm25"))
+    index.scorer.DELTA_MIN_DOCS = 40  # gộp vài lần trong test
+    index.load(docs)
+
+    rnd = random.Random(0)
+    next_id = max(d.id for d in docs) + 1
+    for i in range(300):
+        r = rnd.random()
+        if r < 0.6:
+            doc = docs[rnd.randrange(len(docs))]
+            index.apply([edited(doc, f"sửa{i % 7}", rnd.choice([doc.intent, None, "report"]))], ())
+        elif r < 0.8:
+            doc = docs[rnd.randrange(len(docs))]
+            index.apply([KnowledgeDoc(next_id, doc.title, doc.content, doc.keywords, doc.intent)], ())
+            next_id += 1
+        else:
+            index.apply((), [rnd.choice(list(index.docs))])
+        if i % 50 == 0:
+            assert_same_as_rebuild(index, questions[:10])
+
+    assert_same_as_rebuild(index, questions)
+
+
+def test_query_after_apply_does_not_rebuild():
+    docs = make_docs(10000)
+    questions = [tokenize(q) for q in make_questions(60)]
+    index = KnowledgeIndex(make_scorer("bm25"))
+    index.load(docs)
+
+    def timed(tokens) -> float:
+        start = time.perf_counter()
+        index.top_k(tokens, set(), 3)
+        return time.perf_counter() - start
+
+    warm = statistics.median(timed(tokens) for tokens in questions[:30])
+    worst = 0.0
+    for i, tokens in enumerate(questions[30:]):
+        index.apply([edited(docs[i * 97], "cập nhật", docs[i * 97].intent)], ())
+        worst = max(worst, timed(tokens))
+    # dựng lại ma trận (cách cũ) mất cỡ trăm lần một câu hỏi ấm
+    assert worst < 10 * warm + 0.05
@@ -0,0 +1,54 @@
+"""Cấp id hội thoại và kiểm tra chủ hội thoại khi lịch sử chưa flush."""
+import threading
+
+from db import IdBlockAllocator, get_session, init_db
+
+
+def test_follow_up_before_flush_keeps_conversation(app, client, admin, bob, monkeypatch):
+    writer = app.history_writer
+    # như worker khác: lượt đầu còn nằm trong buffer của worker đã nhận nó
+    monkeypatch.setattr(writer, "flush", lambda *a, **kw: True)
+    monkeypatch.setattr(writer, "wait_user", lambda *a, **kw: False)
+    monkeypatch.setattr(writer, "has_pending", lambda uid: False)
+
+    cid = client.post("/chat", json={"message": "lỗi đăng nhập"}, headers=admin).json()["conversation_id"]
+    app.conversation_owners.clear()
+    follow = client.post("/chat", json={"message": "vẫn lỗi", "conversation_id": cid}, headers=admin)
+    assert follow.status_code == 200
+    assert follow.json()["conversation_id"] == cid
+
+    # id chưa từng cấp vẫn là hội thoại mới
+    ghost = client.post("/chat", json={"message": "x", "conversation_id": 10 ** 9}, headers=admin)
+    assert ghost.json()["conversation_id"] != 10 ** 9
+
+    monkeypatch.undo()
+    writer.flush()
+    app.conversation_owners.clear()
+    # đã ghi: người khác không chen được vào hội thoại
+    other = client.post("/chat", json={"message": "x", "conversation_id": cid}, headers=bob)
+    assert other.json()["conversation_id"] != cid
+
+
+def test_allocator_unique_across_workers():
+    init_db()
+    # hai allocator cùng tên = hai worker dùng chung id_sequence
+    workers = [IdBlockAllocator("test_ids", 7, lambda db: 1) for _ in range(2)]
+    out = []
+    lock = threading.Lock()
+
+    def work(allocator):
+        ids = [allocator.allocate() for _ in range(50)]
+        with lock:
+            out.extend(ids)
+
+    threads = [threading.Thread(target=work, args=(workers[i % 2],)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(out) == 400
+    assert len(set(out)) == 400
+    with get_session() as db:
+        assert all(workers[0].issued(db, value) for value in out)
+        assert not workers[0].issued(db, max(out) + 100)
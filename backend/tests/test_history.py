@@ -0,0 +1,65 @@
+"""HistoryWriter: read-your-writes, giới hạn hàng đợi và lô ghi lỗi."""
+import logging
+
+import pytest
+
+import history
+from db import ChatHistory, get_session, init_db
+from history import HistoryWriter
+
+
+def count_rows(conversation_id: int) -> int:
+    with get_session() as db:
+        return db.query(ChatHistory).filter(ChatHistory.conversation_id == conversation_id).count()
+
+
+@pytest.fixture
+def writer():
+    init_db()
+    w = HistoryWriter(batch_size=10, flush_interval=60, max_pending=20, submit_timeout=0.1, max_retries=2)
+    yield w
+    w.stop()
+
+
+def test_wait_user_reads_own_writes(writer):
+    writer.start()
+    assert writer.try_submit(9001, 501, "hỏi", "đáp")
+    assert writer.has_pending(501)
+    # chu kỳ flush 60 s: wait_user phải tự đẩy lô xuống DB
+    assert writer.wait_user(501, 5)
+    assert not writer.has_pending(501)
+    assert count_rows(9001) == 1
+
+
+def test_bad_row_is_dropped_not_retried_forever(writer, caplog):
+    caplog.set_level(logging.CRITICAL)
+    for i in range(9):
+        writer.try_submit(9002, 502, f"hỏi {i}", "đáp")
+    writer.try_submit(9002, 502, None, "đáp")  # question NOT NULL -> dòng hỏng
+
+    assert not writer.flush()
+    assert writer.flush()
+    assert count_rows(9002) == 9
+    assert writer.dropped_rows == 1
+    assert not writer.has_pending(502)
+
+
+def test_outage_requeues_within_max_pending(writer, monkeypatch, caplog):
+    caplog.set_level(logging.CRITICAL)
+
+    def down():
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(history, "get_session", down)
+    accepted = sum(writer.try_submit(9003, 503, "hỏi", "đáp") for _ in range(30))
+    assert accepted == writer.max_pending
+    for _ in range(4):
+        assert not writer.flush()
+    # lô trả về đầu hàng đợi, không vượt giới hạn, không bỏ dòng nào
+    assert len(writer._buffer) == writer.max_pending
+    assert not writer.try_submit(9003, 503, "hỏi", "đáp")
+    assert writer.dropped_rows == 0
+
+    monkeypatch.undo()
+    assert writer.flush()
+    assert count_rows(9003) == writer.max_pending
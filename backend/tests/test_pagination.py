@@ -0,0 +1,48 @@
+"""Phân trang keyset: cursor hợp lệ đi tiếp được, cursor hỏng trả 400 thay vì 500."""
+import base64
+import json
+
+import pytest
+
+
+def cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+@pytest.fixture(scope="module")
+def conversations(app, client, admin):
+    for i in range(4):
+        client.post("/chat", json={"message": f"lỗi đăng nhập {i}"}, headers=admin)
+    app.history_writer.flush()
+    return client.get("/chat/conversations?limit=2", headers=admin).json()
+
+
+def test_conversation_pages(client, admin, conversations):
+    assert len(conversations["items"]) == 2
+    page = client.get("/chat/conversations?limit=2&cursor=" + conversations["next_cursor"], headers=admin)
+    assert page.status_code == 200
+    seen = {c["id"] for c in conversations["items"]}
+    assert seen.isdisjoint(c["id"] for c in page.json()["items"])
+
+
+@pytest.mark.parametrize("bad", [
+    "!!!",
+    cursor(["x", "x", 1]),
+    cursor([True, "2024-01-01T00:00:00", "x"]),
+    cursor([1, "2024-01-01", 1]),
+    cursor([True, 5, 1]),
+])
+def test_bad_conversation_cursor(client, admin, bad):
+    assert client.get("/chat/conversations?cursor=" + bad, headers=admin).status_code == 400
+
+
+def test_message_cursor(client, admin, conversations):
+    url = f"/chat/conversations/{conversations['items'][0]['id']}/messages?before="
+    for bad in (cursor(["x", 1]), cursor(["2024-01-01T00:00:00", "1"]), cursor([None, 1])):
+        assert client.get(url + bad, headers=admin).status_code == 400
+    assert client.get(url + cursor(["2099-01-01T00:00:00", 1]), headers=admin).status_code == 200
+
+
+def test_knowledge_cursor(client, admin):
+    assert client.get("/admin/knowledge?cursor=" + cursor(["1"]), headers=admin).status_code == 400
+    assert client.get("/admin/knowledge?cursor=" + cursor([0]), headers=admin).status_code == 200
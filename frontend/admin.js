@@ -133,9 +133,19 @@ function logout() {
 
 const AdminUI = {
   selectedId: null,
+  query: "",
+  next: null,
+  searchTimer: null,
+
+  // danh sách rút gọn theo trang; q = tìm trên server
+  async loadList(more = false) {
+    const params = new URLSearchParams({ limit: 50 });
+    if (this.query) params.set("q", this.query);
+    if (more && this.next) {
+      for (const [k, v] of Object.entries(this.next)) params.set(k, v);
+    }
 
-  async loadList() {
-    const res = await fetch(`${API}/admin/knowledge`, {
+    const res = await fetch(`${API}/admin/knowledge?${params}`, {
       headers: { Authorization: `Bearer ${getToken()}` }
     });
 
@@ -143,26 +153,50 @@ const AdminUI = {
 
     const data = await res.json();
     const list = document.getElementById("knowledge-list");
-    list.innerHTML = "";
+    if (!more) list.innerHTML = "";
 
-    if (!data.length) {
-      list.innerHTML = "<p style='opacity:.6'>Chưa có dữ liệu</p>";
+    if (data.next_cursor) this.next = { cursor: data.next_cursor };
+    else if (data.next_offset !== null) this.next = { offset: data.next_offset };
+    else this.next = null;
+    document.getElementById("btn-more-knowledge").style.display = this.next ? "block" : "none";
+
+    if (!more && !data.items.length) {
+      list.innerHTML = this.query
+        ? "<p style='opacity:.6'>Không tìm thấy</p>"
+        : "<p style='opacity:.6'>Chưa có dữ liệu</p>";
       return;
     }
 
-    data.forEach(k => {
+    data.items.forEach(k => {
       const div = document.createElement("div");
       div.className = "knowledge-item";
-      div.innerText = k.title;
-      div.onclick = () => this.select(k);
+      div.innerText = k.title || `#${k.id}`;
+      div.title = k.snippet || `${k.content_length} ký tự`;
+      div.onclick = () => this.select(k.id);
       list.appendChild(div);
     });
   },
 
-  select(k) {
+  search(value) {
+    clearTimeout(this.searchTimer);
+    this.searchTimer = setTimeout(() => {
+      this.query = value.trim();
+      this.next = null;
+      this.loadList();
+    }, 300);
+  },
+
+  // content đầy đủ chỉ tải khi chọn
+  async select(id) {
+    const res = await fetch(`${API}/admin/knowledge/${id}`, {
+      headers: { Authorization: `Bearer ${getToken()}` }
+    });
+    if (!res.ok) return alert("Không tải được kiến thức");
+
+    const k = await res.json();
     this.selectedId = k.id;
     document.getElementById("k-id").value = k.id;
-    document.getElementById("k-title").value = k.title;
+    document.getElementById("k-title").value = k.title || "";
     document.getElementById("k-content").value = k.content;
     document.getElementById("k-keywords").value = k.keywords || "";
 
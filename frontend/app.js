@@ -1,4 +1,5 @@
 const API_URL = "http://127.0.0.1:8000/chat";
+const STREAM_API_URL = "http://127.0.0.1:8000/chat/stream";
 const AUTH_API = "http://127.0.0.1:8000/auth";
 const CONVERSATIONS_API = "http://127.0.0.1:8000/chat/conversations";
 
@@ -10,6 +11,13 @@ let skipDeleteConfirm = false;
 /* ===== loading flag để tránh gọi loadConversations nhiều lần ===== */
 let isLoadingConversations = false;
 
+/* ===== phân trang (cursor do server trả về) ===== */
+const MESSAGES_PAGE_SIZE = 50;
+let conversationsCursor = null;
+let isLoadingMoreConversations = false;
+let messagesCursor = null;
+let isLoadingOlderMessages = false;
+
 /* ================= UTIL ================= */
 
 function getAuthHeaders() {
@@ -61,15 +69,50 @@ function timeAgo(isoTime) {
 
 /* ================= CHAT ================= */
 
-function appendMessage(text, sender = "bot") {
-  const messages = document.getElementById("messages");
+function setMessageText(el, text) {
+  el.innerHTML = String(text).replace(/\n/g, "<br>");
+}
+
+function createMessageEl(text, sender = "bot") {
   const div = document.createElement("div");
   div.className = sender;
-  div.innerHTML = String(text).replace(/\n/g, "<br>");
-  messages.appendChild(div);
+  setMessageText(div, text);
+  return div;
+}
+
+function appendMessage(text, sender = "bot") {
+  const messages = document.getElementById("messages");
+  messages.appendChild(createMessageEl(text, sender));
   messages.scrollTop = messages.scrollHeight;
 }
 
+/* ===== đọc Server-Sent Events từ fetch (EventSource chỉ hỗ trợ GET) ===== */
+async function readEvents(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
 async function send() {
   const input = document.getElementById("input");
   const msg = input.value.trim();
@@ -81,7 +124,7 @@ async function send() {
   document.getElementById("typing").classList.remove("hidden");
 
   try {
-    const res = await fetch(API_URL, {
+    const res = await fetch(STREAM_API_URL, {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
@@ -110,13 +153,36 @@ async function send() {
       return;
     }
 
-    const data = await res.json();
-    document.getElementById("typing").classList.add("hidden");
+    // hiện câu trả lời dần theo từng chunk thay vì chờ cả bài
+    const messages = document.getElementById("messages");
+    let botEl = null;
+    let answer = "";
+    let result = null;
+
+    await readEvents(res, (event, data) => {
+      if (event === "meta") {
+        if (!data.guest) currentConversationId = data.conversation_id;
+      } else if (event === "chunk") {
+        if (!botEl) {
+          document.getElementById("typing").classList.add("hidden");
+          botEl = createMessageEl("", "bot");
+          messages.appendChild(botEl);
+        }
+        answer += data.text;
+        setMessageText(botEl, answer);
+        messages.scrollTop = messages.scrollHeight;
+      } else if (event === "done") {
+        result = data;
+      } else if (event === "error") {
+        alert(data.detail || "Lỗi khi gửi tin nhắn");
+      }
+    });
 
-    appendMessage(data.answer, "bot");
+    document.getElementById("typing").classList.add("hidden");
 
-    if (!data.guest) {
-      currentConversationId = data.conversation_id;
+    if (!result) return;
+    if (!result.guest) {
+      // done đến sau khi lượt chat đã lưu -> sidebar đọc được hội thoại mới
       await loadConversations();
     } else {
       document.getElementById("login-hint").classList.remove("hidden");
@@ -129,6 +195,7 @@ async function send() {
 
 function newConversation() {
   currentConversationId = null;
+  messagesCursor = null;
   document.getElementById("messages").innerHTML =
     `<div class="bot">Xin chào 👋 Tôi có thể giúp bạn về CNTT.</div>`;
 }
@@ -165,6 +232,67 @@ async function togglePin(convo) {
   }
 }
 
+function renderConversationItem(c) {
+  const item = document.createElement("div");
+  item.className =
+    "conversation-item " + (currentConversationId === c.id ? "active" : "");
+  item.dataset.convId = c.id;
+  
+  item.onclick = function(e) {
+    const target = e.target;
+    if (target.closest(".pin-star") || target.closest(".delete-conv-btn")) {
+      return;
+    }
+    loadConversation(c.id);
+  };
+
+  const row = document.createElement("div");
+  row.className = "conv-row";
+
+  /* LEFT: STAR + TITLE */
+  const left = document.createElement("div");
+  left.className = "conv-left";
+
+  const star = document.createElement("span");
+  star.className = "pin-star" + (c.is_pinned ? " pinned" : "");
+  star.innerText = "⭐";
+  star.title = c.is_pinned ? "Bỏ ghim" : "Ghim";
+  star.onclick = function(e) {
+    e.stopPropagation();
+    e.preventDefault();
+    togglePin(c);
+  };
+
+  const title = document.createElement("b");
+  title.innerText = c.title || "Cuộc hội thoại";
+
+  left.appendChild(star);
+  left.appendChild(title);
+
+  /* DELETE */
+  const delBtn = document.createElement("button");
+  delBtn.className = "delete-conv-btn";
+  delBtn.innerText = "🗑️";
+  delBtn.title = "Xóa hội thoại";
+  delBtn.onclick = function(e) {
+    e.stopPropagation();
+    e.preventDefault();
+    confirmDeleteConversation(c.id);
+  };
+
+  row.appendChild(left);
+  row.appendChild(delBtn);
+
+  const meta = document.createElement("small");
+  meta.innerText =
+    `${c.message_count} tin nhắn · ${timeAgo(c.last_message_at)}`;
+
+  item.appendChild(row);
+  item.appendChild(meta);
+
+  return item;
+}
+
 async function loadConversations(search = "", retryCount = 0) {
   // Tránh gọi nhiều lần cùng lúc
   if (isLoadingConversations && retryCount === 0) {
@@ -235,7 +363,7 @@ async function loadConversations(search = "", retryCount = 0) {
 
     const data = await res.json();
 
-    if (!Array.isArray(data)) {
+    if (!data || !Array.isArray(data.items)) {
       list.innerHTML = `
         <div style="opacity:.6; padding:10px; text-align:center; color: #ef4444;">
           Dữ liệu không hợp lệ
@@ -245,8 +373,9 @@ async function loadConversations(search = "", retryCount = 0) {
     }
 
     list.innerHTML = "";
+    conversationsCursor = data.next_cursor || null;
 
-    if (data.length === 0) {
+    if (data.items.length === 0) {
       list.innerHTML = `
         <div style="opacity:.6; padding:10px; text-align:center;">
           Chưa có cuộc hội thoại nào
@@ -255,66 +384,7 @@ async function loadConversations(search = "", retryCount = 0) {
       return;
     }
 
-    data.forEach(c => {
-      const item = document.createElement("div");
-      item.className =
-        "conversation-item " + (currentConversationId === c.id ? "active" : "");
-      item.dataset.convId = c.id;
-      
-      item.onclick = function(e) {
-        const target = e.target;
-        if (target.closest(".pin-star") || target.closest(".delete-conv-btn")) {
-          return;
-        }
-        loadConversation(c.id);
-      };
-
-      const row = document.createElement("div");
-      row.className = "conv-row";
-
-      /* LEFT: STAR + TITLE */
-      const left = document.createElement("div");
-      left.className = "conv-left";
-
-      const star = document.createElement("span");
-      star.className = "pin-star" + (c.is_pinned ? " pinned" : "");
-      star.innerText = "⭐";
-      star.title = c.is_pinned ? "Bỏ ghim" : "Ghim";
-      star.onclick = function(e) {
-        e.stopPropagation();
-        e.preventDefault();
-        togglePin(c);
-      };
-
-      const title = document.createElement("b");
-      title.innerText = c.title || "Cuộc hội thoại";
-
-      left.appendChild(star);
-      left.appendChild(title);
-
-      /* DELETE */
-      const delBtn = document.createElement("button");
-      delBtn.className = "delete-conv-btn";
-      delBtn.innerText = "🗑️";
-      delBtn.title = "Xóa hội thoại";
-      delBtn.onclick = function(e) {
-        e.stopPropagation();
-        e.preventDefault();
-        confirmDeleteConversation(c.id);
-      };
-
-      row.appendChild(left);
-      row.appendChild(delBtn);
-
-      const meta = document.createElement("small");
-      meta.innerText =
-        `${c.message_count} tin nhắn · ${timeAgo(c.last_message_at)}`;
-
-      item.appendChild(row);
-      item.appendChild(meta);
-
-      list.appendChild(item);
-    });
+    data.items.forEach(c => list.appendChild(renderConversationItem(c)));
     
     isLoadingConversations = false;
   } catch (error) {
@@ -343,6 +413,30 @@ async function loadConversations(search = "", retryCount = 0) {
   }
 }
 
+/* ===== tải thêm hội thoại khi cuộn tới cuối sidebar ===== */
+async function loadMoreConversations() {
+  if (!conversationsCursor || isLoadingMoreConversations || isLoadingConversations) return;
+
+  isLoadingMoreConversations = true;
+  const list = document.getElementById("conversations-list");
+
+  try {
+    const res = await fetch(
+      `${CONVERSATIONS_API}?cursor=${encodeURIComponent(conversationsCursor)}`,
+      { headers: getAuthHeaders() }
+    );
+    if (!res.ok) return;
+
+    const data = await res.json();
+    conversationsCursor = data.next_cursor || null;
+    (data.items || []).forEach(c => list.appendChild(renderConversationItem(c)));
+  } catch (error) {
+    // lần cuộn sau sẽ thử lại
+  } finally {
+    isLoadingMoreConversations = false;
+  }
+}
+
 async function loadConversation(id) {
   if (!id || isNaN(id)) {
     return;
@@ -350,7 +444,7 @@ async function loadConversation(id) {
   
   try {
     const res = await fetch(
-      `${CONVERSATIONS_API}/${id}/messages`,
+      `${CONVERSATIONS_API}/${id}/messages?limit=${MESSAGES_PAGE_SIZE}`,
       { headers: getAuthHeaders() }
     );
     
@@ -367,14 +461,16 @@ async function loadConversation(id) {
       return;
     }
 
-    const messages = await res.json();
+    const data = await res.json();
     
-    if (!Array.isArray(messages)) {
+    if (!data || !Array.isArray(data.items)) {
       alert("Dữ liệu không hợp lệ");
       return;
     }
 
+    const messages = data.items;
     currentConversationId = id;
+    messagesCursor = data.next_cursor || null;
     const box = document.getElementById("messages");
     if (!box) return;
     
@@ -398,6 +494,41 @@ async function loadConversation(id) {
   }
 }
 
+/* ===== tải tin nhắn cũ hơn khi cuộn lên đầu khung chat ===== */
+async function loadOlderMessages() {
+  if (!messagesCursor || !currentConversationId || isLoadingOlderMessages) return;
+
+  isLoadingOlderMessages = true;
+  const convId = currentConversationId;
+  const box = document.getElementById("messages");
+
+  try {
+    const res = await fetch(
+      `${CONVERSATIONS_API}/${convId}/messages?limit=${MESSAGES_PAGE_SIZE}` +
+        `&before=${encodeURIComponent(messagesCursor)}`,
+      { headers: getAuthHeaders() }
+    );
+    if (!res.ok || convId !== currentConversationId) return;
+
+    const data = await res.json();
+    messagesCursor = data.next_cursor || null;
+
+    // chèn lên đầu nhưng giữ nguyên vị trí đang đọc
+    const prevHeight = box.scrollHeight;
+    const fragment = document.createDocumentFragment();
+    (data.items || []).forEach(m => {
+      fragment.appendChild(createMessageEl(m.question, "user"));
+      fragment.appendChild(createMessageEl(m.answer, "bot"));
+    });
+    box.insertBefore(fragment, box.firstChild);
+    box.scrollTop += box.scrollHeight - prevHeight;
+  } catch (error) {
+    // lần cuộn sau sẽ thử lại
+  } finally {
+    isLoadingOlderMessages = false;
+  }
+}
+
 /* ===== delete conversation ===== */
 
 function confirmDeleteConversation(id) {
@@ -560,6 +691,22 @@ window.addEventListener("DOMContentLoaded", async () => {
   // Load conversations khi trang load - đảm bảo luôn được gọi
   await loadConversations();
   
+  // Cuộn: tải thêm hội thoại / tin nhắn cũ theo trang
+  document.querySelector(".sidebar-history")
+    ?.addEventListener("scroll", e => {
+      const el = e.target;
+      if (el.scrollTop + el.clientHeight >= el.scrollHeight - 40) {
+        loadMoreConversations();
+      }
+    });
+
+  document.getElementById("messages")
+    ?.addEventListener("scroll", e => {
+      if (e.target.scrollTop < 40) {
+        loadOlderMessages();
+      }
+    });
+
   // Enter key cho input chat
   const chatInput = document.getElementById("input");
   if (chatInput) {